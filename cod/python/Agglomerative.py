@@ -4,118 +4,221 @@
 @author: sofiabocker
 """
 
-import matplotlib.pyplot as plt
-from sklearn.cluster import AgglomerativeClustering
-from sklearn.metrics import silhouette_score
-import seaborn as sns
-import pandas as pd
+import numpy as np
 
-from sklearn.datasets import load_iris, load_digits, load_wine, load_breast_cancer, load_diabetes, load_linnerud
+from silueta import PRESUPUESTO
+from base import MetodoBase
+from seleccion import seleccionar_k
+from instrumentacion import fase, instrumentado
+from cargadores import lotes as iterar_lotes
 
-class MetodoAgglomerative():
+# Cantidad de filas a partir de la cual compresion = 'auto' usa BIRCH
+MAX_N_EXACTO = 20000
+
+def _cortar_arbol(arbol, cluster):
+    '''Obtiene las etiquetas de las hojas deshaciendo las últimas uniones del árbol.'''
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
     
-    # Constructor
-    def __init__(self, df):
-        '''
-        Inicializa un objeto de la clase con los parámetros dados.
+    n = len(arbol) + 1
     
-        Parameters
-        ----------
-        df : pd.DataFrame
-            Dataset de sklearn.datasets al que se le va a aplicar el método
+    # Unir cada hijo con su nodo padre en las primeras n - cluster uniones
+    uniones = n - cluster
+    hijos = arbol[:uniones, :2].astype(np.intp)
+    padres = np.arange(n, n + uniones)
+    filas = np.concatenate([hijos[:, 0], hijos[:, 1]])
+    columnas = np.concatenate([padres, padres])
+    grafo = coo_matrix((np.ones(len(filas)), (filas, columnas)), shape = (n + uniones, n + uniones))
     
-        Returns
-        -------
-        None
-        '''
-        self.__df = df
+    _, componentes = connected_components(grafo, directed = False)
+    _, etiquetas = np.unique(componentes[:n], return_inverse = True)
+    return etiquetas
+
+def _umbral_birch(muestra, objetivo, tamano_consulta = 1000, random_state = 0):
+    '''Estima el umbral de BIRCH para que la muestra quede en unos objetivo subclusters.
+
+    Cada subcluster debería juntar unas m / objetivo filas de la muestra, así que
+    el umbral sale de la mediana de la distancia a ese vecino en una submuestra
+    de consultas, pasada del radio de la bola al radio cuadrático medio que usa
+    BIRCH. Cómo crece esa distancia al doblar los vecinos da la dimensión
+    efectiva de los datos, con la que después se corrige el umbral.
+    '''
+    from sklearn.neighbors import NearestNeighbors
     
-    # Get
-    @property
-    def df(self):
-        '''
-        Obtiene el Dataset de sklearn.datasets en el que se va a trabajar
+    m, d = muestra.shape
+    k = int(min(max(np.ceil(m / objetivo), 1), (m - 1) // 2))
+    if k < 1:
+        return 0.0, float(d)
+    generador = np.random.default_rng(random_state)
+    consultas = muestra[generador.choice(m, min(m, tamano_consulta), replace = False)]
+    distancias = NearestNeighbors(n_neighbors = 2 * k + 1).fit(muestra).kneighbors(consultas)[0]
+    # La columna 0 es el propio punto
+    radio, radio_doble = np.median(distancias[:, k]), np.median(distancias[:, 2 * k])
+    dimension = np.log(2) / np.log(radio_doble / radio) if radio_doble > radio > 0 else d
+    return radio * np.sqrt(d / (d + 2)), float(np.clip(dimension, 1, d))
+
+def _comprimir_birch(X, n_representantes, tamano_lote = 100000, tamano_muestra = 20000, random_state = 0):
+    '''Resume los datos en los subclusters de un árbol CF de BIRCH.
+
+    El umbral se estima con las distancias a los vecinos más cercanos de una
+    muestra (ver _umbral_birch) para que la muestra quede en unos
+    n_representantes / 2 subclusters; se comprueba con un solo ajuste sobre la
+    muestra y, si se aleja del objetivo, se corrige con la dimensión efectiva.
+    Luego el árbol se construye con partial_fit lote a lote y cada fila se
+    asigna a su subcluster más cercano. Si con todos los datos quedan más de
+    n_representantes subclusters, se agrupan con KMeans pesado por la cantidad
+    de filas de cada uno.
+    '''
+    from sklearn.cluster import Birch, KMeans
+    from sklearn.neighbors import NearestNeighbors
     
-        Returns
-        -------
-        df : sklearn.datasets
-            Dataset de sklearn.datasets.
-        '''
-        return self.__df
+    generador = np.random.default_rng(random_state)
+    muestra = np.asarray(X[np.sort(generador.choice(len(X), min(len(X), tamano_muestra), replace = False))],
+                         dtype = float)
+    objetivo = max(n_representantes / 2, 1)
+    umbral, dimension = _umbral_birch(muestra, objetivo, random_state = random_state)
+    if umbral <= 0:
+        # Muchas filas repetidas: se parte de una fracción de la escala de los datos
+        escala = np.sqrt(muestra.var(axis = 0).sum())
+        umbral = 0.01 * escala if escala > 0 else 1.0
+    subclusters = len(Birch(threshold = umbral, n_clusters = None).fit(muestra).subcluster_centers_)
+    if not objetivo / 2 <= subclusters <= objetivo:
+        # La cantidad de subclusters decrece como umbral^-dimension
+        umbral *= (subclusters / objetivo) ** (1 / dimension)
+    
+    lotes = iterar_lotes(X, tamano_lote)
+    birch = Birch(threshold = umbral, n_clusters = None)
+    for lote in lotes():
+        birch.partial_fit(np.asarray(lote, dtype = float))
+    representantes = birch.subcluster_centers_
+    
+    # Asignar cada fila a su subcluster con un índice de vecinos en lugar de Birch.predict
+    indice = NearestNeighbors(n_neighbors = 1).fit(representantes)
+    asignacion = np.concatenate([indice.kneighbors(np.asarray(lote, dtype = float), return_distance = False)[:, 0]
+                                 for lote in lotes()])
+    
+    if len(representantes) > n_representantes:
+        kmeans = KMeans(n_clusters = n_representantes, n_init = 1, random_state = random_state)
+        kmeans.fit(representantes, sample_weight = np.bincount(asignacion, minlength = len(representantes)))
+        representantes, asignacion = kmeans.cluster_centers_, kmeans.labels_[asignacion]
+    return representantes, asignacion.astype(np.intp)
+
+def _grafo_conexo(X, n_vecinos):
+    '''Construye el grafo de k vecinos y une sus componentes con un árbol de expansión mínima.
+
+    Así AgglomerativeClustering no tiene que completarlo calculando distancias
+    entre todos los puntos de componentes distintas.
+    '''
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components, minimum_spanning_tree
+    from sklearn.metrics import pairwise_distances
+    from sklearn.neighbors import kneighbors_graph
     
-    # Set 
-    @df.setter
-    def df(self, nuevo_df):
+    grafo = kneighbors_graph(X, n_vecinos, include_self = False)
+    n_componentes, componentes = connected_components(grafo, directed = False)
+    if n_componentes == 1:
+        return grafo
+    
+    # Un punto por componente: el más cercano a la media de su componente
+    X = np.asarray(X)
+    conteos = np.bincount(componentes)
+    medias = np.column_stack([np.bincount(componentes, weights = X[:, j]) for j in range(X.shape[1])])
+    medias /= conteos[:, None]
+    distancias = ((X - medias[componentes]) ** 2).sum(axis = 1)
+    orden = np.lexsort((distancias, componentes))
+    representantes = orden[np.concatenate([[0], np.cumsum(conteos)[:-1]])]
+    
+    arbol = minimum_spanning_tree(pairwise_distances(X[representantes])).tocoo()
+    filas, columnas = representantes[arbol.row], representantes[arbol.col]
+    uniones = coo_matrix((np.ones(len(filas)), (filas, columnas)), shape = grafo.shape)
+    return (grafo + uniones).tocsr()
+
+class MetodoAgglomerative(MetodoBase):
+    
+    NOMBRE = 'Agglomerative'
+    TITULO = 'Agglomerative'
+    # sklearn solo lo ajusta sobre datos densos
+    DISPERSOS = False
+    
+    # Constructor
+    def __init__(self, df, arbol_unico = True, max_modelos = 8, compresion = None, n_representantes = 5000,
+                 n_vecinos = 10, preprocesamiento = None):
         '''
-        Establece un nuevo dataframe.
+        Inicializa un objeto de la clase con los parámetros dados.
     
         Parameters
         ----------
-        df : sklearn.datasets
-            El nuevo dataset de sklearn.datasets.
+        df : sklearn.datasets o ConjuntoDatos
+            Dataset de sklearn.datasets al que se le va a aplicar el método. Si
+            es un ConjuntoDatos se comparte el árbol con los demás objetos que lo
+            usen con la misma compresión.
+        arbol_unico : bool, default True
+            Si es True se construye el árbol jerárquico una sola vez y todas las
+            cantidades de clusters se obtienen cortándolo.
+        max_modelos : int, default 8
+            Cantidad máxima de modelos ajustados que se guardan en la cache.
+        compresion : {None, 'birch', 'vecinos', 'auto'}, default None
+            Forma de reducir los datos antes de construir el árbol para que no
+            haga falta memoria O(n²). 'birch' construye el árbol sobre los
+            subclusters de un árbol CF de BIRCH y cada fila recibe la etiqueta de
+            su subcluster. 'vecinos' restringe las uniones a un grafo de k vecinos
+            más cercanos. 'auto' usa 'birch' con más de MAX_N_EXACTO filas. Con
+            compresión siempre se usa el árbol único.
+        n_representantes : int, default 5000
+            Cantidad aproximada de subclusters de BIRCH.
+        n_vecinos : int, default 10
+            Cantidad de vecinos del grafo de conectividad.
+        preprocesamiento : preprocesamiento.Preprocesamiento, default None
+            Escalado y reducción de dimensión que se aplican antes del método
+            (ver base.MetodoBase). Si df.data es dispersa hace falta una
+            reducción ('svd' o una proyección aleatoria) que la lleve a una
+            matriz densa de pocas columnas.
     
         Returns
         -------
         None
         '''
-        self.__df = nuevo_df
-    
-    # Str
-    def __str__(self):
-        '''
-        Devuelve una representación de cadena del objeto.
-    
-        Returns
-        -------
-        __str__ : str
-            Una cadena que representa el objeto con los valores actuales de sus atributos.
-        '''
-        return f'DataFrame : {self.__df}'
+        super().__init__(df, max_modelos, preprocesamiento)
+        self.__arbol_unico = arbol_unico
+        self.__compresion = compresion
+        self.__n_representantes = n_representantes
+        self.__n_vecinos = n_vecinos
+        self.__arbol = None
+        self.__asignacion = None
     
     # Métodos
-    def tabla_resumen(self):
-        '''Genera una tabla resumen del dataset de sklearn.datasets con el que se va a trabajar.
-
-        Parameters
-        --------------
-        None
+    def _limpiar(self):
+        super()._limpiar()
+        self.__arbol = None
+        self.__asignacion = None
     
-        Returns
-        -------------
-        resumen: pd.DataFrame
-                Tabla resumen del dataset de sklearn.datasets.
-        '''
-        X, y = self.__df.data, self.__df.target
-        dataset = pd.DataFrame(X, columns = self.__df.feature_names)
-        dataset['target'] = y
-        resumen = dataset.describe()
-        return resumen
-    
-    def clusters(self, cluster):
+    @instrumentado
+    def clusters(self, cluster, como_dataframe = True):
         '''Realiza el clustering con Agglomerative y devuelve el DataFrame con las etiquetas de los clusters.
 
         Parameters
         --------------
-        None
+        cluster : int
+            Número de clusters. Con compresión 'birch' no puede superar la
+            cantidad de representantes; si no, se lanza ValueError.
+        como_dataframe : bool, default True
+            Si es False se devuelve un ResultadoClusters con las etiquetas int32 y
+            una vista de los datos, sin construir el DataFrame.
     
         Returns
         -------------
         dataset : pd.DataFrame
             DataFrame con las etiquetas de los clusters.
         '''
-        # Cargar el dataset
-        X = self.__df.data
-        
         # Encontrar los clusters
-        agglomerative = AgglomerativeClustering(n_clusters = cluster)
-        agglomerative.fit(X)
+        etiquetas = self.__etiquetas(cluster)
         
-        # Convertir a un dataframe
-        dataset = pd.DataFrame(X, columns = self.__df.feature_names)
-        dataset['cluster'] = agglomerative.labels_
-        return dataset
+        # Convertir a un dataframe sin copiar los datos
+        return self._resultado(etiquetas, como_dataframe)
     
-    def graficar(self, cluster):
+    @instrumentado
+    def graficar(self, cluster = None, resultado = None, modo = 'pairplot',
+                 archivo = None, **opciones):
         '''Genera un pairplot del dataset con las etiquetas de los clusters.
 
         Parameters
@@ -124,61 +227,248 @@ class MetodoAgglomerative():
             Número de clusters.
         random : int
             Estado aleatorio para la inicialización de KMeans.
+        resultado : ResultadoClusters, default None
+            Resultado ya calculado para graficar sin volver a hacer el clustering.
+        modo : {'pairplot', 'escalable'}, default 'pairplot'
+            'pairplot' dibuja sns.pairplot con todos los puntos y columnas.
+            'escalable' usa graficos.graficar_escalable: muestra por cluster,
+            columnas más discriminantes o PCA y densidad con hexbin.
+        archivo : str, default None
+            Ruta donde guardar la figura en lugar de mostrarla.
+        **opciones
+            Argumentos adicionales de graficos.graficar_escalable.
     
         Returns
         -------------
         None
         '''
-        dataset = self.clusters(cluster)
-        
-        # Graficar
-        pairplot = sns.pairplot(dataset, hue = 'cluster', palette = 'Accent')
-        pairplot.fig.suptitle(f"Pairplot con Agglomerative Clusters",  y = 1.02)
-        plt.show()
+        if resultado is None:
+            resultado = self.clusters(cluster, como_dataframe = False)
+        self._graficar(resultado, modo, archivo, **opciones)
     
-    def mejor_cluster(self):
+    @instrumentado
+    def mejor_cluster(self, k_values = range(2, 11), modo = 'auto', presupuesto = PRESUPUESTO):
         '''Calcula el silhouette score para diferentes cantidades de clusters
 
         Parameters
         --------------
-        None
+        k_values : iterable of int, default range(2, 11)
+            Cantidades de clusters a evaluar. Se omiten las que superan la
+            cantidad de hojas del árbol.
+        modo : {'auto', 'exacto', 'muestreo'}, default 'auto'
+            Forma de calcular el Silhouette Score (ver silueta.puntaje_silueta).
+        presupuesto : int, default PRESUPUESTO
+            Cantidad máxima de distancias entre pares para el Silhouette Score.
     
         Returns
         -------------
-        None
+        resultados : pd.DataFrame
+            Tabla con la cantidad de clusters y su Silhouette Score.
         '''
-        # Cargar el dataset
-        X = self.__df.data
+        import pandas as pd
         
-        for n_clusters in range(2, 11):
-            agglomerative = AgglomerativeClustering(n_clusters = n_clusters)
-            resultado = agglomerative.fit_predict(X)
-            silueta = silhouette_score(X, resultado)
-            print(f"Cantidad de clusters: {n_clusters}, Silhouette Score: {silueta}")
+        maximo = self.__max_clusters()
+        filas = []
+        for n_clusters in sorted(k_values):
+            if n_clusters > maximo:
+                break
+            resultado = self.__etiquetas(n_clusters)
+            silueta = self._silueta(resultado, modo, presupuesto, k = n_clusters).valor
+            filas.append({'k': n_clusters, 'silhouette': silueta})
         
-        return()
+        return pd.DataFrame(filas, columns = ['k', 'silhouette'])
+    
+    @instrumentado
+    def elegir_k(self, k_min = 2, k_max = 30, criterio = 'silueta', estrategia = 'gruesa_fina', paciencia = 2,
+                 modo = 'auto', presupuesto = PRESUPUESTO, random_state = 0):
+        '''Elige la cantidad de clusters de Agglomerative evaluando pocos k en lugar de toda la grilla.
+
+        Cada k se ajusta una sola vez (los modelos quedan en la cache) y la
+        búsqueda se detiene cuando el criterio deja de mejorar (ver
+        seleccion.buscar_k).
+
+        Parameters
+        --------------
+        k_min : int, default 2
+            Menor cantidad de clusters.
+        k_max : int, default 30
+            Mayor cantidad de clusters. Se limita a la cantidad de filas menos uno
+            y a la cantidad de hojas del árbol (los representantes de BIRCH).
+        criterio : {'silueta', 'gap'}, default 'silueta'
+            Criterio a maximizar: el Silhouette Score (muestreado si no cabe en el presupuesto) o el estadístico gap (ver seleccion).
+        estrategia : {'gruesa_fina', 'dorada'}, default 'gruesa_fina'
+            'gruesa_fina' recorre una grilla logarítmica de k y la refina
+            alrededor del mejor; 'dorada' hace una búsqueda de sección dorada,
+            que supone un único máximo.
+        paciencia : int, default 2
+            Puntos seguidos de la grilla gruesa sin mejora tras los que se corta.
+            Si es None se recorre completa.
+        modo : {'auto', 'exacto', 'muestreo', 'simplificado'}, default 'auto'
+            Forma de calcular el Silhouette Score (ver silueta.puntaje_silueta).
+        presupuesto : int, default PRESUPUESTO
+            Cantidad máxima de distancias entre pares para el Silhouette Score.
+        random_state : int, default 0
+            Estado aleatorio de los criterios.
     
-    def silhouette(self, cluster):
+        Returns
+        -------------
+        k : int
+            Cantidad de clusters elegida.
+        evidencia : pd.DataFrame
+            Valor del criterio en cada k evaluado, ordenado por k, con el orden
+            de evaluación, el tiempo y la columna 'elegido'.
+        '''
+        def ajustar(k):
+            return self.__etiquetas(k), None
+        
+        k_max = min(k_max, len(self._datos) - 1, self.__max_clusters())
+        return seleccionar_k(self._datos.data, ajustar, criterio, k_min, k_max,
+                             estrategia, paciencia = paciencia, modo = modo, presupuesto = presupuesto,
+                             random_state = random_state)
+    
+    @instrumentado
+    def fit(self, cluster):
+        '''Ajusta el modelo y lo guarda para etiquetar datos nuevos con predict.
+
+        Parameters
+        --------------
+        cluster : int
+            Número de clusters.
+    
+        Returns
+        -------------
+        self : MetodoAgglomerative
+            El mismo objeto, con el modelo ajustado.
+        '''
+        X = self._datos.data
+        resultado = self.__etiquetas(cluster)
+        # Centroide de cada cluster
+        etiquetas, resultado = np.unique(resultado, return_inverse = True)
+        centroides = np.zeros((len(etiquetas), X.shape[1]))
+        np.add.at(centroides, resultado, X)
+        centroides /= np.bincount(resultado)[:, None]
+        return self._guardar_ajuste({'cluster': cluster}, puntos = centroides, etiquetas = etiquetas)
+    
+    @instrumentado
+    def silhouette(self, cluster, modo = 'auto', presupuesto = PRESUPUESTO):
         '''Calcula y devuelve el Silhouette Score del clustering con KMeans.
 
         Parameters
         --------------
         clusters : int
             Número de clusters.
+        modo : {'auto', 'exacto', 'muestreo'}, default 'auto'
+            Forma de calcular el Silhouette Score (ver silueta.puntaje_silueta).
+        presupuesto : int, default PRESUPUESTO
+            Cantidad máxima de distancias entre pares para el Silhouette Score.
     
         Returns
         -------------
         silueta: str
             Silhouette Score del clustering.
         '''
-        # Cargar el dataset
-        X = self.__df.data
-        
         # Encontrar los clusters
-        agglomerative = AgglomerativeClustering(n_clusters = cluster)
-        resultado = agglomerative.fit_predict(X)
+        resultado = self.__etiquetas(cluster)
         
-        silueta = silhouette_score(X, resultado)
+        silueta = self._silueta(resultado, modo, presupuesto)
         
         return(f'Silhouette Score Agglomerative: {silueta}')
-    
\ No newline at end of file
+    
+    @instrumentado
+    def arbol(self):
+        '''Construye (o reutiliza) el árbol jerárquico completo del dataset.
+
+        Con compresion = 'birch' las hojas del árbol son los subclusters de BIRCH
+        y la última columna cuenta las filas originales bajo cada nodo. El árbol
+        se guarda en el ConjuntoDatos.
+
+        Parameters
+        --------------
+        None
+    
+        Returns
+        -------------
+        arbol : np.ndarray
+            Matriz de enlace en el formato de scipy.cluster.hierarchy.
+        '''
+        if self.__arbol is None:
+            X = self._datos.data
+            compresion = self.__compresion
+            if compresion == 'auto':
+                compresion = 'birch' if len(X) > MAX_N_EXACTO else None
+            
+            # El árbol depende solo de los datos y de la compresión
+            llave = ('arbol', compresion,
+                     self.__n_representantes if compresion == 'birch' else None,
+                     self.__n_vecinos if compresion == 'vecinos' else None)
+            self.__arbol, self.__asignacion = self._datos.derivado(llave, lambda: self.__construir_arbol(compresion))
+        return self.__arbol
+    
+    def __construir_arbol(self, compresion):
+        from sklearn.cluster import AgglomerativeClustering
+        
+        X = self._datos.data
+        
+        # Reducir los datos antes de construir el árbol
+        conectividad = None
+        pesos = None
+        asignacion = None
+        if compresion == 'birch':
+            with fase('compresion', metodo = 'Birch') as medicion:
+                X, asignacion = _comprimir_birch(X, self.__n_representantes)
+                medicion.anotar(representantes = len(X))
+            pesos = np.bincount(asignacion, minlength = len(X))
+        elif compresion == 'vecinos':
+            with fase('compresion', metodo = 'vecinos', n_vecinos = self.__n_vecinos):
+                conectividad = _grafo_conexo(X, self.__n_vecinos)
+        elif compresion is not None:
+            raise ValueError(f"Compresión desconocida: {compresion}")
+        
+        agglomerative = AgglomerativeClustering(n_clusters = 1, compute_full_tree = True,
+                                                compute_distances = True, connectivity = conectividad)
+        with fase('ajuste', metodo = 'Agglomerative', arbol = True):
+            agglomerative.fit(X)
+        
+        # Cantidad de puntos bajo cada nodo del árbol
+        n = len(X)
+        hijos = agglomerative.children_
+        tamanos = np.ones(n + len(hijos))
+        if pesos is not None:
+            tamanos[:n] = pesos
+        for i, (izquierdo, derecho) in enumerate(hijos):
+            tamanos[n + i] = tamanos[izquierdo] + tamanos[derecho]
+        
+        arbol = np.column_stack([hijos, agglomerative.distances_, tamanos[n:]]).astype(float)
+        return arbol, asignacion
+    
+    def __max_clusters(self):
+        '''Mayor cantidad de clusters posible: las hojas del árbol (los representantes de BIRCH si se comprime).'''
+        if not self.__arbol_unico and self.__compresion is None:
+            return len(self._datos)
+        return len(self.arbol()) + 1
+    
+    def __etiquetas(self, cluster):
+        from sklearn.cluster import AgglomerativeClustering
+        
+        maximo = self.__max_clusters()
+        if not 1 <= cluster <= maximo:
+            raise ValueError(f"La cantidad de clusters debe estar entre 1 y {maximo} (las hojas del árbol), "
+                             f"no {cluster}")
+        
+        # Reutilizar las etiquetas si ya se calcularon con los mismos parámetros y datos
+        llave = self._llave(cluster, self.__arbol_unico, self.__compresion, self.__n_representantes,
+                            self.__n_vecinos)
+        
+        def ajustar():
+            if not self.__arbol_unico and self.__compresion is None:
+                with fase('ajuste', metodo = 'Agglomerative', k = cluster):
+                    return AgglomerativeClustering(n_clusters = cluster).fit_predict(self._datos.data)
+            arbol = self.arbol()
+            with fase('corte', k = cluster):
+                etiquetas = _cortar_arbol(arbol, cluster)
+                # Propagar las etiquetas de los subclusters a todas las filas
+                if self.__asignacion is not None:
+                    etiquetas = etiquetas[self.__asignacion]
+                return etiquetas
+        
+        return self._modelos.obtener(llave, ajustar)
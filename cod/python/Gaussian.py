@@ -4,95 +4,182 @@
 @author: sofiabocker
 """
 
-import matplotlib.pyplot as plt
-from sklearn.mixture import GaussianMixture
-from sklearn.metrics import silhouette_score
-import seaborn as sns
-import pandas as pd
+import copy
+import functools
+import time
 
-from sklearn.datasets import load_iris, load_digits, load_wine, load_breast_cancer, load_diabetes, load_linnerud
+import numpy as np
 
-class MetodoGaussian():
+from silueta import puntaje_silueta, PRESUPUESTO
+from base import MetodoBase
+from seleccion import seleccionar_k
+from instrumentacion import fase, instrumentado
+from consenso import correr_semillas, etiquetas_consenso
+
+def _n_parametros(gm):
+    '''Cantidad de parámetros libres de la mezcla, para el BIC y el AIC.'''
+    k, d = gm.means_.shape
+    if gm.covariance_type == 'full':
+        covarianza = k * d * (d + 1) / 2
+    elif gm.covariance_type == 'diag':
+        covarianza = k * d
+    elif gm.covariance_type == 'tied':
+        covarianza = d * (d + 1) / 2
+    else:
+        covarianza = k
+    return int(covarianza + k * d + k - 1)
+
+def _dividir_componente(pesos, medias, precisiones, covarianzas, tipo = 'full'):
+    '''Divide en dos la componente de mayor varianza a lo largo de su eje principal.
+
+    Las formas de precisiones y covarianzas dependen de covariance_type: (k, d, d)
+    con 'full', (d, d) compartida con 'tied', (k, d) con 'diag' y (k,) con
+    'spherical'. Con 'tied' se divide la componente de mayor peso y la
+    covarianza compartida no cambia.
+    '''
+    if tipo == 'full':
+        valores, vectores = np.linalg.eigh(covarianzas)
+        peor = valores[:, -1].argmax()
+        desplazamiento = np.sqrt(valores[peor, -1]) * vectores[peor][:, -1]
+    elif tipo == 'tied':
+        valores, vectores = np.linalg.eigh(covarianzas)
+        peor = pesos.argmax()
+        desplazamiento = np.sqrt(valores[-1]) * vectores[:, -1]
+    elif tipo in ('diag', 'spherical'):
+        # Usar la coordenada de mayor varianza (cualquiera si es esférica)
+        varianzas = covarianzas.reshape(len(medias), -1)
+        peor = varianzas.max(axis = 1).argmax()
+        desplazamiento = np.zeros(medias.shape[1])
+        eje = varianzas[peor].argmax() if varianzas.shape[1] > 1 else 0
+        desplazamiento[eje] = np.sqrt(varianzas[peor, eje])
+    else:
+        raise ValueError(f"covariance_type desconocido: {tipo}")
+    
+    pesos = np.append(pesos, pesos[peor] / 2)
+    pesos[peor] /= 2
+    medias = np.vstack([medias, medias[peor] + desplazamiento])
+    medias[peor] = medias[peor] - desplazamiento
+    if tipo != 'tied':
+        precisiones = np.concatenate([precisiones, precisiones[peor:peor + 1]])
+        covarianzas = np.concatenate([covarianzas, covarianzas[peor:peor + 1]])
+    return pesos, medias, precisiones, covarianzas
+
+def _etiquetas_semilla(X, components, semilla, covariance_type = 'full'):
+    '''Ajusta GaussianMixture con una semilla y devuelve sus etiquetas.'''
+    from sklearn.mixture import GaussianMixture
+    return GaussianMixture(n_components = components, covariance_type = covariance_type,
+                           random_state = semilla).fit_predict(X)
+
+class MetodoGaussian(MetodoBase):
+    
+    NOMBRE = 'GaussianMixture'
+    TITULO = 'GaussianMixture'
+    # sklearn solo lo ajusta sobre datos densos
+    DISPERSOS = False
     
     # Constructor
-    def __init__(self, df):
+    def __init__(self, df, max_modelos = 8, preprocesamiento = None, covariance_type = 'full'):
         '''
         Inicializa un objeto de la clase con los parámetros dados.
     
         Parameters
         ----------
-        df : pd.DataFrame
+        df : sklearn.datasets o ConjuntoDatos
             Dataset de sklearn.datasets al que se le va a aplicar el método
+        max_modelos : int, default 8
+            Cantidad máxima de modelos ajustados que se guardan en la cache.
+        preprocesamiento : preprocesamiento.Preprocesamiento, default None
+            Escalado y reducción de dimensión que se aplican antes del método
+            (ver base.MetodoBase). Si df.data es dispersa hace falta una
+            reducción ('svd' o una proyección aleatoria) que la lleve a una
+            matriz densa de pocas columnas.
+        covariance_type : {'full', 'tied', 'diag', 'spherical'}, default 'full'
+            Tipo de matriz de covarianza de las componentes (ver
+            sklearn.mixture.GaussianMixture).
     
         Returns
         -------
         None
         '''
-        self.__df = df
-    
-    # Get
-    @property
-    def df(self):
-        '''
-        Obtiene el Dataset de sklearn.datasets en el que se va a trabajar
-    
-        Returns
-        -------
-        df : sklearn.datasets
-            Dataset de sklearn.datasets.
-        '''
-        return self.__df
+        super().__init__(df, max_modelos, preprocesamiento)
+        self.__covariance_type = covariance_type
+        self.__incrementales = {}
     
-    # Set 
-    @df.setter
-    def df(self, nuevo_df):
-        '''
-        Establece un nuevo dataframe.
+    # Métodos
+    def _limpiar(self):
+        super()._limpiar()
+        self.__incrementales = {}
     
+    @instrumentado
+    def clusters(self, components, como_dataframe = True):
+        '''Realiza el clustering con GaussianMixture y devuelve el DataFrame con las etiquetas de los clusters.
+
         Parameters
-        ----------
-        df : sklearn.datasets
-            El nuevo dataset de sklearn.datasets.
-    
-        Returns
-        -------
-        None
-        '''
-        self.__df = nuevo_df
-    
-    # Str
-    def __str__(self):
-        '''
-        Devuelve una representación de cadena del objeto.
+        --------------
+        components : int
+            Número de componentes de la mezcla.
+        random : int
+            Estado aleatorio para la inicialización de GaussianMixture.
+        como_dataframe : bool, default True
+            Si es False se devuelve un ResultadoClusters con las etiquetas int32 y
+            una vista de los datos, sin construir el DataFrame.
     
         Returns
-        -------
-        __str__ : str
-            Una cadena que representa el objeto con los valores actuales de sus atributos.
+        -------------
+        dataset : pd.DataFrame
+            DataFrame con las etiquetas de los clusters.
         '''
-        return f'DataFrame : {self.__df}'
+        # Encontrar los clusters
+        gm, labels = self.__vigente(components)
+        
+        # Convertir a un dataframe sin copiar los datos
+        return self._resultado(labels, como_dataframe)
     
-    # Métodos
-    def tabla_resumen(self):
-        '''Genera una tabla resumen del dataset de sklearn.datasets con el que se va a trabajar.
+    @instrumentado
+    def consenso(self, components, n_semillas = 20, random_state = 0, n_jobs = 1, max_n_denso = 4000,
+                 n_anclas = 1000, como_dataframe = True):
+        '''Realiza el clustering con GaussianMixture con varias semillas y devuelve las etiquetas de consenso.
+
+        Las corridas se combinan con la matriz de coasociación (ver
+        consenso.etiquetas_consenso). El resultado es reproducible para un mismo
+        random_state e incluye la estabilidad de cada punto.
 
         Parameters
         --------------
-        None
+        components : int
+            Número de componentes de la mezcla.
+        n_semillas : int, default 20
+            Cantidad de corridas.
+        random_state : int, default 0
+            Semilla de la que se derivan las semillas de las corridas y de las anclas.
+        n_jobs : int, default 1
+            Cantidad de procesos para las corridas. -1 usa todos los núcleos.
+        max_n_denso : int, default 4000
+            Máxima cantidad de filas para usar la matriz de coasociación completa.
+        n_anclas : int, default 1000
+            Cantidad de anclas cuando hay más de max_n_denso filas.
+        como_dataframe : bool, default True
+            Si es False se devuelve un ResultadoClusters en lugar del DataFrame.
     
         Returns
         -------------
-        resumen: pd.DataFrame
-                Tabla resumen del dataset de sklearn.datasets.
+        dataset : pd.DataFrame
+            DataFrame con las columnas 'cluster' y 'estabilidad'.
         '''
-        X, y = self.__df.data, self.__df.target
-        dataset = pd.DataFrame(X, columns = self.__df.feature_names)
-        dataset['target'] = y
-        resumen = dataset.describe()
-        return resumen
+        X = self._datos.data
+        semillas = np.random.SeedSequence(random_state).generate_state(n_semillas)
+        with fase('ajuste', metodo = 'GaussianMixture', k = components, corridas = n_semillas):
+            ajustar = functools.partial(_etiquetas_semilla, covariance_type = self.__covariance_type)
+            etiquetas = correr_semillas(ajustar, X, components, semillas, n_jobs)
+        with fase('consenso', k = components):
+            resultado, estabilidad = etiquetas_consenso(etiquetas, components, max_n_denso, n_anclas, random_state)
+        
+        return self._resultado(resultado, como_dataframe, estabilidad)
     
-    def clusters(self, components):
-        '''Realiza el clustering con GaussianMixture y devuelve el DataFrame con las etiquetas de los clusters.
+    @instrumentado
+    def graficar(self, components = None, resultado = None, modo = 'pairplot',
+                 archivo = None, **opciones):
+        '''Genera un pairplot del dataset con las etiquetas de los clusters de GaussianMixture.
 
         Parameters
         --------------
@@ -100,91 +187,297 @@ class MetodoGaussian():
             Número de componentes de la mezcla.
         random : int
             Estado aleatorio para la inicialización de GaussianMixture.
+        resultado : ResultadoClusters, default None
+            Resultado ya calculado para graficar sin volver a hacer el clustering.
+        modo : {'pairplot', 'escalable'}, default 'pairplot'
+            'pairplot' dibuja sns.pairplot con todos los puntos y columnas.
+            'escalable' usa graficos.graficar_escalable: muestra por cluster,
+            columnas más discriminantes o PCA y densidad con hexbin.
+        archivo : str, default None
+            Ruta donde guardar la figura en lugar de mostrarla.
+        **opciones
+            Argumentos adicionales de graficos.graficar_escalable.
     
         Returns
         -------------
-        dataset : pd.DataFrame
-            DataFrame con las etiquetas de los clusters.
+        None
         '''
-        # Cargar el dataset
-        X = self.__df.data
+        if resultado is None:
+            resultado = self.clusters(components, como_dataframe = False)
+        self._graficar(resultado, modo, archivo, **opciones)
+        
+    @instrumentado
+    def mejor_cluster(self, components_values = range(2, 11), random_state = None, paciencia = None,
+                      modo = 'auto', presupuesto = PRESUPUESTO):
+        '''Calcula el silhouette score, el BIC y el AIC para diferentes cantidades de clusters
+
+        Cada cantidad de componentes parte de la solución anterior, dividiendo en
+        dos la componente de mayor varianza, en lugar de reiniciar EM desde cero.
+
+        Parameters
+        --------------
+        components_values : iterable of int, default range(2, 11)
+            Cantidades de componentes a evaluar, en orden creciente.
+        random_state : int, default None
+            Estado aleatorio para la inicialización del primer ajuste.
+        paciencia : int, default None
+            Si se indica, el barrido se detiene cuando el BIC no mejora durante
+            esa cantidad de pasos seguidos.
+        modo : {'auto', 'exacto', 'muestreo', 'simplificado'}, default 'auto'
+            Forma de calcular el Silhouette Score (ver silueta.puntaje_silueta).
+        presupuesto : int, default PRESUPUESTO
+            Cantidad máxima de distancias entre pares para el Silhouette Score.
+    
+        Returns
+        -------------
+        resultados : pd.DataFrame
+            Tabla con k, Silhouette Score, BIC, AIC, iteraciones de EM y tiempo en segundos.
+        '''
+        import pandas as pd
+        from sklearn.mixture import GaussianMixture
         
-        # Encontrar los clusters
-        gm = GaussianMixture(n_components = components)
-        gm.fit(X)
-        labels = gm.predict(X)
         
-        # Convertir a un dataframe
-        dataset = pd.DataFrame(X, columns = self.__df.feature_names)
-        dataset['cluster'] = labels
-        return dataset
+        # Cargar el dataset
+        X = self._datos.data
+        
+        filas = []
+        gm = None
+        mejor_bic = np.inf
+        sin_mejora = 0
+        for n_components in sorted(components_values):
+            inicio = time.perf_counter()
+            if gm is None:
+                gm = GaussianMixture(n_components = n_components, covariance_type = self.__covariance_type,
+                                     random_state = random_state)
+            else:
+                # Partir de la solución anterior dividiendo la componente de mayor varianza
+                pesos, medias, precisiones = gm.weights_, gm.means_, gm.precisions_
+                covarianzas = gm.covariances_
+                while len(medias) < n_components:
+                    pesos, medias, precisiones, covarianzas = _dividir_componente(pesos, medias, precisiones,
+                                                                                  covarianzas, gm.covariance_type)
+                gm = GaussianMixture(n_components = n_components, covariance_type = self.__covariance_type,
+                                     weights_init = pesos, means_init = medias, precisions_init = precisiones,
+                                     random_state = random_state)
+            with fase('ajuste', metodo = 'GaussianMixture', k = n_components) as medicion:
+                gm.fit(X)
+                medicion.anotar(n_iter = gm.n_iter_, convergio = gm.converged_)
+            with fase('etiquetas', k = n_components):
+                resultado = gm.predict(X)
+            
+            # BIC y AIC a partir de una sola evaluación de la verosimilitud
+            with fase('verosimilitud', k = n_components):
+                log_verosimilitud = gm.score(X) * len(X)
+            parametros = _n_parametros(gm)
+            bic = -2 * log_verosimilitud + parametros * np.log(len(X))
+            aic = -2 * log_verosimilitud + 2 * parametros
+            
+            with fase('silueta', modo = modo, k = n_components):
+                silueta = puntaje_silueta(X, resultado, modo, presupuesto, centroides = gm.means_).valor
+            filas.append({'k': n_components,
+                          'silhouette': silueta,
+                          'bic': bic,
+                          'aic': aic,
+                          'n_iter': gm.n_iter_,
+                          'convergio': gm.converged_,
+                          'tiempo': time.perf_counter() - inicio})
+            
+            if bic < mejor_bic:
+                mejor_bic = bic
+                sin_mejora = 0
+            else:
+                sin_mejora += 1
+                if paciencia is not None and sin_mejora >= paciencia:
+                    break
+            
+        return pd.DataFrame(filas)
     
-    def graficar(self, components):
-        '''Genera un pairplot del dataset con las etiquetas de los clusters de GaussianMixture.
+    @instrumentado
+    def actualizar(self, X_nuevo, components):
+        '''Actualiza el modelo de components componentes con un nuevo lote de datos sin reajustarlo.
+
+        Se hace un paso de EM incremental: las responsabilidades del lote nuevo se
+        combinan con las estadísticas suficientes acumuladas de los datos ya vistos.
+        Desde entonces clusters, silhouette y fit con components usan el modelo
+        actualizado, y predict lo usa de inmediato.
 
         Parameters
         --------------
+        X_nuevo : np.ndarray
+            Lote de datos nuevo con las mismas columnas que df.data.
         components : int
             Número de componentes de la mezcla.
-        random : int
-            Estado aleatorio para la inicialización de GaussianMixture.
     
         Returns
         -------------
-        None
+        gm : GaussianMixture
+            Modelo actualizado.
         '''
-        dataset = self.clusters(components)
+        from scipy.linalg import cholesky, solve_triangular
+        
+        if components in self.__incrementales:
+            gm, n, _ = self.__incrementales[components]
+        else:
+            gm, _ = self.__modelo(components)
+            gm, n = copy.deepcopy(gm), len(self._datos)
+        
+        if gm.covariance_type != 'full':
+            raise ValueError("La actualización incremental solo admite covariance_type='full'")
+        
+        if self._transformacion is not None:
+            X_nuevo = self._transformacion.transformar(X_nuevo)
+        X_nuevo = np.asarray(X_nuevo, dtype = float)
+        responsabilidades = gm.predict_proba(X_nuevo)
+        
+        # Estadísticas suficientes de lo ya visto más las del lote nuevo. Las
+        # covarianzas guardadas ya incluyen reg_covar: se quita antes de
+        # reconstruir los segundos momentos para sumarlo una sola vez
+        regularizacion = gm.reg_covar * np.eye(X_nuevo.shape[1])
+        conteos_previos = gm.weights_ * n
+        conteos = conteos_previos + responsabilidades.sum(axis = 0)
+        sumas = conteos_previos[:, None] * gm.means_ + responsabilidades.T @ X_nuevo
+        segundos = conteos_previos[:, None, None] * (gm.covariances_ - regularizacion
+                                                     + np.einsum('ki,kj->kij', gm.means_, gm.means_))
+        segundos += np.einsum('nk,ni,nj->kij', responsabilidades, X_nuevo, X_nuevo)
         
-        # Graficar
-        pairplot = sns.pairplot(dataset, hue = 'cluster', palette = 'Accent')
-        pairplot.fig.suptitle(f"Pairplot con GaussianMixture Clusters", y=1.02)
-        plt.show()
+        medias = sumas / conteos[:, None]
+        covarianzas = segundos / conteos[:, None, None] - np.einsum('ki,kj->kij', medias, medias)
+        covarianzas += regularizacion
         
-    def mejor_cluster(self):
-        '''Calcula el silhouette score para diferentes cantidades de clusters
+        gm.weights_ = conteos / conteos.sum()
+        gm.means_ = medias
+        gm.covariances_ = covarianzas
+        gm.precisions_cholesky_ = np.array([solve_triangular(cholesky(c, lower = True), np.eye(len(c)),
+                                                             lower = True).T for c in covarianzas])
+        gm.precisions_ = np.einsum('kij,klj->kil', gm.precisions_cholesky_, gm.precisions_cholesky_)
+        
+        # Las etiquetas de df.data se recalculan cuando se piden
+        self.__incrementales[components] = (gm, n + len(X_nuevo), None)
+        self._guardar_ajuste({'components': components}, estimador = gm)
+        return gm
+        
+    @instrumentado
+    def elegir_k(self, k_min = 2, k_max = 30, criterio = 'bic', estrategia = 'gruesa_fina', paciencia = 2,
+                 modo = 'auto', presupuesto = PRESUPUESTO, random_state = 0):
+        '''Elige la cantidad de clusters de GaussianMixture evaluando pocos k en lugar de toda la grilla.
+
+        Cada k se ajusta una sola vez (los modelos quedan en la cache) y la
+        búsqueda se detiene cuando el criterio deja de mejorar (ver
+        seleccion.buscar_k).
 
         Parameters
         --------------
-        None
+        k_min : int, default 2
+            Menor cantidad de clusters.
+        k_max : int, default 30
+            Mayor cantidad de clusters. Se limita a la cantidad de filas menos uno.
+        criterio : {'bic', 'silueta', 'gap'}, default 'bic'
+            Criterio a maximizar: el BIC (se maximiza -BIC),
+            el Silhouette Score (muestreado si no cabe en el presupuesto) o el
+            estadístico gap (ver seleccion).
+        estrategia : {'gruesa_fina', 'dorada'}, default 'gruesa_fina'
+            'gruesa_fina' recorre una grilla logarítmica de k y la refina
+            alrededor del mejor; 'dorada' hace una búsqueda de sección dorada,
+            que supone un único máximo.
+        paciencia : int, default 2
+            Puntos seguidos de la grilla gruesa sin mejora tras los que se corta.
+            Si es None se recorre completa.
+        modo : {'auto', 'exacto', 'muestreo', 'simplificado'}, default 'auto'
+            Forma de calcular el Silhouette Score (ver silueta.puntaje_silueta).
+        presupuesto : int, default PRESUPUESTO
+            Cantidad máxima de distancias entre pares para el Silhouette Score.
+        random_state : int, default 0
+            Estado aleatorio de los criterios.
     
         Returns
         -------------
-        None
+        k : int
+            Cantidad de clusters elegida.
+        evidencia : pd.DataFrame
+            Valor del criterio en cada k evaluado, ordenado por k, con el orden
+            de evaluación, el tiempo y la columna 'elegido'.
         '''
+        X = self._datos.data
         
-        # Cargar el dataset
-        X = self.__df.data
+        def ajustar(k):
+            gm, etiquetas = self.__modelo(k)
+            return etiquetas, gm.means_
         
-        for n_components in range(2, 11):
-            gm = GaussianMixture(n_components = n_components)
-            resultado = gm.fit_predict(X)
-            silueta = silhouette_score(X, resultado)
-            print(f"Cantidad de clusters: {n_components}, Silhouette Score: {silueta}")
-            
-        return()
+        def bic(k):
+            gm, _ = self.__modelo(k)
+            with fase('verosimilitud', k = k):
+                valor = gm.bic(X)
+            return {'valor': -valor, 'bic': valor}
         
-    def silhouette(self, components):
+        return seleccionar_k(X, ajustar, criterio, k_min, min(k_max, len(self._datos) - 1), estrategia,
+                             paciencia = paciencia, modo = modo, presupuesto = presupuesto,
+                             random_state = random_state, criterios = {'bic': bic})
+    
+    @instrumentado
+    def fit(self, components):
+        '''Ajusta el modelo y lo guarda para etiquetar datos nuevos con predict.
+
+        Parameters
+        --------------
+        components : int
+            Número de componentes de la mezcla.
+    
+        Returns
+        -------------
+        self : MetodoGaussian
+            El mismo objeto, con el modelo ajustado.
+        '''
+        gm, _ = self.__vigente(components)
+        return self._guardar_ajuste({'components': components}, estimador = gm)
+    
+    @instrumentado
+    def silhouette(self, components, modo = 'auto', presupuesto = PRESUPUESTO):
         '''Calcula y devuelve el Silhouette Score del clustering con GaussianMixture.
 
         Parameters
         --------------
         clusters : int
             Número de clusters.
+        modo : {'auto', 'exacto', 'muestreo', 'simplificado'}, default 'auto'
+            Forma de calcular el Silhouette Score (ver silueta.puntaje_silueta).
+        presupuesto : int, default PRESUPUESTO
+            Cantidad máxima de distancias entre pares para el Silhouette Score.
     
         Returns
         -------------
         silueta: str
             Silhouette Score del clustering.
         '''
-        # Cargar el dataset
-        X = self.__df.data
-        
         # Encontrar los clusters
-        gm = GaussianMixture(n_components = components)
-        gm.fit(X)
-        resultado = gm.predict(X)
+        gm, resultado = self.__vigente(components)
         
-        silueta = silhouette_score(X, resultado)
+        silueta = self._silueta(resultado, modo, presupuesto, centroides = gm.means_)
         
         return(f'Silhouette Score GaussianMixture: {silueta}')
     
+    def __modelo(self, components):
+        from sklearn.mixture import GaussianMixture
+        
+        # Reutilizar el modelo y sus etiquetas si ya se ajustó con los mismos parámetros y datos
+        llave = self._llave(components, self.__covariance_type)
+        
+        def ajustar():
+            with fase('ajuste', metodo = 'GaussianMixture', k = components) as medicion:
+                gm = GaussianMixture(n_components = components, covariance_type = self.__covariance_type)
+                gm.fit(self._datos.data)
+                medicion.anotar(n_iter = gm.n_iter_, convergio = gm.converged_)
+            with fase('etiquetas'):
+                return gm, gm.predict(self._datos.data)
+        
+        return self._modelos.obtener(llave, ajustar)
+    
+    def __vigente(self, components):
+        '''Modelo y etiquetas de df.data: los del modelo actualizado con actualizar si lo hay.'''
+        if components not in self.__incrementales:
+            return self.__modelo(components)
+        gm, n, etiquetas = self.__incrementales[components]
+        if etiquetas is None:
+            with fase('etiquetas', incremental = True):
+                etiquetas = gm.predict(self._datos.data)
+            self.__incrementales[components] = (gm, n, etiquetas)
+        return gm, etiquetas
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: sofiabocker
+"""
+
+import numpy as np
+
+# Versión del formato de los archivos guardados con ModeloAjustado.save
+VERSION = 1
+
+class ModeloAjustado():
+
+    # Constructor
+    def __init__(self, metodo, parametros, estimador = None, puntos = None, etiquetas = None,
+                 radio = None, feature_names = None, transformacion = None):
+        '''
+        Inicializa un modelo ajustado que puede etiquetar datos nuevos.
+
+        Se usa el predict del estimador si se indica (KMeans, GaussianMixture).
+        Si no, cada fila recibe la etiqueta del punto de referencia más cercano
+        (puntos centrales de DBSCAN o centroides de Agglomerative), siempre que
+        esté a distancia menor o igual que radio; si no, recibe -1 (ruido).
+
+        Parameters
+        ----------
+        metodo : str
+            Nombre del método con el que se ajustó el modelo.
+        parametros : dict
+            Parámetros del ajuste.
+        estimador : sklearn estimator, default None
+            Estimador con predict.
+        puntos : np.ndarray o scipy.sparse matrix, default None
+            Puntos de referencia de tamaño (m, d). Si son dispersos se guardan como CSR.
+        etiquetas : np.ndarray, default None
+            Etiqueta de cada punto de referencia.
+        radio : float, default None
+            Distancia máxima al punto de referencia. Si es None no hay límite.
+        feature_names : list of str, default None
+            Nombres de las columnas con las que se ajustó.
+        transformacion : preprocesamiento.Transformacion, default None
+            Preprocesamiento que se aplica a cada lote antes de predecir.
+
+        Returns
+        -------
+        None
+        '''
+        from scipy.sparse import issparse
+
+        self.__metodo = metodo
+        self.__parametros = dict(parametros)
+        self.__estimador = estimador
+        if puntos is not None:
+            puntos = puntos.tocsr() if issparse(puntos) else np.ascontiguousarray(puntos)
+        self.__puntos = puntos
+        self.__etiquetas = None if etiquetas is None else np.asarray(etiquetas, dtype = np.int32)
+        self.__radio = radio
+        self.__feature_names = None if feature_names is None else list(feature_names)
+        self.__transformacion = transformacion
+        self.__indice = None
+
+    # Get
+    @property
+    def metodo(self):
+        '''
+        Obtiene el nombre del método con el que se ajustó el modelo.
+
+        Returns
+        -------
+        metodo : str
+            Nombre del método.
+        '''
+        return self.__metodo
+
+    @property
+    def parametros(self):
+        '''
+        Obtiene los parámetros del ajuste.
+
+        Returns
+        -------
+        parametros : dict
+            Parámetros del ajuste.
+        '''
+        return dict(self.__parametros)
+
+    # Str
+    def __str__(self):
+        '''
+        Devuelve una representación de cadena del objeto.
+
+        Returns
+        -------
+        __str__ : str
+            Una cadena con el método y los parámetros del ajuste.
+        '''
+        return f'ModeloAjustado : {self.__metodo} {self.__parametros}'
+
+    # Métodos
+    def predict(self, X, tamano_lote = 100000):
+        '''Asigna un cluster a cada fila de X, recorriéndola por lotes.
+
+        Parameters
+        --------------
+        X : np.ndarray o scipy.sparse matrix
+            Datos de tamaño (n, d), con las mismas columnas que el ajuste.
+        tamano_lote : int, default 100000
+            Cantidad de filas por lote.
+
+        Returns
+        -------------
+        etiquetas : np.ndarray
+            Etiquetas int32 de los clusters.
+        '''
+        from scipy.sparse import issparse
+
+        if issparse(X):
+            X = X.tocsr()
+        # Los lotes se convierten al tipo de los datos del ajuste
+        if self.__estimador is None:
+            tipo = self.__puntos.dtype
+        else:
+            centros = getattr(self.__estimador, 'cluster_centers_', getattr(self.__estimador, 'means_', None))
+            tipo = None if centros is None else centros.dtype
+        etiquetas = np.empty(X.shape[0], dtype = np.int32)
+        for inicio in range(0, X.shape[0], tamano_lote):
+            lote = X[inicio:inicio + tamano_lote]
+            if self.__transformacion is not None:
+                lote = self.__transformacion.transformar(lote)
+            if issparse(lote):
+                lote = lote if tipo is None else lote.astype(tipo)
+            else:
+                lote = np.asarray(lote, dtype = tipo)
+            etiquetas[inicio:inicio + lote.shape[0]] = self.__predecir_lote(lote)
+        return etiquetas
+
+    def save(self, ruta, compress = 0):
+        '''Guarda el modelo con joblib.
+
+        Sin compresión los arreglos quedan guardados tal cual, de modo que load
+        puede mapearlos a memoria en lugar de leerlos.
+
+        Parameters
+        --------------
+        ruta : str
+            Ruta del archivo.
+        compress : int, default 0
+            Nivel de compresión de joblib. Con compresión no se puede usar mmap.
+
+        Returns
+        -------------
+        None
+        '''
+        import joblib
+
+        joblib.dump({'version': VERSION,
+                     'metodo': self.__metodo,
+                     'parametros': self.__parametros,
+                     'estimador': self.__estimador,
+                     'puntos': self.__puntos,
+                     'etiquetas': self.__etiquetas,
+                     'radio': self.__radio,
+                     'feature_names': self.__feature_names,
+                     'transformacion': self.__transformacion}, ruta, compress = compress)
+
+    @staticmethod
+    def load(ruta, mmap_mode = 'r'):
+        '''Carga un modelo guardado con save.
+
+        Parameters
+        --------------
+        ruta : str
+            Ruta del archivo.
+        mmap_mode : {None, 'r', 'c'}, default 'r'
+            Modo de mapeo a memoria de los arreglos (ver joblib.load).
+
+        Returns
+        -------------
+        modelo : ModeloAjustado
+            Modelo listo para predecir.
+        '''
+        import joblib
+
+        contenido = joblib.load(ruta, mmap_mode = mmap_mode)
+        if contenido.get('version') != VERSION:
+            raise ValueError(f"Versión de archivo no soportada: {contenido.get('version')}")
+        return ModeloAjustado(contenido['metodo'], contenido['parametros'], contenido['estimador'],
+                              contenido['puntos'], contenido['etiquetas'], contenido['radio'],
+                              contenido['feature_names'], contenido.get('transformacion'))
+
+    def __predecir_lote(self, lote):
+        if self.__estimador is not None:
+            return self.__estimador.predict(lote)
+        if self.__puntos.shape[0] == 0:
+            return np.full(lote.shape[0], -1)
+
+        # El índice de vecinos se construye la primera vez que se predice
+        if self.__indice is None:
+            from sklearn.neighbors import NearestNeighbors
+            self.__indice = NearestNeighbors(n_neighbors = 1).fit(self.__puntos)
+        distancias, vecinos = self.__indice.kneighbors(lote)
+        etiquetas = self.__etiquetas[vecinos[:, 0]]
+        if self.__radio is not None:
+            etiquetas = np.where(distancias[:, 0] <= self.__radio, etiquetas, -1)
+        return etiquetas
@@ -0,0 +1,675 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: sofiabocker
+"""
+
+import numpy as np
+
+from silueta import puntaje_silueta, PRESUPUESTO
+from cache import CacheModelos, huella
+from resultado import ResultadoClusters
+from artefactos import ModeloAjustado
+from instrumentacion import fase, instrumentado
+from graficos import graficar_escalable
+from resumen import resumir_dataset, resumir_disperso
+from cargadores import Bunch
+
+def centro_escala(X, tipo = 'estandar'):
+    '''Calcula el centro y la escala de cada columna para escalar los datos como (X - centro) / escala.
+
+    Parameters
+    --------------
+    X : np.ndarray o scipy.sparse matrix
+        Datos de tamaño (n, d).
+    tipo : {'estandar', 'minmax', 'robusto'}, default 'estandar'
+        'estandar' usa la media y la desviación estándar, 'minmax' el mínimo y
+        el rango y 'robusto' la mediana y el rango intercuartílico. Con datos
+        dispersos no se centra, porque restar el centro los densificaría:
+        'estandar' solo divide por la desviación estándar, 'minmax' por el
+        máximo valor absoluto y 'robusto' no se admite.
+
+    Returns
+    -------------
+    centro : np.ndarray o None
+        Centro de cada columna, o None si X es dispersa.
+    escala : np.ndarray
+        Escala de cada columna. Las columnas constantes tienen escala 1 y quedan en cero.
+    '''
+    from scipy.sparse import issparse
+
+    if issparse(X):
+        from sklearn.utils.sparsefuncs import mean_variance_axis, min_max_axis
+
+        centro = None
+        if tipo == 'estandar':
+            escala = np.sqrt(mean_variance_axis(X.tocsr(), axis = 0)[1].astype(np.float64))
+        elif tipo == 'minmax':
+            minimos, maximos = min_max_axis(X.tocsr(), axis = 0)
+            escala = np.maximum(np.abs(minimos), np.abs(maximos)).astype(np.float64)
+        elif tipo == 'robusto':
+            raise ValueError("El escalado 'robusto' centra los datos y no se puede usar con datos dispersos")
+        else:
+            raise ValueError(f"Escalado desconocido: {tipo}")
+    elif tipo == 'estandar':
+        centro, escala = X.mean(axis = 0, dtype = np.float64), X.std(axis = 0, dtype = np.float64)
+    elif tipo == 'minmax':
+        centro = X.min(axis = 0).astype(np.float64)
+        escala = X.max(axis = 0) - centro
+    elif tipo == 'robusto':
+        cuartiles = np.percentile(X, [25, 50, 75], axis = 0)
+        centro, escala = cuartiles[1], cuartiles[2] - cuartiles[0]
+    else:
+        raise ValueError(f"Escalado desconocido: {tipo}")
+    return centro, np.where(escala > 0, escala, 1)
+
+def escalar(X, centro, escala):
+    '''Escala los datos como (X - centro) / escala; una matriz dispersa se escala sin densificarla.
+
+    Parameters
+    --------------
+    X : np.ndarray o scipy.sparse matrix
+        Datos de tamaño (n, d).
+    centro : np.ndarray o None
+        Centro de cada columna. Si es None no se centra.
+    escala : np.ndarray
+        Escala de cada columna.
+
+    Returns
+    -------------
+    escalados : np.ndarray o scipy.sparse.csr_matrix
+        Datos escalados, dispersos si X lo es.
+    '''
+    from scipy.sparse import diags, issparse
+
+    if issparse(X):
+        if centro is not None:
+            raise ValueError("Los datos dispersos no se pueden centrar sin densificarlos")
+        return (X @ diags(1 / escala)).tocsr()
+    if centro is not None:
+        X = X - centro
+    return X / escala
+
+class ConjuntoDatos():
+
+    # Constructor
+    def __init__(self, data, feature_names = None, target = None, dtype = None):
+        '''
+        Inicializa un conjunto de datos inmutable que comparten los métodos de clustering.
+
+        Guarda una sola copia contigua de los datos y, a medida que se piden, las
+        estructuras derivadas: variantes escaladas, matriz de distancias, índice
+        de vecinos y grafo de vecinos. Si varios objetos Metodo* reciben el mismo
+        ConjuntoDatos, la preparación de los datos se paga una sola vez. Las
+        matrices dispersas (por ejemplo TF-IDF) se guardan como CSR, sin
+        densificarlas.
+
+        Parameters
+        ----------
+        data : np.ndarray o scipy.sparse matrix
+            Datos de tamaño (n, d). Si ya son contiguos y del tipo pedido (por
+            ejemplo un np.memmap de cargadores.cargar_npy) no se copian. Una
+            matriz CSR del tipo pedido y en formato canónico tampoco se copia.
+        feature_names : list of str, default None
+            Nombres de las columnas. Si es None se usan x0, x1, ...
+        target : np.ndarray, default None
+            Etiquetas reales de cada fila, si existen.
+        dtype : np.dtype, default None
+            Tipo de la copia de los datos. Si es None se conserva el tipo de
+            punto flotante de data (los enteros pasan a float64). np.float32
+            reduce la memoria a la mitad, pero puede cambiar los resultados que
+            dependen de comparar distancias con un umbral, como los de DBSCAN.
+
+        Returns
+        -------
+        None
+        '''
+        from scipy.sparse import csr_matrix, issparse
+
+        if not issparse(data):
+            data = np.asarray(data)
+        if dtype is None:
+            dtype = data.dtype if np.issubdtype(data.dtype, np.floating) else np.float64
+
+        if issparse(data):
+            X = data.tocsr()
+            if X.dtype != dtype:
+                X = X.astype(dtype)
+            if not X.has_canonical_format:
+                X = X.copy()
+                X.sum_duplicates()
+            # Vistas de solo lectura de los tres arreglos CSR
+            arreglos = [X.data.view(), X.indices.view(), X.indptr.view()]
+            for arreglo in arreglos:
+                arreglo.flags.writeable = False
+            X = csr_matrix(tuple(arreglos), shape = X.shape, copy = False)
+            X.has_canonical_format = True
+        else:
+            X = data
+            if X.dtype != dtype or not X.flags.c_contiguous:
+                X = np.ascontiguousarray(X, dtype = dtype)
+            else:
+                X = X.view()
+            X.flags.writeable = False
+        self.__data = X
+        if feature_names is None:
+            feature_names = [f'x{i}' for i in range(X.shape[1])]
+        self.__feature_names = list(feature_names)
+        self.__target = target
+        self.__huella = None
+        self.__derivados = {}
+
+    @staticmethod
+    def desde(df, dtype = None):
+        '''Devuelve el mismo objeto si df ya es un ConjuntoDatos o lo construye a partir de un dataset.
+
+        Parameters
+        --------------
+        df : ConjuntoDatos o sklearn.datasets
+            Dataset con data y, opcionalmente, feature_names y target.
+        dtype : np.dtype, default None
+            Tipo de la copia de los datos si hay que construir el conjunto. Si
+            es None se conserva el de df.data (ver ConjuntoDatos).
+
+        Returns
+        -------------
+        datos : ConjuntoDatos
+            Conjunto de datos compartible.
+        '''
+        if isinstance(df, ConjuntoDatos):
+            return df
+        return ConjuntoDatos(df.data, getattr(df, 'feature_names', None), getattr(df, 'target', None), dtype)
+
+    # Get
+    @property
+    def data(self):
+        '''
+        Obtiene la copia de solo lectura de los datos.
+
+        Returns
+        -------
+        data : np.ndarray o scipy.sparse.csr_matrix
+            Datos contiguos de tamaño (n, d).
+        '''
+        return self.__data
+
+    @property
+    def disperso(self):
+        '''
+        Indica si los datos se guardan como matriz dispersa.
+
+        Returns
+        -------
+        disperso : bool
+            True si data es una scipy.sparse.csr_matrix.
+        '''
+        return not isinstance(self.__data, np.ndarray)
+
+    @property
+    def feature_names(self):
+        '''
+        Obtiene los nombres de las columnas.
+
+        Returns
+        -------
+        feature_names : list of str
+            Nombres de las columnas.
+        '''
+        return self.__feature_names
+
+    @property
+    def target(self):
+        '''
+        Obtiene las etiquetas reales, si existen.
+
+        Returns
+        -------
+        target : np.ndarray o None
+            Etiquetas reales de cada fila.
+        '''
+        return self.__target
+
+    @property
+    def huella(self):
+        '''
+        Obtiene (y guarda) la huella del contenido de los datos.
+
+        Returns
+        -------
+        huella : str
+            Huella para usar como llave de cache (ver cache.huella).
+        '''
+        if self.__huella is None:
+            self.__huella = huella(self.__data)
+        return self.__huella
+
+    def __len__(self):
+        return self.__data.shape[0]
+
+    def __reduce__(self):
+        # A otros procesos se envían solo los datos, no las estructuras derivadas
+        return (ConjuntoDatos, (self.__data, self.__feature_names, self.__target, self.__data.dtype))
+
+    # Str
+    def __str__(self):
+        '''
+        Devuelve una representación de cadena del objeto.
+
+        Returns
+        -------
+        __str__ : str
+            Una cadena con el tamaño, el tipo y las estructuras ya calculadas.
+        '''
+        tipo = f'{self.__data.dtype}'
+        if self.disperso:
+            tipo += f', disperso con {self.__data.nnz} valores no nulos'
+        return (f'ConjuntoDatos : {self.__data.shape[0]} filas, {self.__data.shape[1]} columnas, '
+                f'{tipo}, derivados {[llave[0] for llave in self.__derivados]}')
+
+    # Métodos
+    def derivado(self, llave, calcular):
+        '''Devuelve una estructura derivada de los datos, calculándola solo la primera vez.
+
+        Parameters
+        --------------
+        llave : tuple
+            Llave de la estructura, cuyo primer elemento es su nombre.
+        calcular : callable
+            Función sin argumentos que calcula la estructura.
+
+        Returns
+        -------------
+        derivado : object
+            Estructura guardada.
+        '''
+        if llave not in self.__derivados:
+            self.__derivados[llave] = calcular()
+        return self.__derivados[llave]
+
+    def escalado(self, tipo = 'estandar'):
+        '''Devuelve (y guarda) una variante escalada de los datos como un nuevo ConjuntoDatos.
+
+        Parameters
+        --------------
+        tipo : {'estandar', 'minmax', 'robusto'}, default 'estandar'
+            'estandar' resta la media y divide por la desviación estándar,
+            'minmax' lleva cada columna a [0, 1] y 'robusto' resta la mediana y
+            divide por el rango intercuartílico. Los datos dispersos no se
+            centran (ver centro_escala).
+
+        Returns
+        -------------
+        datos : ConjuntoDatos
+            Conjunto con los datos escalados, el mismo en cada llamada.
+        '''
+        def calcular():
+            X = self.__data
+            centro, escala = centro_escala(X, tipo)
+            return ConjuntoDatos(escalar(X, centro, escala), self.__feature_names, self.__target, X.dtype)
+
+        with fase('escalado', tipo = tipo):
+            return self.derivado(('escalado', tipo), calcular)
+
+    def distancias(self):
+        '''Devuelve (y guarda) la matriz de distancias euclídeas entre las filas.
+
+        Parameters
+        --------------
+        None
+
+        Returns
+        -------------
+        distancias : np.ndarray
+            Matriz de distancias de tamaño (n, n).
+        '''
+        from sklearn.metrics import pairwise_distances
+
+        def calcular():
+            with fase('distancias'):
+                return pairwise_distances(self.__data)
+        return self.derivado(('distancias',), calcular)
+
+    def indice_vecinos(self, algoritmo = 'auto'):
+        '''Devuelve (y guarda) el índice espacial de vecinos de los datos.
+
+        Parameters
+        --------------
+        algoritmo : {'auto', 'ball_tree', 'kd_tree', 'brute'}, default 'auto'
+            Algoritmo de sklearn.neighbors.NearestNeighbors.
+
+        Returns
+        -------------
+        indice : sklearn.neighbors.NearestNeighbors
+            Índice ajustado sobre los datos.
+        '''
+        from sklearn.neighbors import NearestNeighbors
+
+        def calcular():
+            with fase('indice', algoritmo = algoritmo):
+                return NearestNeighbors(algorithm = algoritmo).fit(self.__data)
+        return self.derivado(('indice', algoritmo), calcular)
+
+    def grafo_vecinos(self, radio, algoritmo = 'auto'):
+        '''Devuelve el grafo disperso de vecinos dentro de un radio, reutilizando el de radio mayor.
+
+        Parameters
+        --------------
+        radio : float
+            Radio máximo del grafo de vecindad.
+        algoritmo : {'auto', 'ball_tree', 'kd_tree', 'brute'}, default 'auto'
+            Algoritmo del índice de vecinos.
+
+        Returns
+        -------------
+        grafo : scipy.sparse.csr_matrix
+            Matriz dispersa con las distancias entre vecinos, con las filas
+            ordenadas por distancia. Puede incluir vecinos a más de radio si ya
+            había un grafo de radio mayor: para quedarse con los de radio se usa
+            dbscan._recortar_grafo, que da las mismas aristas que una búsqueda
+            directa en el índice.
+        '''
+        llave = ('grafo', algoritmo)
+        guardado = self.__derivados.get(llave)
+        if guardado is None or radio > guardado[0]:
+            indice = self.indice_vecinos(algoritmo)
+            with fase('grafo', radio = radio):
+                grafo = indice.radius_neighbors_graph(self.__data, radius = radio, mode = 'distance',
+                                                      sort_results = True)
+            guardado = (radio, grafo)
+            self.__derivados[llave] = guardado
+        return guardado[1]
+
+class MetodoBase():
+
+    # Nombre del método en los modelos guardados y en el Silhouette Score, y título de los gráficos
+    NOMBRE = None
+    TITULO = None
+    # Si el método trabaja directamente sobre matrices dispersas
+    DISPERSOS = True
+
+    # Constructor
+    def __init__(self, df, max_modelos = 8, preprocesamiento = None):
+        '''
+        Inicializa un objeto de la clase con los parámetros dados.
+
+        Parameters
+        ----------
+        df : sklearn.datasets o ConjuntoDatos
+            Dataset de sklearn.datasets al que se le va a aplicar el método. Si
+            es un ConjuntoDatos se comparte con los demás objetos que lo usen.
+            data puede ser una matriz dispersa de scipy, que no se densifica.
+        max_modelos : int, default 8
+            Cantidad máxima de modelos ajustados que se guardan en la cache.
+        preprocesamiento : preprocesamiento.Preprocesamiento, default None
+            Escalado y reducción de dimensión que se aplican antes del método.
+            Los DataFrames de resultados siguen mostrando las columnas originales
+            y predict transforma los datos nuevos de la misma forma.
+
+        Returns
+        -------
+        None
+        '''
+        self.__df = df
+        self.__preprocesamiento = preprocesamiento
+        self._modelos = CacheModelos(max_modelos)
+        self._ajustado = None
+        self.__preparar()
+
+    # Get
+    @property
+    def df(self):
+        '''
+        Obtiene el Dataset de sklearn.datasets en el que se va a trabajar
+
+        Returns
+        -------
+        df : sklearn.datasets
+            Dataset de sklearn.datasets.
+        '''
+        return self.__df
+
+    @property
+    def datos(self):
+        '''
+        Obtiene el conjunto de datos compartible con el que trabaja el método, ya preprocesado.
+
+        Returns
+        -------
+        datos : ConjuntoDatos
+            Datos contiguos y sus estructuras derivadas.
+        '''
+        return self._datos
+
+    @property
+    def preprocesamiento(self):
+        '''
+        Obtiene la etapa de preprocesamiento del objeto.
+
+        Returns
+        -------
+        preprocesamiento : preprocesamiento.Preprocesamiento o None
+            Escalado y reducción de dimensión, o None si se usan los datos originales.
+        '''
+        return self.__preprocesamiento
+
+    # Set
+    @df.setter
+    def df(self, nuevo_df):
+        '''
+        Establece un nuevo dataframe.
+
+        Parameters
+        ----------
+        df : sklearn.datasets o ConjuntoDatos
+            El nuevo dataset de sklearn.datasets.
+
+        Returns
+        -------
+        None
+        '''
+        self.__df = nuevo_df
+        self._modelos.limpiar()
+        self._limpiar()
+        self.__preparar()
+
+    @preprocesamiento.setter
+    def preprocesamiento(self, nuevo_preprocesamiento):
+        '''
+        Establece una nueva etapa de preprocesamiento.
+
+        Parameters
+        ----------
+        preprocesamiento : preprocesamiento.Preprocesamiento o None
+            La nueva etapa de preprocesamiento.
+
+        Returns
+        -------
+        None
+        '''
+        self.__preprocesamiento = nuevo_preprocesamiento
+        self._modelos.limpiar()
+        self._limpiar()
+        self.__preparar()
+
+    # Str
+    def __str__(self):
+        '''
+        Devuelve una representación de cadena del objeto.
+
+        Returns
+        -------
+        __str__ : str
+            Una cadena que representa el objeto con los valores actuales de sus atributos.
+        '''
+        return f'DataFrame : {self.__df}'
+
+    # Métodos
+    @instrumentado
+    def tabla_resumen(self, resultado = None, modo = 'exacto', tamano_bloque = 100000):
+        '''Genera una tabla resumen del dataset de sklearn.datasets con el que se va a trabajar.
+
+        Parameters
+        --------------
+        resultado : ResultadoClusters, default None
+            Si se indica, se resumen los datos junto con la columna 'cluster' del
+            resultado en lugar de la columna 'target'.
+        modo : {'exacto', 'streaming'}, default 'exacto'
+            En modo 'streaming' la tabla se calcula en una pasada por bloques, sin
+            copiar el dataset; los cuartiles son aproximados (sketch KLL). Con
+            datos dispersos la tabla siempre se calcula de forma exacta sobre
+            los valores no nulos (ver resumen.resumir_disperso).
+        tamano_bloque : int, default 100000
+            Cantidad de filas por bloque en modo 'streaming'.
+
+        Returns
+        -------------
+        resumen: pd.DataFrame
+                Tabla resumen del dataset de sklearn.datasets.
+        '''
+        import pandas as pd
+
+        if modo not in ('exacto', 'streaming'):
+            raise ValueError(f"Modo desconocido: {modo}")
+
+        if self._original.disperso:
+            if resultado is not None:
+                return resumir_disperso(resultado.X, resultado.feature_names, resultado.etiquetas, 'cluster')
+            return resumir_disperso(self._original.data, self._original.feature_names, self._original.target)
+
+        if modo == 'streaming':
+            if resultado is not None:
+                conjunto = Bunch(data = resultado.X, target = resultado.etiquetas,
+                                 feature_names = resultado.feature_names)
+                return resumir_dataset(conjunto, tamano_bloque, nombre_objetivo = 'cluster')
+            return resumir_dataset(self._original, tamano_bloque)
+
+        if resultado is not None:
+            return resultado.a_dataframe(copiar = False).describe()
+
+        dataset = pd.DataFrame(self._original.data, columns = self._original.feature_names)
+        if self._original.target is not None:
+            dataset['target'] = self._original.target
+        resumen = dataset.describe()
+        return resumen
+
+    @instrumentado
+    def predict(self, X_nuevo, tamano_lote = 100000):
+        '''Asigna un cluster a cada fila de X_nuevo con el modelo ajustado con fit.
+
+        Parameters
+        --------------
+        X_nuevo : np.ndarray o scipy.sparse matrix
+            Datos de tamaño (m, d), con las mismas columnas que df.data.
+        tamano_lote : int, default 100000
+            Cantidad de filas por lote.
+
+        Returns
+        -------------
+        etiquetas : np.ndarray
+            Etiquetas int32 de los clusters.
+        '''
+        return self._modelo_ajustado().predict(X_nuevo, tamano_lote)
+
+    def save(self, ruta, compress = 0):
+        '''Guarda el modelo ajustado en un archivo de joblib (ver artefactos.ModeloAjustado.save).
+
+        Parameters
+        --------------
+        ruta : str
+            Ruta del archivo.
+        compress : int, default 0
+            Nivel de compresión de joblib. Con compresión no se puede usar mmap.
+
+        Returns
+        -------------
+        None
+        '''
+        self._modelo_ajustado().save(ruta, compress)
+
+    @classmethod
+    def load(cls, ruta, df = None, mmap_mode = 'r'):
+        '''Crea un objeto de la clase con un modelo guardado con save, listo para predict.
+
+        Parameters
+        --------------
+        ruta : str
+            Ruta del archivo.
+        df : sklearn.datasets, default None
+            Dataset del objeto. No hace falta para predecir.
+        mmap_mode : {None, 'r', 'c'}, default 'r'
+            Modo de mapeo a memoria de los arreglos guardados.
+
+        Returns
+        -------------
+        objeto : MetodoBase
+            Objeto con el modelo cargado.
+        '''
+        modelo = ModeloAjustado.load(ruta, mmap_mode)
+        if modelo.metodo != cls.NOMBRE:
+            raise ValueError(f"El archivo tiene un modelo de {modelo.metodo}, no de {cls.NOMBRE}")
+        objeto = cls(df)
+        objeto._ajustado = modelo
+        return objeto
+
+    def __preparar(self):
+        # Datos originales, datos con los que trabaja el método y transformación entre ambos
+        self._original = None if self.__df is None else ConjuntoDatos.desde(self.__df)
+        self._datos = self._original
+        self._transformacion = None
+        if self._original is not None and self.__preprocesamiento is not None:
+            self._datos, self._transformacion = self.__preprocesamiento.aplicar(self._original)
+        if self._datos is not None and self._datos.disperso and not self.DISPERSOS:
+            raise ValueError(f"{self.NOMBRE} no admite datos dispersos: use un Preprocesamiento con "
+                             "reduccion 'svd', 'aleatoria' o 'dispersa' para obtener datos densos")
+
+    def _limpiar(self):
+        '''Descarta lo calculado con el dataset anterior. Cada método agrega sus propias estructuras.'''
+        self._ajustado = None
+
+    def _llave(self, *parametros):
+        '''Llave de la cache de modelos: algoritmo, parámetros y huella de los datos.'''
+        return (self.NOMBRE, parametros, self._datos.huella)
+
+    def _guardar_ajuste(self, parametros, **modelo):
+        '''Guarda el modelo que usa predict.'''
+        self._ajustado = ModeloAjustado(self.NOMBRE, parametros, feature_names = self._original.feature_names,
+                                        transformacion = self._transformacion, **modelo)
+        return self
+
+    def _modelo_ajustado(self):
+        if self._ajustado is None:
+            raise ValueError('Primero hay que ajustar el modelo con fit')
+        return self._ajustado
+
+    def _resultado(self, etiquetas, como_dataframe = True, estabilidad = None):
+        '''Construye el resultado con los datos originales, sin copiarlos, y, si se pide, su DataFrame (una copia modificable).'''
+        resultado = ResultadoClusters(self._original.data, etiquetas, self._original.feature_names, estabilidad)
+        if not como_dataframe:
+            return resultado
+        with fase('dataframe'):
+            return resultado.a_dataframe()
+
+    def _silueta(self, etiquetas, modo = 'auto', presupuesto = PRESUPUESTO, centroides = None, k = None):
+        '''Silhouette Score de unas etiquetas sobre los datos (ver silueta.puntaje_silueta).'''
+        with fase('silueta', modo = modo, k = k):
+            return puntaje_silueta(self._datos.data, etiquetas, modo, presupuesto, centroides = centroides)
+
+    def _graficar(self, resultado, modo = 'pairplot', archivo = None, **opciones):
+        '''Grafica un resultado con sns.pairplot o con graficos.graficar_escalable.'''
+        # Con datos dispersos el pairplot tendría que densificar todas las columnas
+        if modo == 'escalable' or not isinstance(resultado.X, np.ndarray):
+            graficar_escalable(resultado, f"{self.TITULO} Clusters", archivo = archivo, **opciones)
+            return
+
+        # Graficar
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+
+        dataset = resultado.a_dataframe(copiar = False)
+        pairplot = sns.pairplot(dataset, hue = 'cluster', palette = 'Accent')
+        pairplot.fig.suptitle(f"Pairplot con {self.TITULO} Clusters", y = 1.02)
+        if archivo is not None:
+            pairplot.savefig(archivo)
+            plt.close(pairplot.fig)
+        else:
+            plt.show()
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: sofiabocker
+
+Benchmark reproducible de las cuatro clases Metodo* sobre datos sintéticos.
+
+Cada caso (método, operación, filas, dimensiones) se corre en un proceso
+nuevo y su pico de memoria (RSS) se mide muestreando el RSS durante la
+operación, descontando el que había antes de llamarla. El reporte se
+guarda en JSON con los tiempos, los picos de memoria y el exponente de
+escalamiento de cada operación (pendiente de log(tiempo) contra log(n)).
+
+Con --importacion se mide en cambio el tiempo de importar cada módulo en un
+intérprete nuevo y qué dependencias pesadas quedan cargadas; si alguno supera
+--max-importacion segundos el programa termina con código 1.
+
+Uso:
+    python benchmark.py --tamanos 1000 10000 100000 --dimensiones 2 10 --salida reporte.json
+    python benchmark.py --importacion --max-importacion 0.5
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+# Parámetros de cada operación por clase
+METODOS = {
+    'MetodoKMeans': {'modulo': 'kmeans', 'parametros': (5,)},
+    'MetodoDBSCAN': {'modulo': 'dbscan', 'parametros': (0.5, 5)},
+    'MetodoAgglomerative': {'modulo': 'Agglomerative', 'parametros': (5,)},
+    'MetodoGaussian': {'modulo': 'Gaussian', 'parametros': (5,)},
+}
+
+OPERACIONES = ('clusters', 'silhouette', 'mejor_cluster')
+
+# Dependencias que no deberían cargarse al importar los módulos
+PESADAS = ('sklearn', 'scipy', 'pandas', 'matplotlib', 'seaborn')
+
+_SCRIPT_IMPORTACION = '''
+import json, sys, time
+inicio = time.perf_counter()
+import {modulo}
+tiempo = time.perf_counter() - inicio
+print(json.dumps({{'tiempo': tiempo, 'cargadas': [m for m in {pesadas!r} if m in sys.modules]}}))
+'''
+
+# Máxima cantidad de filas por (clase, operación); los casos más grandes se omiten
+LIMITES = {
+    ('MetodoAgglomerative', 'clusters'): 30000,
+    ('MetodoAgglomerative', 'silhouette'): 30000,
+    ('MetodoAgglomerative', 'mejor_cluster'): 30000,
+    ('MetodoDBSCAN', 'mejor_cluster'): 100000,
+    ('MetodoGaussian', 'mejor_cluster'): 100000,
+}
+
+def generar_datos(n, d, random_state = 0):
+    '''Genera blobs sintéticos con la forma de un dataset de sklearn.datasets.
+
+    Parameters
+    --------------
+    n : int
+        Cantidad de filas.
+    d : int
+        Cantidad de dimensiones.
+    random_state : int, default 0
+        Estado aleatorio.
+
+    Returns
+    -------------
+    df : sklearn.utils.Bunch
+        Dataset con data, target y feature_names.
+    '''
+    from sklearn.datasets import make_blobs
+    from sklearn.utils import Bunch
+
+    # La dispersión se ajusta a la dimensión para que las distancias dentro de
+    # un cluster queden en la escala de la grilla de eps de MetodoDBSCAN
+    X, y = make_blobs(n_samples = n, n_features = d, centers = 5, cluster_std = 0.5 / np.sqrt(d),
+                      random_state = random_state)
+    return Bunch(data = X, target = y, feature_names = [f'x{i}' for i in range(d)])
+
+def _rss_actual():
+    '''RSS actual del proceso en bytes, o None si no se puede leer (fuera de Linux).'''
+    try:
+        with open('/proc/self/statm') as archivo:
+            return int(archivo.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+class _MonitorRSS():
+    '''Muestrea el RSS actual en un hilo y guarda el máximo visto mientras está activo.'''
+
+    def __init__(self, intervalo = 0.002):
+        self.__intervalo = intervalo
+        self.__detener = threading.Event()
+        self.__hilo = threading.Thread(target = self.__muestrear, daemon = True)
+        self.pico = _rss_actual()
+
+    def __enter__(self):
+        self.__hilo.start()
+        return self
+
+    def __exit__(self, *excepcion):
+        self.__detener.set()
+        self.__hilo.join()
+        self.pico = max(self.pico, _rss_actual())
+        return False
+
+    def __muestrear(self):
+        while not self.__detener.wait(self.__intervalo):
+            self.pico = max(self.pico, _rss_actual())
+
+def _correr_caso(metodo, operacion, n, d, cola):
+    '''Corre un caso en el proceso actual y deja el resultado en la cola.
+
+    ru_maxrss es el máximo de toda la vida del proceso, así que incluye los
+    picos de importar y generar los datos. En Linux el pico de la operación se
+    mide muestreando el RSS actual durante la llamada; en otros sistemas se
+    usa ru_maxrss, que puede subestimarlo.
+    '''
+    import importlib
+
+    modulo = importlib.import_module(METODOS[metodo]['modulo'])
+    df = generar_datos(n, d)
+    objeto = getattr(modulo, metodo)(df)
+    parametros = METODOS[metodo]['parametros'] if operacion != 'mejor_cluster' else ()
+
+    if _rss_actual() is not None:
+        monitor = _MonitorRSS()
+        rss_base = monitor.pico
+        with monitor:
+            inicio = time.perf_counter()
+            inicio_cpu = time.process_time()
+            getattr(objeto, operacion)(*parametros)
+            tiempo = time.perf_counter() - inicio
+            tiempo_cpu = time.process_time() - inicio_cpu
+        rss_pico = monitor.pico
+    else:
+        # ru_maxrss está en KiB en Linux y en bytes en macOS
+        escala = 1 if platform.system() == 'Darwin' else 1024
+        rss_base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * escala
+        inicio = time.perf_counter()
+        inicio_cpu = time.process_time()
+        getattr(objeto, operacion)(*parametros)
+        tiempo = time.perf_counter() - inicio
+        tiempo_cpu = time.process_time() - inicio_cpu
+        rss_pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * escala
+
+    cola.put({'tiempo': tiempo,
+              'tiempo_cpu': tiempo_cpu,
+              'rss_pico': rss_pico,
+              'rss_datos': rss_base})
+
+def medir(metodo, operacion, n, d, tiempo_maximo):
+    '''Mide un caso en un proceso separado.
+
+    Parameters
+    --------------
+    metodo : str
+        Nombre de la clase.
+    operacion : str
+        Método de la clase a medir.
+    n : int
+        Cantidad de filas.
+    d : int
+        Cantidad de dimensiones.
+    tiempo_maximo : float
+        Segundos antes de cancelar el caso.
+
+    Returns
+    -------------
+    resultado : dict
+        Registro del caso con su estado, tiempo y memoria.
+    '''
+    registro = {'metodo': metodo, 'operacion': operacion, 'n': n, 'd': d}
+    if n > LIMITES.get((metodo, operacion), np.inf):
+        registro['estado'] = 'omitido'
+        return registro
+
+    contexto = multiprocessing.get_context('spawn')
+    cola = contexto.Queue()
+    proceso = contexto.Process(target = _correr_caso, args = (metodo, operacion, n, d, cola))
+    proceso.start()
+    proceso.join(tiempo_maximo)
+
+    if proceso.is_alive():
+        proceso.terminate()
+        proceso.join()
+        registro['estado'] = 'tiempo_agotado'
+    elif proceso.exitcode != 0 or cola.empty():
+        registro['estado'] = 'error'
+        registro['codigo_salida'] = proceso.exitcode
+    else:
+        registro['estado'] = 'ok'
+        registro.update(cola.get())
+    return registro
+
+def medir_importacion(modulo, repeticiones = 5):
+    '''Mide el tiempo de importar un módulo en intérpretes nuevos.
+
+    Parameters
+    --------------
+    modulo : str
+        Nombre del módulo a importar.
+    repeticiones : int, default 5
+        Cantidad de intérpretes en los que se mide; se informa la mediana.
+
+    Returns
+    -------------
+    resultado : dict
+        Mediana del tiempo y dependencias pesadas cargadas por la importación.
+    '''
+    directorio = os.path.dirname(os.path.abspath(__file__))
+    script = _SCRIPT_IMPORTACION.format(modulo = modulo, pesadas = PESADAS)
+    mediciones = []
+    for _ in range(repeticiones):
+        salida = subprocess.run([sys.executable, '-c', script], cwd = directorio, check = True,
+                                capture_output = True, text = True)
+        mediciones.append(json.loads(salida.stdout))
+    return {'modulo': modulo,
+            'tiempo': float(np.median([m['tiempo'] for m in mediciones])),
+            'cargadas': mediciones[0]['cargadas']}
+
+def exponentes(resultados):
+    '''Estima el exponente de escalamiento en n de cada (método, operación, dimensión).
+
+    Parameters
+    --------------
+    resultados : list of dict
+        Registros devueltos por medir.
+
+    Returns
+    -------------
+    exponentes : list of dict
+        Pendiente de log(tiempo) y de log(memoria) contra log(n).
+    '''
+    grupos = {}
+    for registro in resultados:
+        if registro['estado'] == 'ok':
+            llave = (registro['metodo'], registro['operacion'], registro['d'])
+            grupos.setdefault(llave, []).append(registro)
+
+    salida = []
+    for (metodo, operacion, d), registros in sorted(grupos.items()):
+        if len(registros) < 2:
+            continue
+        n = np.log([r['n'] for r in registros])
+        tiempo = np.log([max(r['tiempo'], 1e-9) for r in registros])
+        memoria = np.log([max(r['rss_pico'] - r['rss_datos'], 1) for r in registros])
+        salida.append({'metodo': metodo, 'operacion': operacion, 'd': d,
+                       'exponente_tiempo': float(np.polyfit(n, tiempo, 1)[0]),
+                       'exponente_memoria': float(np.polyfit(n, memoria, 1)[0])})
+    return salida
+
+def entorno():
+    '''Describe el entorno en el que se corrió el benchmark.'''
+    import sklearn
+    import pandas as pd
+
+    return {'python': platform.python_version(),
+            'plataforma': platform.platform(),
+            'procesadores': os.cpu_count(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'sklearn': sklearn.__version__}
+
+def main(argumentos = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark de las clases Metodo*')
+    parser.add_argument('--tamanos', type = int, nargs = '+', default = [1000, 10000, 100000, 1000000])
+    parser.add_argument('--dimensiones', type = int, nargs = '+', default = [2, 10, 50])
+    parser.add_argument('--metodos', nargs = '+', default = list(METODOS), choices = list(METODOS))
+    parser.add_argument('--operaciones', nargs = '+', default = list(OPERACIONES), choices = OPERACIONES)
+    parser.add_argument('--tiempo-maximo', type = float, default = 600)
+    parser.add_argument('--salida', default = 'reporte_benchmark.json')
+    parser.add_argument('--importacion', action = 'store_true')
+    parser.add_argument('--max-importacion', type = float, default = None)
+    argumentos = parser.parse_args(argumentos)
+
+    if argumentos.importacion:
+        modulos = [METODOS[metodo]['modulo'] for metodo in argumentos.metodos]
+        resultados = [medir_importacion(modulo) for modulo in modulos]
+        for registro in resultados:
+            print(json.dumps(registro))
+        with open(argumentos.salida, 'w') as archivo:
+            json.dump({'entorno': entorno(), 'importacion': resultados}, archivo, indent = 2)
+        if argumentos.max_importacion is not None and any(r['tiempo'] > argumentos.max_importacion
+                                                          for r in resultados):
+            sys.exit(1)
+        return resultados
+
+    resultados = []
+    for metodo in argumentos.metodos:
+        for operacion in argumentos.operaciones:
+            for d in argumentos.dimensiones:
+                for n in sorted(argumentos.tamanos):
+                    registro = medir(metodo, operacion, n, d, argumentos.tiempo_maximo)
+                    resultados.append(registro)
+                    print(json.dumps(registro))
+
+    reporte = {'entorno': entorno(),
+               'resultados': resultados,
+               'exponentes': exponentes(resultados)}
+    with open(argumentos.salida, 'w') as archivo:
+        json.dump(reporte, archivo, indent = 2)
+    return reporte
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: sofiabocker
+"""
+
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+def huella(X):
+    '''Calcula una huella del contenido de una matriz para usarla como llave de cache.
+
+    Parameters
+    --------------
+    X : np.ndarray o scipy.sparse matrix
+        Datos a identificar.
+
+    Returns
+    -------------
+    huella : str
+        Resumen hexadecimal de la forma, el tipo y los bytes de X (de sus
+        arreglos CSR si es dispersa).
+    '''
+    from scipy.sparse import issparse
+
+    if issparse(X):
+        X = X.tocsr()
+        partes = [np.ascontiguousarray(X.data), np.ascontiguousarray(X.indices), np.ascontiguousarray(X.indptr)]
+        forma = ('csr', X.shape, X.dtype.str)
+    else:
+        partes = [np.ascontiguousarray(X)]
+        forma = (partes[0].shape, partes[0].dtype.str)
+    resumen = hashlib.blake2b(digest_size = 16)
+    resumen.update(str(forma).encode())
+    for parte in partes:
+        resumen.update(memoryview(parte).cast('B'))
+    return resumen.hexdigest()
+
+class CacheModelos():
+
+    # Constructor
+    def __init__(self, max_modelos = 8):
+        '''
+        Inicializa una cache LRU de modelos ajustados.
+
+        Parameters
+        ----------
+        max_modelos : int, default 8
+            Cantidad máxima de modelos guardados. Al superarla se descarta el
+            usado hace más tiempo.
+
+        Returns
+        -------
+        None
+        '''
+        self.__max_modelos = max_modelos
+        self.__modelos = OrderedDict()
+
+    def __len__(self):
+        return len(self.__modelos)
+
+    def __contains__(self, llave):
+        return llave in self.__modelos
+
+    # Métodos
+    def obtener(self, llave, ajustar):
+        '''Devuelve el modelo guardado con la llave o lo ajusta y lo guarda.
+
+        Parameters
+        --------------
+        llave : tuple
+            Llave del modelo, por ejemplo (algoritmo, parámetros, huella de los datos).
+        ajustar : callable
+            Función sin argumentos que ajusta y devuelve el modelo.
+
+        Returns
+        -------------
+        modelo : object
+            Modelo ajustado.
+        '''
+        if llave in self.__modelos:
+            self.__modelos.move_to_end(llave)
+            return self.__modelos[llave]
+
+        modelo = ajustar()
+        self.__modelos[llave] = modelo
+        if len(self.__modelos) > self.__max_modelos:
+            self.__modelos.popitem(last = False)
+        return modelo
+
+    def limpiar(self):
+        '''Descarta todos los modelos guardados.
+
+        Parameters
+        --------------
+        None
+
+        Returns
+        -------------
+        None
+        '''
+        self.__modelos.clear()
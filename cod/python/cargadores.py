@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: sofiabocker
+"""
+
+import numpy as np
+
+class Bunch(dict):
+    '''Diccionario con acceso por atributo, con la misma forma que los datasets de sklearn.datasets.'''
+
+    def __getattr__(self, llave):
+        try:
+            return self[llave]
+        except KeyError:
+            raise AttributeError(llave)
+
+    def __setattr__(self, llave, valor):
+        self[llave] = valor
+
+def _conjunto(X, feature_names, target = None):
+    conjunto = Bunch(data = X, feature_names = list(feature_names))
+    if target is not None:
+        conjunto.target = target
+    return conjunto
+
+def cargar_parquet(ruta, columnas = None, columna_objetivo = None, dtype = np.float32, tamano_bloque = 100000):
+    '''Carga un archivo Parquet leyendo solo las columnas pedidas.
+
+    El archivo se recorre por lotes de filas y cada lote de Arrow se copia una
+    sola vez, directamente a la matriz final, sin pasar por un DataFrame de
+    pandas ni tener la tabla completa en memoria.
+
+    Parameters
+    --------------
+    ruta : str
+        Ruta del archivo Parquet.
+    columnas : list of str, default None
+        Columnas a usar como variables. Si es None se usan todas menos la objetivo.
+    columna_objetivo : str, default None
+        Columna que se guarda como target.
+    dtype : np.dtype, default np.float32
+        Tipo de la matriz de datos.
+    tamano_bloque : int, default 100000
+        Cantidad de filas leídas por lote.
+
+    Returns
+    -------------
+    df : Bunch
+        Dataset con data, feature_names y, si se indicó, target.
+    '''
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError('Para cargar archivos Parquet se necesita pyarrow (pip install pyarrow)')
+
+    archivo = pq.ParquetFile(ruta)
+    if columnas is None:
+        columnas = [c for c in archivo.schema_arrow.names if c != columna_objetivo]
+    leer = list(columnas) + ([columna_objetivo] if columna_objetivo is not None else [])
+
+    # Los metadatos dan la cantidad de filas sin leer los datos
+    X = np.empty((archivo.metadata.num_rows, len(columnas)), dtype = dtype)
+    target = [] if columna_objetivo is not None else None
+    inicio = 0
+    for lote in archivo.iter_batches(batch_size = tamano_bloque, columns = leer):
+        for j, columna in enumerate(columnas):
+            X[inicio:inicio + lote.num_rows, j] = lote.column(columna).to_numpy(zero_copy_only = False)
+        if target is not None:
+            target.append(lote.column(columna_objetivo).to_numpy(zero_copy_only = False))
+        inicio += lote.num_rows
+
+    if target is not None:
+        target = np.concatenate(target) if target else np.empty(0)
+    return _conjunto(X, columnas, target)
+
+def cargar_csv(ruta, columnas = None, columna_objetivo = None, dtype = np.float32, tamano_bloque = 100000,
+               **opciones):
+    '''Carga un archivo CSV por bloques en una matriz reservada de antemano.
+
+    Se cuentan primero las filas del archivo para reservar la matriz final y
+    luego se llena bloque a bloque, de modo que nunca se tiene el archivo
+    completo en un DataFrame.
+
+    Parameters
+    --------------
+    ruta : str
+        Ruta del archivo CSV.
+    columnas : list of str, default None
+        Columnas a usar como variables. Si es None se usan todas menos la objetivo.
+    columna_objetivo : str, default None
+        Columna que se guarda como target.
+    dtype : np.dtype, default np.float32
+        Tipo de la matriz de datos.
+    tamano_bloque : int, default 100000
+        Cantidad de filas leídas por bloque.
+    **opciones
+        Argumentos adicionales de pd.read_csv, por ejemplo header = None para
+        archivos sin encabezado.
+
+    Returns
+    -------------
+    df : Bunch
+        Dataset con data, feature_names y, si se indicó, target.
+    '''
+    import os
+    import pandas as pd
+
+    if os.path.getsize(ruta) == 0:
+        raise ValueError(f"El archivo CSV está vacío: {ruta}")
+
+    if columnas is None:
+        encabezado = pd.read_csv(ruta, nrows = 0, **opciones).columns
+        columnas = [c for c in encabezado if c != columna_objetivo]
+    leer = list(columnas) + ([columna_objetivo] if columna_objetivo is not None else [])
+
+    # Líneas de encabezado según el argumento header de pd.read_csv
+    header = opciones.get('header', 'infer')
+    if header == 'infer':
+        header = None if opciones.get('names') is not None else 0
+    if header is None:
+        lineas_encabezado = 0
+    elif isinstance(header, (list, tuple)):
+        lineas_encabezado = max(header) + 1
+    else:
+        lineas_encabezado = header + 1
+
+    with open(ruta, 'rb') as archivo:
+        n = 0
+        ultimo = b'\n'
+        for bloque in iter(lambda: archivo.read(1 << 20), b''):
+            n += bloque.count(b'\n')
+            ultimo = bloque[-1:]
+        if ultimo != b'\n':
+            n += 1
+    n = max(n - lineas_encabezado, 0)
+
+    X = np.empty((n, len(columnas)), dtype = dtype)
+    target = [] if columna_objetivo is not None else None
+    inicio = 0
+    for bloque in pd.read_csv(ruta, usecols = leer, chunksize = tamano_bloque, **opciones):
+        X[inicio:inicio + len(bloque)] = bloque[list(columnas)].to_numpy(dtype = dtype)
+        if target is not None:
+            target.append(bloque[columna_objetivo].to_numpy())
+        inicio += len(bloque)
+
+    # Por si el archivo tiene líneas vacías al final
+    X = X[:inicio]
+    if target is not None:
+        target = np.concatenate(target)
+    return _conjunto(X, columnas, target)
+
+def cargar_npy(ruta, feature_names = None, ruta_objetivo = None, mmap = True):
+    '''Abre un archivo .npy mapeado a memoria, sin leerlo completo.
+
+    El tipo de los datos se respeta tal como está en el archivo, porque
+    convertirlo obligaría a copiarlo completo en memoria.
+
+    Parameters
+    --------------
+    ruta : str
+        Ruta del archivo .npy con una matriz de tamaño (n, d).
+    feature_names : list of str, default None
+        Nombres de las columnas. Si es None se usan x0, x1, ...
+    ruta_objetivo : str, default None
+        Ruta de un archivo .npy con el target.
+    mmap : bool, default True
+        Si es False el archivo se carga completo en memoria.
+
+    Returns
+    -------------
+    df : Bunch
+        Dataset con data, feature_names y, si se indicó, target.
+    '''
+    modo = 'r' if mmap else None
+    X = np.load(ruta, mmap_mode = modo)
+    if feature_names is None:
+        feature_names = [f'x{i}' for i in range(X.shape[1])]
+    target = np.load(ruta_objetivo, mmap_mode = modo) if ruta_objetivo is not None else None
+    return _conjunto(X, feature_names, target)
+
+def cargar_npz(ruta, feature_names = None, ruta_objetivo = None, dtype = np.float32):
+    '''Carga una matriz dispersa guardada con scipy.sparse.save_npz, sin densificarla.
+
+    Parameters
+    --------------
+    ruta : str
+        Ruta del archivo .npz con una matriz dispersa de tamaño (n, d).
+    feature_names : list of str, default None
+        Nombres de las columnas. Si es None se usan x0, x1, ...
+    ruta_objetivo : str, default None
+        Ruta de un archivo .npy con el target.
+    dtype : np.dtype, default np.float32
+        Tipo de los valores no nulos.
+
+    Returns
+    -------------
+    df : Bunch
+        Dataset con data (scipy.sparse.csr_matrix), feature_names y, si se
+        indicó, target.
+    '''
+    from scipy.sparse import load_npz
+
+    X = load_npz(ruta).tocsr().astype(dtype, copy = False)
+    if feature_names is None:
+        feature_names = [f'x{i}' for i in range(X.shape[1])]
+    target = np.load(ruta_objetivo) if ruta_objetivo is not None else None
+    return _conjunto(X, feature_names, target)
+
+def lotes(fuente, tamano_lote):
+    '''Devuelve una función que recorre la fuente por lotes de filas cada vez que se llama.
+
+    Parameters
+    --------------
+    fuente : str, np.ndarray, scipy.sparse matrix o callable
+        Ruta a un archivo .npy (se abre con mmap), arreglo (por ejemplo np.memmap
+        o una matriz CSR) o función sin argumentos que devuelve un iterador nuevo
+        de lotes.
+    tamano_lote : int
+        Cantidad de filas por lote cuando la fuente es un arreglo.
+
+    Returns
+    -------------
+    lotes : callable
+        Función sin argumentos que devuelve un iterador de lotes.
+    '''
+    if callable(fuente):
+        return fuente
+    if isinstance(fuente, str):
+        fuente = np.load(fuente, mmap_mode = 'r')
+
+    def recorrer():
+        for inicio in range(0, fuente.shape[0], tamano_lote):
+            yield fuente[inicio:inicio + tamano_lote]
+    return recorrer
+
+def cargar(ruta, **opciones):
+    '''Carga un dataset eligiendo el cargador según la extensión del archivo.
+
+    Parameters
+    --------------
+    ruta : str
+        Ruta de un archivo .parquet, .csv, .npy o .npz (matriz dispersa).
+    **opciones
+        Argumentos del cargador correspondiente.
+
+    Returns
+    -------------
+    df : Bunch
+        Dataset listo para las clases Metodo*.
+    '''
+    extension = ruta.lower().rsplit('.', 1)[-1]
+    if extension in ('parquet', 'pq'):
+        return cargar_parquet(ruta, **opciones)
+    if extension == 'csv':
+        return cargar_csv(ruta, **opciones)
+    if extension == 'npy':
+        return cargar_npy(ruta, **opciones)
+    if extension == 'npz':
+        return cargar_npz(ruta, **opciones)
+    raise ValueError(f"Extensión de archivo no soportada: {extension}")
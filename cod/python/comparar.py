@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: sofiabocker
+"""
+
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from base import ConjuntoDatos
+
+# Clase, módulo y columnas de parámetros de la tabla de mejor_cluster de cada método
+METODOS = {
+    'KMeans': ('kmeans', 'MetodoKMeans', ['k']),
+    'DBSCAN': ('dbscan', 'MetodoDBSCAN', ['eps', 'min_samples']),
+    'Agglomerative': ('Agglomerative', 'MetodoAgglomerative', ['k']),
+    'GaussianMixture': ('Gaussian', 'MetodoGaussian', ['k']),
+}
+
+# Parámetro de mejor_cluster que recorre la grilla de cada método y sus valores por defecto:
+# cada valor se corre como una tarea aparte del grupo de procesos
+GRILLAS = {
+    'KMeans': ('k_values', range(2, 11)),
+    'DBSCAN': ('eps_values', np.arange(0.3, 1.2, 0.1)),
+    'Agglomerative': ('k_values', range(2, 11)),
+    'GaussianMixture': ('components_values', range(2, 11)),
+}
+
+_VARIABLES_HILOS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                    'BLIS_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+# Estado de cada proceso: el dataset se envía una sola vez por proceso y cada
+# método se crea una sola vez, así sus caches sirven para todas sus tareas
+_df_trabajador = None
+_limites_trabajador = None
+_objetos_trabajador = {}
+
+def _iniciar_trabajador(df, hilos):
+    '''Guarda el dataset y limita los hilos de BLAS/OpenMP del proceso.'''
+    global _df_trabajador, _limites_trabajador
+    from threadpoolctl import threadpool_limits
+
+    for variable in _VARIABLES_HILOS:
+        os.environ[variable] = str(hilos)
+    _limites_trabajador = threadpool_limits(limits = hilos)
+    _df_trabajador = df
+
+def _clase(metodo):
+    '''Importa la clase Metodo* de un método.'''
+    import importlib
+
+    modulo, clase, _ = METODOS[metodo]
+    return getattr(importlib.import_module(modulo), clase)
+
+def _barrido(metodo, opciones):
+    '''Corre mejor_cluster de un método sobre el dataset del proceso.'''
+    if metodo not in _objetos_trabajador:
+        _objetos_trabajador[metodo] = _clase(metodo)(_df_trabajador)
+    objeto = _objetos_trabajador[metodo]
+    inicio = time.perf_counter()
+    resultados = objeto.mejor_cluster(**opciones)
+    return resultados, time.perf_counter() - inicio
+
+def comparar(df, metodos = None, n_jobs = None, hilos = None, opciones = None):
+    '''Corre los barridos de mejor_cluster de varios métodos en un mismo grupo de procesos.
+
+    Cada valor de la grilla de cada método (ver GRILLAS) es una tarea aparte,
+    así que los procesos se reparten los puntos de todas las grillas y no solo
+    los métodos. Los puntos que fallan se avisan con warnings y se omiten.
+
+    Parameters
+    --------------
+    df : sklearn.datasets o ConjuntoDatos
+        Dataset de sklearn.datasets al que se le van a aplicar los métodos.
+    metodos : list of str, default None
+        Métodos a comparar, entre las llaves de METODOS. Si es None se usan todos
+        los que admiten los datos (con datos dispersos, solo KMeans y DBSCAN).
+    n_jobs : int, default None
+        Cantidad de procesos. Si es None se usa uno por núcleo, sin superar la
+        cantidad de tareas.
+    hilos : int, default None
+        Total de hilos de BLAS/OpenMP repartidos entre los procesos. Si es None
+        se usa la cantidad de núcleos.
+    opciones : dict, default None
+        Argumentos de mejor_cluster para cada método, por ejemplo
+        {'KMeans': {'random_state': 0}}. Si incluyen el parámetro de la grilla,
+        sus valores reemplazan a los de GRILLAS.
+
+    Returns
+    -------------
+    ranking : pd.DataFrame
+        Mejor configuración de cada método ordenada por Silhouette Score; el
+        tiempo es la suma de sus tareas. Sin métodos válidos queda vacío.
+    '''
+    import pandas as pd
+
+    # Una sola copia contigua de los datos, compartida por los métodos de cada proceso
+    datos = ConjuntoDatos.desde(df)
+
+    if metodos is None:
+        metodos = [metodo for metodo in METODOS if not datos.disperso or _clase(metodo).DISPERSOS]
+    metodos = list(metodos)
+    opciones = opciones or {}
+    # Una tarea por método y valor de su grilla, todas en el mismo grupo de procesos
+    tareas = []
+    for metodo in metodos:
+        parametro, valores = GRILLAS[metodo]
+        opciones_metodo = dict(opciones.get(metodo, {}))
+        valores = opciones_metodo.pop(parametro, valores)
+        tareas.extend((metodo, parametro, valor, {**opciones_metodo, parametro: [valor]}) for valor in valores)
+
+    nucleos = os.cpu_count() or 1
+    if n_jobs is None:
+        n_jobs = max(1, min(len(tareas), nucleos))
+    if hilos is None:
+        hilos = nucleos
+    hilos_por_proceso = max(1, hilos // n_jobs)
+
+    with ProcessPoolExecutor(max_workers = n_jobs, initializer = _iniciar_trabajador,
+                             initargs = (datos, hilos_por_proceso)) as pool:
+        futuros = [pool.submit(_barrido, metodo, opciones_tarea) for metodo, _, _, opciones_tarea in tareas]
+        barridos = {metodo: [] for metodo in metodos}
+        for (metodo, parametro, valor, _), futuro in zip(tareas, futuros):
+            try:
+                barridos[metodo].append(futuro.result())
+            except Exception as error:
+                warnings.warn(f"{metodo} falló con {parametro}={valor}: {type(error).__name__}: {error}")
+
+    filas = []
+    for metodo, partes in barridos.items():
+        if not partes:
+            continue
+        resultados = pd.concat([resultado for resultado, _ in partes], ignore_index = True)
+        if 'silhouette' not in resultados:
+            continue
+        columnas = METODOS[metodo][2]
+        validos = resultados.dropna(subset = ['silhouette'])
+        if validos.empty:
+            continue
+        mejor = validos['silhouette'].idxmax()
+        filas.append({'metodo': metodo,
+                      'parametros': ', '.join(f'{columna}={resultados.at[mejor, columna]}' for columna in columnas),
+                      'silhouette': resultados.at[mejor, 'silhouette'],
+                      'configuraciones': len(resultados),
+                      'tiempo': sum(tiempo for _, tiempo in partes)})
+
+    ranking = pd.DataFrame(filas, columns = ['metodo', 'parametros', 'silhouette', 'configuraciones', 'tiempo'])
+    ranking = ranking.sort_values('silhouette', ascending = False, na_position = 'last', ignore_index = True)
+    ranking.index = ranking.index + 1
+    return ranking
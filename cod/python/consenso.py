@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: sofiabocker
+"""
+
+import numpy as np
+
+def correr_semillas(ajustar, X, k, semillas, n_jobs = 1):
+    '''Corre un mismo clustering con varias semillas y junta las etiquetas.
+
+    Con n_jobs > 1 los procesos se crean con joblib, que guarda X una sola vez
+    en un archivo mapeado a memoria y lo comparte entre todos los procesos en
+    lugar de copiarlo a cada uno.
+
+    Parameters
+    --------------
+    ajustar : callable
+        Función de nivel de módulo ajustar(X, k, semilla) que devuelve las etiquetas.
+    X : np.ndarray
+        Datos de tamaño (n, d).
+    k : int
+        Número de clusters.
+    semillas : iterable of int
+        Semillas de cada corrida.
+    n_jobs : int, default 1
+        Cantidad de procesos. -1 usa todos los núcleos.
+
+    Returns
+    -------------
+    etiquetas : np.ndarray
+        Etiquetas int32 de tamaño (corridas, n).
+    '''
+    semillas = list(semillas)
+    if n_jobs == 1:
+        corridas = [ajustar(X, k, semilla) for semilla in semillas]
+    else:
+        from joblib import Parallel, delayed
+
+        corridas = Parallel(n_jobs = n_jobs, max_nbytes = '1M')(delayed(ajustar)(X, k, semilla)
+                                                              for semilla in semillas)
+    return np.asarray(corridas, dtype = np.int32)
+
+def _una_caliente(etiquetas, filas):
+    '''Codifica las filas pedidas de todas las corridas: una columna por cada cluster de cada corrida.'''
+    corridas = len(etiquetas)
+    clusters = int(etiquetas.max()) + 1
+    codigo = np.zeros((len(filas), corridas * clusters), dtype = np.float32)
+    columnas = etiquetas[:, filas].T + np.arange(corridas) * clusters
+    codigo[np.arange(len(filas))[:, None], columnas] = 1
+    return codigo
+
+def coasociacion(etiquetas, filas = None, columnas = None):
+    '''Calcula la fracción de corridas en que cada par de puntos queda en el mismo cluster.
+
+    Parameters
+    --------------
+    etiquetas : np.ndarray
+        Etiquetas de tamaño (corridas, n), con valores entre 0 y k - 1.
+    filas : np.ndarray, default None
+        Índices de las filas de la matriz. Si es None se usan todos los puntos.
+    columnas : np.ndarray, default None
+        Índices de las columnas de la matriz. Si es None se usan todos los puntos.
+
+    Returns
+    -------------
+    coasociacion : np.ndarray
+        Matriz float32 con valores entre 0 y 1.
+    '''
+    todos = np.arange(etiquetas.shape[1])
+    izquierda = _una_caliente(etiquetas, todos if filas is None else filas)
+    derecha = izquierda if columnas is filas else _una_caliente(etiquetas, todos if columnas is None else columnas)
+    return (izquierda @ derecha.T) / len(etiquetas)
+
+def _afinidad(matriz, filas, anclas, pertenencia):
+    '''Coasociación promedio de cada fila con las anclas de cada grupo, sin contar la fila consigo misma.
+
+    La coasociación de un ancla consigo misma siempre es 1: se quita de la suma
+    y del tamaño de su grupo, para que anclas y demás puntos se midan igual.
+    Modifica matriz, la coasociación de las filas con las anclas.
+    '''
+    posiciones = np.minimum(np.searchsorted(anclas, filas), len(anclas) - 1)
+    propias = np.flatnonzero(anclas[posiciones] == filas)
+    matriz[propias, posiciones[propias]] = 0
+    sumas = matriz @ pertenencia
+    tamanos = np.repeat(pertenencia.sum(axis = 0)[None, :], len(filas), axis = 0)
+    tamanos[propias] -= pertenencia[posiciones[propias]]
+    return np.divide(sumas, tamanos, out = np.zeros_like(sumas), where = tamanos > 0)
+
+def etiquetas_consenso(etiquetas, k, max_n_denso = 4000, n_anclas = 1000, random_state = None):
+    '''Combina las etiquetas de varias corridas en un clustering de consenso.
+
+    Los puntos se agrupan con enlace promedio sobre 1 - coasociación. Con más de
+    max_n_denso puntos no se construye la matriz de n x n: se agrupa una muestra
+    de anclas y cada punto va al cluster de anclas con el que más veces coincidió.
+
+    Parameters
+    --------------
+    etiquetas : np.ndarray
+        Etiquetas de tamaño (corridas, n).
+    k : int
+        Número de clusters del consenso.
+    max_n_denso : int, default 4000
+        Máxima cantidad de puntos para usar la matriz de coasociación completa.
+    n_anclas : int, default 1000
+        Cantidad de anclas cuando n supera max_n_denso.
+    random_state : int, default None
+        Estado aleatorio de la elección de anclas.
+
+    Returns
+    -------------
+    consenso : np.ndarray
+        Etiquetas int32 de consenso.
+    estabilidad : np.ndarray
+        Coasociación promedio de cada punto con su cluster de consenso (o con
+        las anclas de su cluster), sin contar al punto consigo mismo, entre 0 y
+        1. Es 0 para un ancla que quedó sola en su grupo.
+    '''
+    from sklearn.cluster import AgglomerativeClustering
+
+    n = etiquetas.shape[1]
+    if n <= max_n_denso:
+        anclas = np.arange(n)
+    else:
+        anclas = np.sort(np.random.default_rng(random_state).choice(n, n_anclas, replace = False))
+
+    # Agrupar las anclas con la coasociación entre ellas
+    matriz = coasociacion(etiquetas, anclas, anclas)
+    agrupamiento = AgglomerativeClustering(n_clusters = k, metric = 'precomputed', linkage = 'average')
+    grupos = agrupamiento.fit_predict(1 - matriz)
+
+    # Coasociación promedio de cada punto con las anclas de cada grupo
+    pertenencia = np.zeros((len(anclas), k), dtype = np.float32)
+    pertenencia[np.arange(len(anclas)), grupos] = 1
+    if n <= max_n_denso:
+        afinidad = _afinidad(matriz, np.arange(n), anclas, pertenencia)
+    else:
+        afinidad = np.vstack([_afinidad(coasociacion(etiquetas, filas, anclas), filas, anclas, pertenencia)
+                              for filas in (np.arange(inicio, min(inicio + max_n_denso, n))
+                                            for inicio in range(0, n, max_n_denso))])
+
+    consenso = afinidad.argmax(axis = 1).astype(np.int32)
+    # Un ancla sola en su grupo no tiene con quién compararse: conserva su grupo
+    solas = np.bincount(grupos, minlength = k)[grupos] == 1
+    consenso[anclas[solas]] = grupos[solas]
+    estabilidad = afinidad[np.arange(n), consenso]
+    return consenso, estabilidad
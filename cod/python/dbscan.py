@@ -4,96 +4,348 @@
 @author: sofiabocker
 """
 
-import matplotlib.pyplot as plt
-from sklearn.cluster import DBSCAN
-from sklearn.metrics import silhouette_score
-import seaborn as sns
-import pandas as pd
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 
-from sklearn.datasets import load_iris, load_digits, load_wine, load_breast_cancer, load_diabetes, load_linnerud
+from silueta import puntaje_silueta, PRESUPUESTO
+from base import MetodoBase
+from instrumentacion import fase, instrumentado
+
+# Estado de cada proceso del barrido: el grafo, los datos y el índice se envían una sola vez
+_grafo_trabajador = None
+_X_trabajador = None
+_indice_trabajador = None
+_opciones_silueta = {}
+
+def _iniciar_trabajador(grafo, X, opciones_silueta = None, indice = None):
+    global _grafo_trabajador, _X_trabajador, _opciones_silueta, _indice_trabajador
+    _grafo_trabajador = grafo
+    _X_trabajador = X
+    _opciones_silueta = opciones_silueta or {}
+    _indice_trabajador = indice
+
+def _recortar_grafo(grafo, eps, indice = None, X = None):
+    '''Se queda con las aristas del grafo que devolvería una búsqueda directa en el índice con radio eps.
+
+    El índice compara distancias al cuadrado en las hojas y cotas de distancia
+    en los nodos, así que una arista de largo guardado igual a eps (salvo
+    redondeo) puede quedar dentro o fuera. Las filas con aristas en ese borde
+    se vuelven a consultar en el índice con radio eps, de modo que el grafo
+    recortado es el mismo que se obtendría sin reutilizar uno de radio mayor.
+    '''
+    from scipy.sparse import csr_matrix
+    
+    # Se conservan los ceros explícitos, que corresponden al propio punto y a duplicados
+    mascara = grafo.data <= eps
+    dudosas = np.flatnonzero(np.abs(grafo.data - eps) <= 1e-9 * max(eps, 1.0))
+    if len(dudosas) and indice is not None:
+        filas_aristas = np.repeat(np.arange(grafo.shape[0]), np.diff(grafo.indptr))
+        filas = np.unique(filas_aristas[dudosas])
+        vecinos = indice.radius_neighbors(X[filas], radius = eps, return_distance = False)
+        # Pares (fila, columna) de la consulta directa, codificados como un entero
+        directos = np.concatenate([fila * grafo.shape[1] + columnas.astype(np.int64)
+                                   for fila, columnas in zip(filas.astype(np.int64), vecinos)])
+        pares = filas_aristas[dudosas].astype(np.int64) * grafo.shape[1] + grafo.indices[dudosas]
+        mascara[dudosas] = np.isin(pares, directos)
+    
+    # Las filas sin aristas (o que quedan vacías) tienen conteo 0
+    acumulado = np.concatenate(([0], np.cumsum(mascara)))
+    indptr = acumulado[grafo.indptr]
+    # DBSCAN con metric = 'precomputed' vuelve a filtrar con distancia <= eps
+    datos = np.minimum(grafo.data[mascara], eps)
+    return csr_matrix((datos, grafo.indices[mascara], indptr), shape = grafo.shape)
+
+def _etiquetas_eps(eps, min_samples_values):
+    '''Deriva las etiquetas de DBSCAN para un eps y todos los min_samples a partir del grafo.'''
+    from sklearn.cluster import DBSCAN
+    
+    grafo = _recortar_grafo(_grafo_trabajador, eps, _indice_trabajador, _X_trabajador)
+    
+    etiquetas = []
+    for min_samples in min_samples_values:
+        dbscan = DBSCAN(eps = eps, min_samples = min_samples, metric = 'precomputed')
+        etiquetas.append(dbscan.fit_predict(grafo).astype(np.int32))
+    return etiquetas
+
+def _etiquetas_corte(hdbscan, eps):
+    '''Corta la jerarquía de HDBSCAN a la altura eps: etiquetas de DBSCAN* en tiempo lineal.'''
+    # Con min_cluster_size = 2 solo los puntos centrales aislados quedan como ruido
+    return hdbscan.dbscan_clustering(cut_distance = eps, min_cluster_size = 2).astype(np.int32)
+
+def _llave_etiquetas(resultado):
+    return resultado.tobytes()
+
+def _etiquetas_unicas(etiquetas):
+    unicas = {}
+    for etiquetas_eps in etiquetas:
+        for resultado in etiquetas_eps:
+            unicas.setdefault(_llave_etiquetas(resultado), resultado)
+    return unicas
+
+def _silueta(resultado):
+    # Calcular Silhouette Score solo si hay más de un cluster
+    if len(set(resultado)) > 1:
+        return puntaje_silueta(_X_trabajador, resultado, **_opciones_silueta).valor
+    return np.nan
 
-class MetodoDBSCAN():
+class MetodoDBSCAN(MetodoBase):
+    
+    NOMBRE = 'DBSCAN'
+    TITULO = 'DBSCAN'
     
     # Constructor
-    def __init__(self, df):
+    def __init__(self, df, max_modelos = 8, radio_indice = None, algoritmo = 'auto', preprocesamiento = None):
         '''
         Inicializa un objeto de la clase con los parámetros dados.
     
         Parameters
         ----------
-        df : pd.DataFrame
-            Dataset de sklearn.datasets al que se le va a aplicar el método
+        df : sklearn.datasets o ConjuntoDatos
+            Dataset de sklearn.datasets al que se le va a aplicar el método. Si
+            es un ConjuntoDatos se comparte el índice y el grafo de vecinos con
+            los demás objetos que lo usen.
+        max_modelos : int, default 8
+            Cantidad máxima de modelos ajustados que se guardan en la cache.
+        radio_indice : float, default None
+            Radio mínimo del grafo de vecinos que se construye en el primer ajuste.
+            Todo eps menor o igual reutiliza el grafo sin volver a buscar vecinos.
+        algoritmo : {'auto', 'ball_tree', 'kd_tree', 'brute'}, default 'auto'
+            Índice espacial de NearestNeighbors que se construye una sola vez.
+        preprocesamiento : preprocesamiento.Preprocesamiento, default None
+            Escalado y reducción de dimensión que se aplican antes del método
+            (ver base.MetodoBase).
     
         Returns
         -------
         None
         '''
-        self.__df = df
+        super().__init__(df, max_modelos, preprocesamiento)
+        self.__radio_indice = radio_indice
+        self.__algoritmo = algoritmo
+        self.__barridos = {}
     
-    # Get
-    @property
-    def df(self):
-        '''
-        Obtiene el Dataset de sklearn.datasets en el que se va a trabajar
+    # Métodos
+    def _limpiar(self):
+        super()._limpiar()
+        self.__barridos = {}
     
-        Returns
-        -------
-        df : sklearn.datasets
-            Dataset de sklearn.datasets.
-        '''
-        return self.__df
+    @instrumentado
+    def clusters(self, eps, min_samples, como_dataframe = True):
+        '''Realiza el clustering con DBSCAN y devuelve el DataFrame con las etiquetas de los clusters.
+
+        Parameters
+        --------------
+        eps : float
+            Distancia máxima entre dos muestras para que una sea considerada como en el vecindario de la otra.
+        min_samples : int
+            Número de muestras (o peso total) en un vecindario para que un punto sea considerado como un punto central.
+        como_dataframe : bool, default True
+            Si es False se devuelve un ResultadoClusters con las etiquetas int32 y
+            una vista de los datos, sin construir el DataFrame.
     
-    # Set 
-    @df.setter
-    def df(self, nuevo_df):
+        Returns
+        -------------
+        dataset : pd.DataFrame
+            DataFrame con las etiquetas de los clusters.
         '''
-        Establece un nuevo dataframe.
+        # Encontrar los clusters
+        dbscan = self.__modelo(eps, min_samples)
+        
+        # Convertir a un dataframe sin copiar los datos
+        return self._resultado(dbscan.labels_, como_dataframe)
     
+    @instrumentado
+    def graficar(self, eps = None, min_samples = None, resultado = None, modo = 'pairplot',
+                 archivo = None, **opciones):
+        '''Genera un pairplot del dataset con las etiquetas de los clusters de DBSCAN.
+
         Parameters
-        ----------
-        df : sklearn.datasets
-            El nuevo dataset de sklearn.datasets.
+        --------------
+        eps : float
+            Distancia máxima entre dos muestras para que una sea considerada como en el vecindario de la otra.
+        min_samples : int
+            Número de muestras (o peso total) en un vecindario para que un punto sea considerado como un punto central.
+        resultado : ResultadoClusters, default None
+            Resultado ya calculado para graficar sin volver a hacer el clustering.
+        modo : {'pairplot', 'escalable'}, default 'pairplot'
+            'pairplot' dibuja sns.pairplot con todos los puntos y columnas.
+            'escalable' usa graficos.graficar_escalable: muestra por cluster,
+            columnas más discriminantes o PCA y densidad con hexbin.
+        archivo : str, default None
+            Ruta donde guardar la figura en lugar de mostrarla.
+        **opciones
+            Argumentos adicionales de graficos.graficar_escalable.
     
         Returns
-        -------
+        -------------
         None
         '''
-        self.__df = nuevo_df
+        if resultado is None:
+            resultado = self.clusters(eps, min_samples, como_dataframe = False)
+        self._graficar(resultado, modo, archivo, **opciones)
+        
+    @instrumentado
+    def grafo_vecinos(self, radio):
+        '''Calcula (o reutiliza) el grafo disperso de vecinos dentro de un radio.
+
+        El índice espacial y el grafo se guardan en el ConjuntoDatos (ver
+        base.ConjuntoDatos.grafo_vecinos). El grafo se reutiliza para cualquier
+        eps menor o igual al radio con el que se construyó, y el índice para
+        construir grafos de radios mayores.
+
+        Parameters
+        --------------
+        radio : float
+            Radio máximo del grafo de vecindad.
     
-    # Str
-    def __str__(self):
+        Returns
+        -------------
+        grafo : scipy.sparse.csr_matrix
+            Matriz dispersa con las distancias entre vecinos.
         '''
-        Devuelve una representación de cadena del objeto.
+        return self._datos.grafo_vecinos(radio, self.__algoritmo)
+        
+    @instrumentado
+    def mejor_cluster(self, eps_values = None, min_samples_values = None, n_jobs = 1,
+                      modo = 'auto', presupuesto = PRESUPUESTO, metodo = 'grilla'):
+        '''Calcula el silhouette score para diferentes combinaciones de eps y min_samples
+
+        Con metodo = 'grilla' el grafo de vecinos se calcula una sola vez con el
+        eps más grande y de él se derivan las etiquetas de toda la grilla. Con
+        metodo = 'jerarquia' se ajusta HDBSCAN una vez por min_samples y las
+        etiquetas de cada eps se obtienen cortando su jerarquía en tiempo
+        lineal; son las de DBSCAN*, donde los puntos de borde quedan como
+        ruido. Las etiquetas repetidas solo se evalúan una vez y los resultados
+        quedan memorizados en la instancia.
+
+        Parameters
+        --------------
+        eps_values : iterable of float, default np.arange(0.3, 1.2, 0.1)
+            Valores de eps a evaluar.
+        min_samples_values : iterable of int, default range(2, 10)
+            Valores de min_samples a evaluar.
+        n_jobs : int, default 1
+            Cantidad de procesos para repartir la grilla. -1 usa todos los núcleos.
+        modo : {'auto', 'exacto', 'muestreo'}, default 'auto'
+            Forma de calcular el Silhouette Score (ver silueta.puntaje_silueta).
+        presupuesto : int, default PRESUPUESTO
+            Cantidad máxima de distancias entre pares para el Silhouette Score.
+        metodo : {'grilla', 'jerarquia'}, default 'grilla'
+            Forma de obtener las etiquetas de cada combinación.
     
         Returns
-        -------
-        __str__ : str
-            Una cadena que representa el objeto con los valores actuales de sus atributos.
+        -------------
+        resultados : pd.DataFrame
+            Tabla con eps, min_samples, cantidad de clusters y Silhouette Score.
         '''
-        return f'DataFrame : {self.__df}'
-    
-    # Métodos
-    def tabla_resumen(self):
-        '''Genera una tabla resumen del dataset de sklearn.datasets con el que se va a trabajar.
+        import pandas as pd
+        
+        if eps_values is None:
+            eps_values = np.arange(0.3, 1.2, 0.1)
+        if min_samples_values is None:
+            min_samples_values = range(2, 10)
+        eps_values = tuple(float(eps) for eps in eps_values)
+        min_samples_values = tuple(int(min_samples) for min_samples in min_samples_values)
+        
+        llave = (eps_values, min_samples_values, modo, presupuesto, metodo)
+        if llave in self.__barridos:
+            return self.__barridos[llave].copy()
+        if metodo not in ('grilla', 'jerarquia'):
+            raise ValueError(f"Método desconocido: {metodo}")
+        
+        # Cargar el dataset
+        X = self._datos.data
+        opciones_silueta = {'modo': modo, 'presupuesto': presupuesto}
+        configuraciones = len(eps_values) * len(min_samples_values)
+        
+        if n_jobs == -1:
+            n_jobs = os.cpu_count()
+        
+        grafo = None
+        indice = None
+        etiquetas = None
+        if metodo == 'jerarquia':
+            # Un ajuste de HDBSCAN por min_samples y un corte lineal por eps
+            modelos = [self.jerarquia(min_samples) for min_samples in min_samples_values]
+            with fase('etiquetas', metodo = 'HDBSCAN', configuraciones = configuraciones):
+                etiquetas = [[_etiquetas_corte(hdbscan, eps) for hdbscan in modelos] for eps in eps_values]
+        else:
+            # Grafo de vecinos con el eps más grande
+            grafo = self.grafo_vecinos(max(eps_values))
+            indice = self._datos.indice_vecinos(self.__algoritmo)
+        
+        if n_jobs > 1:
+            with ProcessPoolExecutor(max_workers = n_jobs, initializer = _iniciar_trabajador,
+                                     initargs = (grafo, X, opciones_silueta, indice)) as pool:
+                if etiquetas is None:
+                    with fase('ajuste', metodo = 'DBSCAN', configuraciones = configuraciones):
+                        etiquetas = list(pool.map(_etiquetas_eps, eps_values,
+                                                  [min_samples_values] * len(eps_values)))
+                unicas = _etiquetas_unicas(etiquetas)
+                with fase('silueta', modo = modo, etiquetados = len(unicas)):
+                    siluetas = dict(zip(unicas, pool.map(_silueta, unicas.values())))
+        else:
+            _iniciar_trabajador(grafo, X, opciones_silueta, indice)
+            if etiquetas is None:
+                with fase('ajuste', metodo = 'DBSCAN', configuraciones = configuraciones):
+                    etiquetas = [_etiquetas_eps(eps, min_samples_values) for eps in eps_values]
+            unicas = _etiquetas_unicas(etiquetas)
+            with fase('silueta', modo = modo, etiquetados = len(unicas)):
+                siluetas = {llave_etiquetas: _silueta(resultado) for llave_etiquetas, resultado in unicas.items()}
+            _iniciar_trabajador(None, None)
+        
+        filas = []
+        for eps, etiquetas_eps in zip(eps_values, etiquetas):
+            for min_samples, resultado in zip(min_samples_values, etiquetas_eps):
+                n_clusters = len(set(resultado)) - (1 if -1 in resultado else 0)
+                filas.append({'eps': round(eps, 2),
+                              'min_samples': min_samples,
+                              'n_clusters': n_clusters,
+                              'silhouette': siluetas[_llave_etiquetas(resultado)]})
+        
+        resultados = pd.DataFrame(filas)
+        self.__barridos[llave] = resultados
+        return resultados.copy()
+        
+    def jerarquia(self, min_samples, min_cluster_size = None):
+        '''Ajusta (o reutiliza) HDBSCAN, la jerarquía de densidad del dataset.
+
+        Con un solo ajuste por min_samples se obtienen las etiquetas para
+        cualquier eps (ver clusters_jerarquia) y el clustering recomendado. El
+        modelo se guarda en el ConjuntoDatos.
 
         Parameters
         --------------
-        None
+        min_samples : int
+            Número de muestras en un vecindario para que un punto sea central.
+        min_cluster_size : int, default None
+            Tamaño mínimo de un cluster. Si es None se usa min_samples (al menos 2).
     
         Returns
         -------------
-        resumen: pd.DataFrame
-                Tabla resumen del dataset de sklearn.datasets.
+        hdbscan : sklearn.cluster.HDBSCAN
+            Modelo ajustado.
         '''
-        X, y = self.__df.data, self.__df.target
-        dataset = pd.DataFrame(X, columns = self.__df.feature_names)
-        dataset['target'] = y
-        resumen = dataset.describe()
-        return resumen
+        from sklearn.cluster import HDBSCAN
+        
+        if min_cluster_size is None:
+            min_cluster_size = max(min_samples, 2)
+        
+        def ajustar():
+            with fase('ajuste', metodo = 'HDBSCAN', min_samples = min_samples, min_cluster_size = min_cluster_size):
+                return HDBSCAN(min_samples = min_samples, min_cluster_size = min_cluster_size,
+                               copy = False).fit(self._datos.data)
+        
+        return self._datos.derivado(('hdbscan', min_samples, min_cluster_size), ajustar)
     
-    def clusters(self, eps, min_samples):
-        '''Realiza el clustering con DBSCAN y devuelve el DataFrame con las etiquetas de los clusters.
+    @instrumentado
+    def clusters_jerarquia(self, eps, min_samples, como_dataframe = True):
+        '''Obtiene las etiquetas de DBSCAN para eps y min_samples cortando la jerarquía, sin volver a ajustar.
+
+        Son las etiquetas de DBSCAN*: los puntos de borde (no centrales) de
+        DBSCAN quedan como ruido.
 
         Parameters
         --------------
@@ -101,101 +353,108 @@ class MetodoDBSCAN():
             Distancia máxima entre dos muestras para que una sea considerada como en el vecindario de la otra.
         min_samples : int
             Número de muestras (o peso total) en un vecindario para que un punto sea considerado como un punto central.
+        como_dataframe : bool, default True
+            Si es False se devuelve un ResultadoClusters en lugar del DataFrame.
     
         Returns
         -------------
         dataset : pd.DataFrame
             DataFrame con las etiquetas de los clusters.
         '''
-        # Cargar el dataset
-        X = self.__df.data
+        hdbscan = self.jerarquia(min_samples)
+        with fase('etiquetas', metodo = 'HDBSCAN', eps = eps):
+            etiquetas = _etiquetas_corte(hdbscan, eps)
         
-        # Encontrar los clusters
-        dbscan = DBSCAN(eps = eps, min_samples = min_samples)
-        dbscan.fit_predict(X)
-        
-        # Convertir a un dataframe
-        dataset = pd.DataFrame(X, columns = self.__df.feature_names)
-        dataset['cluster'] = dbscan.labels_
-        return dataset
+        return self._resultado(etiquetas, como_dataframe)
     
-    def graficar(self, eps, min_samples):
-        '''Genera un pairplot del dataset con las etiquetas de los clusters de DBSCAN.
+    @instrumentado
+    def recomendado(self, min_samples = 5, min_cluster_size = None, como_dataframe = True):
+        '''Obtiene un clustering estable de la jerarquía de densidad de HDBSCAN, sin fijar eps.
+
+        HDBSCAN condensa el árbol de densidad y elige los clusters más estables,
+        de modo que pueden tener densidades distintas. La estabilidad de cada
+        punto es su fuerza de pertenencia a su cluster (0 para el ruido).
 
         Parameters
         --------------
-        eps : float
-            Distancia máxima entre dos muestras para que una sea considerada como en el vecindario de la otra.
-        min_samples : int
-            Número de muestras (o peso total) en un vecindario para que un punto sea considerado como un punto central.
+        min_samples : int, default 5
+            Número de muestras en un vecindario para que un punto sea central.
+        min_cluster_size : int, default None
+            Tamaño mínimo de un cluster. Si es None se usa min_samples (al menos 2).
+        como_dataframe : bool, default True
+            Si es False se devuelve un ResultadoClusters en lugar del DataFrame.
     
         Returns
         -------------
-        None
+        dataset : pd.DataFrame
+            DataFrame con las columnas 'cluster' (-1 es ruido) y 'estabilidad'.
         '''
-        dataset = self.clusters(eps, min_samples)
-        
-        # Graficar
-        pairplot = sns.pairplot(dataset, hue = 'cluster', palette = 'Accent')
-        pairplot.fig.suptitle(f"Pairplot con DBSCAN Clusters", y = 1.02)
-        plt.show()
+        hdbscan = self.jerarquia(min_samples, min_cluster_size)
         
-    def mejor_cluster(self):
-        '''Calcula el silhouette score para diferentes cantidades de clusters
+        return self._resultado(hdbscan.labels_, como_dataframe, hdbscan.probabilities_)
+    
+    @instrumentado
+    def fit(self, eps, min_samples):
+        '''Ajusta el modelo y lo guarda para etiquetar datos nuevos con predict.
 
         Parameters
         --------------
-        None
+        eps : float
+            Distancia máxima entre dos muestras para que una sea considerada como en el vecindario de la otra.
+        min_samples : int
+            Número de muestras (o peso total) en un vecindario para que un punto sea considerado como un punto central.
     
         Returns
         -------------
-        None
+        self : MetodoDBSCAN
+            El mismo objeto, con el modelo ajustado.
         '''
-        
-        # Cargar el dataset
-        X = self.__df.data
-        
-        eps_values = np.arange(0.3, 1.2, 0.1)
-        min_samples_values = range(2, 10)
-        
-        for eps in eps_values:
-            for min_samples in min_samples_values:
-                dbscan = DBSCAN(eps=eps, min_samples=min_samples)
-                resultado = dbscan.fit_predict(X)
-                
-                # Calcular Silhouette Score solo si hay más de un cluster
-                if len(set(resultado)) > 1:
-                    silueta = silhouette_score(X, resultado)
-                    print(f"eps: {eps}, min_samples: {min_samples}, Silhouette Score: {silueta}")
-                else:
-                    print(f"eps: {eps}, min_samples: {min_samples}, Silhouette Score: No clusters found")
-        
-        return()
-        
-    def silhouette(self, eps, min_samples):
+        dbscan = self.__modelo(eps, min_samples)
+        centrales = dbscan.core_sample_indices_
+        return self._guardar_ajuste({'eps': eps, 'min_samples': min_samples},
+                                    puntos = self._datos.data[centrales],
+                                    etiquetas = dbscan.labels_[centrales], radio = eps)
+    
+    @instrumentado
+    def silhouette(self, eps, min_samples, modo = 'auto', presupuesto = PRESUPUESTO):
         '''Calcula y devuelve el Silhouette Score del clustering con DBSCAN.
 
         Parameters
         --------------
         clusters : int
             Número de clusters.
+        modo : {'auto', 'exacto', 'muestreo'}, default 'auto'
+            Forma de calcular el Silhouette Score (ver silueta.puntaje_silueta).
+        presupuesto : int, default PRESUPUESTO
+            Cantidad máxima de distancias entre pares para el Silhouette Score.
     
         Returns
         -------------
         silueta: str
             Silhouette Score del clustering.
         '''
-        # Cargar el dataset
-        X = self.__df.data
-        
         # Encontrar los clusters
-        dbscan = DBSCAN(eps = eps, min_samples = min_samples)
-        resultado = dbscan.fit_predict(X)
+        resultado = self.__modelo(eps, min_samples).labels_
         
-        silueta = silhouette_score(X, resultado)
+        silueta = self._silueta(resultado, modo, presupuesto)
         
 
 
         
         return(f'Silhouette Score DBSCAN: {silueta}')
-        
\ No newline at end of file
+    
+    def __modelo(self, eps, min_samples):
+        from sklearn.cluster import DBSCAN
+        
+        # Reutilizar el modelo si ya se ajustó con los mismos parámetros y datos
+        llave = self._llave(eps, min_samples)
+        
+        def ajustar():
+            # Buscar los vecinos en el grafo guardado en lugar de en los datos
+            radio = max(eps, self.__radio_indice or eps)
+            grafo = _recortar_grafo(self.grafo_vecinos(radio), eps, self._datos.indice_vecinos(self.__algoritmo),
+                                    self._datos.data)
+            with fase('ajuste', metodo = 'DBSCAN', eps = eps, min_samples = min_samples):
+                return DBSCAN(eps = eps, min_samples = min_samples, metric = 'precomputed').fit(grafo)
+        
+        return self._modelos.obtener(llave, ajustar)
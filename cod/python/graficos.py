@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: sofiabocker
+"""
+
+import warnings
+
+import numpy as np
+
+def muestra_estratificada(etiquetas, max_puntos_por_cluster, random_state = None):
+    '''Elige a lo sumo max_puntos_por_cluster filas de cada cluster.
+
+    Parameters
+    --------------
+    etiquetas : np.ndarray
+        Etiqueta de cluster de cada fila.
+    max_puntos_por_cluster : int
+        Máxima cantidad de filas por cluster.
+    random_state : int, default None
+        Estado aleatorio del muestreo.
+
+    Returns
+    -------------
+    filas : np.ndarray
+        Índices ordenados de las filas elegidas.
+    '''
+    generador = np.random.default_rng(random_state)
+    filas = []
+    for etiqueta in np.unique(etiquetas):
+        indices = np.flatnonzero(etiquetas == etiqueta)
+        if len(indices) > max_puntos_por_cluster:
+            indices = generador.choice(indices, max_puntos_por_cluster, replace = False)
+        filas.append(indices)
+    return np.sort(np.concatenate(filas))
+
+def variables_discriminantes(X, etiquetas, max_variables):
+    '''Elige las columnas que mejor separan los clusters según el estadístico F del ANOVA.
+
+    Parameters
+    --------------
+    X : np.ndarray o scipy.sparse matrix
+        Datos de tamaño (n, d).
+    etiquetas : np.ndarray
+        Etiqueta de cluster de cada fila.
+    max_variables : int
+        Cantidad de columnas a elegir.
+
+    Returns
+    -------------
+    columnas : np.ndarray
+        Índices de las columnas elegidas, de mayor a menor F.
+    '''
+    from scipy.sparse import issparse
+    from sklearn.feature_selection import f_classif
+
+    if X.shape[1] <= max_variables:
+        return np.arange(X.shape[1])
+    if len(np.unique(etiquetas)) < 2:
+        if issparse(X):
+            from sklearn.utils.sparsefuncs import mean_variance_axis
+            varianzas = mean_variance_axis(X.tocsr(), axis = 0)[1]
+        else:
+            varianzas = X.var(axis = 0)
+        return np.argsort(varianzas)[::-1][:max_variables]
+    # Las columnas constantes tienen F indefinido y quedan al final
+    with np.errstate(divide = 'ignore', invalid = 'ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning)
+        f, _ = f_classif(X, etiquetas)
+    return np.argsort(np.nan_to_num(f, nan = -np.inf))[::-1][:max_variables]
+
+def graficar_escalable(resultado, titulo, archivo = None, proyeccion = 'variables', max_variables = 4,
+                       max_puntos_por_cluster = 1000, tamano_grilla = 60, random_state = 0):
+    '''Grafica un resultado de clustering sin dibujar todos los puntos ni todas las columnas.
+
+    La densidad de todos los puntos se dibuja con hexbin y encima se dibuja una
+    muestra estratificada por cluster, rasterizada. Solo se grafican las
+    columnas más discriminantes o una proyección PCA a dos dimensiones.
+
+    Parameters
+    --------------
+    resultado : ResultadoClusters
+        Resultado del clustering.
+    titulo : str
+        Título de la figura.
+    archivo : str, default None
+        Ruta donde guardar la figura. Si se indica, no se necesita pantalla;
+        si es None la figura se muestra con plt.show().
+    proyeccion : {'variables', 'pca'}, default 'variables'
+        Graficar las max_variables columnas más discriminantes o las dos
+        primeras componentes principales. Con datos dispersos las componentes
+        salen de una SVD truncada, sin centrar los datos.
+    max_variables : int, default 4
+        Cantidad de columnas en modo 'variables'.
+    max_puntos_por_cluster : int, default 1000
+        Máxima cantidad de puntos dibujados por cluster.
+    tamano_grilla : int, default 60
+        Cantidad de hexágonos a lo ancho de cada gráfico de densidad.
+    random_state : int, default 0
+        Estado aleatorio del muestreo.
+
+    Returns
+    -------------
+    figura : matplotlib.figure.Figure
+        Figura generada.
+    '''
+    import matplotlib
+    from matplotlib.figure import Figure
+
+    X, etiquetas = resultado.X, resultado.etiquetas
+    filas = muestra_estratificada(etiquetas, max_puntos_por_cluster, random_state)
+
+    if proyeccion == 'pca':
+        from scipy.sparse import issparse
+
+        if issparse(X):
+            # Centrar densificaría la matriz: se usa una SVD truncada sin centrar
+            from sklearn.decomposition import TruncatedSVD
+
+            pca = TruncatedSVD(n_components = 2, random_state = random_state).fit(X[filas])
+            prefijo = 'SV'
+        else:
+            from sklearn.decomposition import PCA
+
+            pca = PCA(n_components = 2, random_state = random_state).fit(X[filas])
+            prefijo = 'PC'
+        datos = pca.transform(X)
+        nombres = [f'{prefijo}{i + 1} ({pca.explained_variance_ratio_[i]:.0%})' for i in range(2)]
+    elif proyeccion == 'variables':
+        columnas = variables_discriminantes(X[filas], etiquetas[filas], max_variables)
+        datos = X[:, columnas]
+        # Solo se densifican las columnas elegidas
+        if hasattr(datos, 'toarray'):
+            datos = datos.toarray()
+        nombres = [resultado.feature_names[c] for c in columnas]
+    else:
+        raise ValueError(f"Proyección desconocida: {proyeccion}")
+
+    d = datos.shape[1]
+    if archivo is not None:
+        figura = Figure(figsize = (2.5 * d, 2.5 * d))
+    else:
+        import matplotlib.pyplot as plt
+        figura = plt.figure(figsize = (2.5 * d, 2.5 * d))
+    ejes = figura.subplots(d, d, squeeze = False)
+
+    clusters = np.unique(etiquetas)
+    paleta = matplotlib.colormaps['Accent']
+    colores = {c: paleta(i % paleta.N) for i, c in enumerate(clusters)}
+
+    for i in range(d):
+        for j in range(d):
+            eje = ejes[i, j]
+            if i == j:
+                # Histograma de cada cluster sobre todos los puntos
+                bordes = np.histogram_bin_edges(datos[:, i], bins = 30)
+                for c in clusters:
+                    eje.hist(datos[etiquetas == c, i], bins = bordes, histtype = 'step', color = colores[c])
+            else:
+                eje.hexbin(datos[:, j], datos[:, i], gridsize = tamano_grilla, cmap = 'Greys',
+                           bins = 'log', mincnt = 1, linewidths = 0)
+                eje.scatter(datos[filas, j], datos[filas, i], c = [colores[c] for c in etiquetas[filas]],
+                            s = 4, alpha = 0.6, linewidths = 0, rasterized = True)
+            if i == d - 1:
+                eje.set_xlabel(nombres[j])
+            if j == 0:
+                eje.set_ylabel(nombres[i])
+
+    figura.legend(handles = [matplotlib.lines.Line2D([], [], marker = 'o', linestyle = '', color = colores[c],
+                                                     label = str(c)) for c in clusters],
+                  title = 'cluster', loc = 'center right')
+    figura.suptitle(titulo)
+
+    if archivo is not None:
+        figura.savefig(archivo, dpi = 100, bbox_inches = 'tight')
+    else:
+        plt.show()
+    return figura
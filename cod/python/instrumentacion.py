@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: sofiabocker
+"""
+
+import functools
+import json
+import threading
+import time
+import tracemalloc
+
+# Instrumentaciones activas y funciones registradas
+_activas = []
+_callbacks = []
+
+# Cada hilo tiene su propia pila de fases abiertas
+_local = threading.local()
+
+def _abiertas():
+    if not hasattr(_local, 'abiertas'):
+        _local.abiertas = []
+    return _local.abiertas
+
+class _FaseInactiva():
+    '''Fase que no mide nada, para cuando no hay ninguna instrumentación activa.'''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excepcion):
+        return False
+
+    def anotar(self, **datos):
+        pass
+
+_INACTIVA = _FaseInactiva()
+
+class _Fase():
+
+    def __init__(self, nombre, datos):
+        self.nombre = nombre
+        self.datos = datos
+        self.pico = 0
+
+    def __enter__(self):
+        abiertas = _abiertas()
+        self.padre = abiertas[-1] if abiertas else None
+        self.memoria = tracemalloc.is_tracing()
+        if self.memoria:
+            self.actual, pico = tracemalloc.get_traced_memory()
+            # El pico de la fase que la contiene no se pierde al reiniciarlo
+            if self.padre is not None:
+                self.padre.pico = max(self.padre.pico, pico)
+            tracemalloc.reset_peak()
+        abiertas.append(self)
+        self.inicio = time.time()
+        self.cpu = time.process_time()
+        self.pared = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        pared = time.perf_counter() - self.pared
+        cpu = time.process_time() - self.cpu
+        abiertas = _abiertas()
+        abiertas.pop()
+
+        memoria_pico = None
+        if self.memoria and tracemalloc.is_tracing():
+            self.pico = max(self.pico, tracemalloc.get_traced_memory()[1])
+            memoria_pico = max(self.pico - self.actual, 0)
+            if self.padre is not None:
+                self.padre.pico = max(self.padre.pico, self.pico)
+
+        registro = {'fase': self.nombre,
+                    'padre': None if self.padre is None else self.padre.nombre,
+                    'nivel': len(abiertas),
+                    'inicio': self.inicio,
+                    'pared': pared,
+                    'cpu': cpu,
+                    'memoria_pico': memoria_pico,
+                    'error': None if tipo is None else tipo.__name__}
+        registro.update(self.datos)
+        for instrumentacion in _activas:
+            instrumentacion.registros.append(registro)
+        for funcion in list(_callbacks):
+            funcion(registro)
+        return False
+
+    def anotar(self, **datos):
+        '''Agrega datos al registro de la fase, por ejemplo n_iter o convergio.'''
+        self.datos.update(datos)
+
+def _a_json(valor):
+    # Escalares de numpy y cualquier otro objeto
+    return valor.item() if hasattr(valor, 'item') else str(valor)
+
+def activa():
+    '''Indica si hay alguna instrumentación activa o función registrada.'''
+    return bool(_activas or _callbacks)
+
+def fase(nombre, **datos):
+    '''Mide una fase: tiempo de pared, tiempo de CPU y memoria pico.
+
+    Si no hay ninguna instrumentación activa ni función registrada no mide
+    nada y su costo es el de una llamada a función.
+
+    Parameters
+    --------------
+    nombre : str
+        Nombre de la fase, por ejemplo 'ajuste' o 'silueta'.
+    **datos
+        Datos que se agregan al registro, por ejemplo los parámetros.
+
+    Returns
+    -------------
+    fase : context manager
+        Objeto con el método anotar(**datos) para agregar datos al registro
+        dentro del bloque with.
+    '''
+    if not (_activas or _callbacks):
+        return _INACTIVA
+    return _Fase(nombre, datos)
+
+def instrumentado(metodo):
+    '''Decorador que mide cada llamada a un método como una fase 'Clase.metodo'.'''
+    @functools.wraps(metodo)
+    def envoltura(self, *args, **kwargs):
+        if not (_activas or _callbacks):
+            return metodo(self, *args, **kwargs)
+        with fase(f'{type(self).__name__}.{metodo.__name__}'):
+            return metodo(self, *args, **kwargs)
+    return envoltura
+
+def registrar(funcion):
+    '''Registra una función que se llama con cada registro al terminar una fase.
+
+    Parameters
+    --------------
+    funcion : callable
+        Función que recibe el registro (dict).
+
+    Returns
+    -------------
+    funcion : callable
+        La misma función, para poder usar registrar como decorador.
+    '''
+    _callbacks.append(funcion)
+    return funcion
+
+def quitar(funcion):
+    '''Quita una función registrada con registrar.
+
+    Parameters
+    --------------
+    funcion : callable
+        Función registrada.
+
+    Returns
+    -------------
+    None
+    '''
+    _callbacks.remove(funcion)
+
+class Instrumentacion():
+
+    # Constructor
+    def __init__(self, memoria = False):
+        '''
+        Inicializa un registro de fases que se activa con un bloque with.
+
+        Parameters
+        ----------
+        memoria : bool, default False
+            Si es True se mide la memoria pico de cada fase con tracemalloc, lo
+            que hace más lento el código medido.
+
+        Returns
+        -------
+        None
+        '''
+        self.__memoria = memoria
+        self.__inicio_tracemalloc = False
+        self.registros = []
+
+    def __enter__(self):
+        if self.__memoria and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.__inicio_tracemalloc = True
+        _activas.append(self)
+        return self
+
+    def __exit__(self, *excepcion):
+        _activas.remove(self)
+        if self.__inicio_tracemalloc:
+            tracemalloc.stop()
+            self.__inicio_tracemalloc = False
+        return False
+
+    # Str
+    def __str__(self):
+        '''
+        Devuelve una representación de cadena del objeto.
+
+        Returns
+        -------
+        __str__ : str
+            Una cadena con la cantidad de registros.
+        '''
+        return f'Instrumentacion : {len(self.registros)} registros'
+
+    # Métodos
+    def a_dataframe(self):
+        '''Devuelve los registros como un DataFrame, una fila por fase.
+
+        Parameters
+        --------------
+        None
+
+        Returns
+        -------------
+        registros : pd.DataFrame
+            Registros en el orden en que terminaron las fases.
+        '''
+        import pandas as pd
+
+        return pd.DataFrame(self.registros)
+
+    def resumen(self):
+        '''Suma los tiempos de cada fase.
+
+        Parameters
+        --------------
+        None
+
+        Returns
+        -------------
+        resumen : pd.DataFrame
+            Cantidad de llamadas, tiempo de pared y de CPU totales y memoria pico
+            máxima por fase, ordenado por tiempo de pared.
+        '''
+        registros = self.a_dataframe()
+        if registros.empty:
+            return registros
+        resumen = registros.groupby('fase').agg(llamadas = ('pared', 'size'), pared = ('pared', 'sum'),
+                                                cpu = ('cpu', 'sum'), memoria_pico = ('memoria_pico', 'max'))
+        return resumen.sort_values('pared', ascending = False)
+
+    def exportar(self, ruta):
+        '''Guarda los registros en un archivo JSON Lines, un registro por línea.
+
+        Parameters
+        --------------
+        ruta : str
+            Ruta del archivo.
+
+        Returns
+        -------------
+        None
+        '''
+        with open(ruta, 'w') as archivo:
+            for registro in self.registros:
+                archivo.write(json.dumps(registro, default = _a_json) + '\n')
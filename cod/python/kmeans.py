@@ -4,176 +4,440 @@
 @author: sofiabocker
 """
 
-import matplotlib.pyplot as plt
-from sklearn.cluster import KMeans
-from sklearn.metrics import silhouette_score
-import seaborn as sns
-import pandas as pd
+import time
 
-from sklearn.datasets import load_iris, load_digits, load_wine, load_breast_cancer, load_diabetes, load_linnerud
+import numpy as np
 
-class MetodoKMeans():
+from silueta import puntaje_silueta, PRESUPUESTO
+from base import MetodoBase
+from seleccion import seleccionar_k
+from instrumentacion import fase, instrumentado
+from consenso import correr_semillas, etiquetas_consenso
+from cargadores import lotes as iterar_lotes
+
+def _asignar(X, centros):
+    '''Asigna cada fila al centro más cercano.'''
+    from sklearn.metrics import pairwise_distances
+    return pairwise_distances(X, centros).argmin(axis = 1)
+
+def _distancias_centros(X, centros, etiquetas):
+    '''Distancia al cuadrado de cada fila a su centro, como |x|² - 2 x·c + |c|² si X es dispersa.'''
+    from scipy.sparse import issparse
     
-    # Constructor
-    def __init__(self, df):
-        '''
-        Inicializa un objeto de la clase con los parámetros dados.
+    if not issparse(X):
+        return ((X - centros[etiquetas]) ** 2).sum(axis = 1)
+    X = X.tocsr()
+    filas = np.repeat(np.arange(X.shape[0]), np.diff(X.indptr))
+    valores = X.data.astype(np.float64)
+    cruzados = np.bincount(filas, weights = valores * centros[etiquetas[filas], X.indices],
+                           minlength = X.shape[0])
+    normas = np.bincount(filas, weights = valores ** 2, minlength = X.shape[0])
+    return np.maximum(normas - 2 * cruzados + (centros ** 2).sum(axis = 1)[etiquetas], 0)
+
+def _direccion_principal(puntos, centro):
+    '''Primer valor y vector singular de las filas de puntos centradas en centro.'''
+    from scipy.sparse import issparse
     
-        Parameters
-        ----------
-        df : pd.DataFrame
-            Dataset de sklearn.datasets al que se le va a aplicar el método
+    if not issparse(puntos) or min(puntos.shape) < 2:
+        puntos = puntos.toarray() if issparse(puntos) else puntos
+        _, valores, vectores = np.linalg.svd(puntos - centro, full_matrices = False)
+        return valores[0], vectores[0]
     
-        Returns
-        -------
-        None
-        '''
-        self.__df = df
+    from scipy.sparse.linalg import LinearOperator, svds
     
-    # Get
-    @property
-    def df(self):
-        '''
-        Obtiene el Dataset de sklearn.datasets en el que se va a trabajar
+    # Los puntos dispersos se centran de forma implícita, sin densificarlos
+    operador = LinearOperator(puntos.shape, dtype = np.float64,
+                              matvec = lambda v: puntos @ np.ravel(v) - centro @ np.ravel(v),
+                              rmatvec = lambda u: puntos.T @ np.ravel(u) - centro * np.ravel(u).sum())
+    _, valores, vectores = svds(operador, k = 1, random_state = 0)
+    return valores[0], vectores[0]
+
+def _dividir_peor_cluster(X, etiquetas, centros):
+    '''Divide en dos el cluster con mayor inercia a lo largo de su dirección principal.'''
+    distancias = _distancias_centros(X, centros, etiquetas)
+    inercias = np.bincount(etiquetas, weights = distancias, minlength = len(centros))
+    peor = inercias.argmax()
+    puntos = X[etiquetas == peor]
     
-        Returns
-        -------
-        df : sklearn.datasets
-            Dataset de sklearn.datasets.
-        '''
-        return self.__df
+    if puntos.shape[0] > 1:
+        valor, vector = _direccion_principal(puntos, centros[peor])
+        desplazamiento = vector * valor / np.sqrt(puntos.shape[0])
+    else:
+        desplazamiento = np.zeros(X.shape[1])
     
-    # Set 
-    @df.setter
-    def df(self, nuevo_df):
-        '''
-        Establece un nuevo dataframe.
+    if not desplazamiento.any():
+        # Cluster degenerado: usar el punto más lejano a su centro
+        lejano = X[distancias.argmax()]
+        return np.vstack([centros, lejano.toarray() if hasattr(lejano, 'toarray') else lejano])
     
-        Parameters
-        ----------
-        df : sklearn.datasets
-            El nuevo dataset de sklearn.datasets.
+    centros = centros.copy()
+    nuevo = centros[peor] + desplazamiento
+    centros[peor] = centros[peor] - desplazamiento
+    return np.vstack([centros, nuevo])
+
+def _etiquetas_semilla(X, clusters, semilla):
+    '''Ajusta KMeans con una semilla y devuelve sus etiquetas.'''
+    from sklearn.cluster import KMeans
+    return KMeans(n_clusters = clusters, n_init = 1, random_state = semilla).fit_predict(X)
+
+class MetodoKMeans(MetodoBase):
     
-        Returns
-        -------
-        None
-        '''
-        self.__df = nuevo_df
+    NOMBRE = 'KMeans'
+    TITULO = 'K-Means'
     
-    # Str
-    def __str__(self):
-        '''
-        Devuelve una representación de cadena del objeto.
+    # Métodos
+    @instrumentado
+    def clusters(self, clusters, como_dataframe = True):
+        '''Realiza el clustering con KMeans y devuelve el DataFrame con las etiquetas de los clusters.
+
+        Parameters
+        --------------
+        clusters : int
+            Número de clusters.
+        como_dataframe : bool, default True
+            Si es False se devuelve un ResultadoClusters con las etiquetas int32 y
+            una vista de los datos, sin construir el DataFrame.
     
         Returns
-        -------
-        __str__ : str
-            Una cadena que representa el objeto con los valores actuales de sus atributos.
+        -------------
+        dataset : pd.DataFrme
+            DataFrame con las etiquetas de los clusters.
         '''
-        return f'DataFrame : {self.__df}'
+        kmeans = self.__modelo(clusters)
+        # Convertir a un dataframe sin copiar los datos
+        return self._resultado(kmeans.labels_, como_dataframe)
     
-    # Métodos
-    def tabla_resumen(self):
-        '''Genera una tabla resumen del dataset de sklearn.datasets con el que se va a trabajar.
+    @instrumentado
+    def consenso(self, clusters, n_semillas = 20, random_state = 0, n_jobs = 1, max_n_denso = 4000,
+                 n_anclas = 1000, como_dataframe = True):
+        '''Realiza el clustering con KMeans con varias semillas y devuelve las etiquetas de consenso.
+
+        Las corridas se combinan con la matriz de coasociación (ver
+        consenso.etiquetas_consenso). El resultado es reproducible para un mismo
+        random_state e incluye la estabilidad de cada punto.
 
         Parameters
         --------------
-        None
+        clusters : int
+            Número de clusters.
+        n_semillas : int, default 20
+            Cantidad de corridas.
+        random_state : int, default 0
+            Semilla de la que se derivan las semillas de las corridas y de las anclas.
+        n_jobs : int, default 1
+            Cantidad de procesos para las corridas. -1 usa todos los núcleos.
+        max_n_denso : int, default 4000
+            Máxima cantidad de filas para usar la matriz de coasociación completa.
+        n_anclas : int, default 1000
+            Cantidad de anclas cuando hay más de max_n_denso filas.
+        como_dataframe : bool, default True
+            Si es False se devuelve un ResultadoClusters en lugar del DataFrame.
     
         Returns
         -------------
-        resumen: pd.DataFrame
-                Tabla resumen del dataset de sklearn.datasets.
+        dataset : pd.DataFrame
+            DataFrame con las columnas 'cluster' y 'estabilidad'.
         '''
-        X, y = self.__df.data, self.__df.target
-        dataset = pd.DataFrame(X, columns = self.__df.feature_names)
-        dataset['target'] = y
-        resumen = dataset.describe()
-        return resumen
+        X = self._datos.data
+        semillas = np.random.SeedSequence(random_state).generate_state(n_semillas)
+        with fase('ajuste', metodo = 'KMeans', k = clusters, corridas = n_semillas):
+            etiquetas = correr_semillas(_etiquetas_semilla, X, clusters, semillas, n_jobs)
+        with fase('consenso', k = clusters):
+            resultado, estabilidad = etiquetas_consenso(etiquetas, clusters, max_n_denso, n_anclas, random_state)
+        
+        return self._resultado(resultado, como_dataframe, estabilidad)
     
-    def clusters(self, clusters):
-        '''Realiza el clustering con KMeans y devuelve el DataFrame con las etiquetas de los clusters.
+    @instrumentado
+    def clusters_por_lotes(self, clusters, fuente = None, salida = None, tamano_lote = 10000,
+                           epocas = 1, random_state = None):
+        '''Realiza el clustering con MiniBatchKMeans recorriendo los datos por lotes.
+
+        Los datos nunca se cargan completos en memoria: se entrena con partial_fit
+        lote a lote y luego se escriben las etiquetas en un arreglo mapeado a disco.
 
         Parameters
         --------------
         clusters : int
             Número de clusters.
+        fuente : str, np.ndarray, scipy.sparse matrix o callable, default None
+            Ruta a un archivo .npy (se abre con mmap), arreglo (por ejemplo np.memmap
+            o una matriz CSR) o función sin argumentos que devuelve un iterador nuevo
+            de lotes en cada llamada. Si es None se usa df.data. Si hay
+            preprocesamiento se aplica a cada lote.
+        salida : str, default None
+            Ruta del archivo .npy donde se escriben las etiquetas. Si es None las
+            etiquetas se devuelven en memoria.
+        tamano_lote : int, default 10000
+            Cantidad de filas por lote.
+        epocas : int, default 1
+            Cantidad de pasadas de entrenamiento sobre los datos.
+        random_state : int, default None
+            Estado aleatorio de MiniBatchKMeans.
     
         Returns
         -------------
-        dataset : pd.DataFrme
-            DataFrame con las etiquetas de los clusters.
+        etiquetas : np.ndarray
+            Etiquetas int32 de los clusters (np.memmap si se indicó salida).
         '''
-        X = self.__df.data
-        kmeans = KMeans(n_clusters = clusters)
-        kmeans.fit_predict(X)
-        dataset = pd.DataFrame(X, columns = self.__df.feature_names)
-        dataset['cluster'] = kmeans.labels_
-        return dataset
-    
-    def graficar(self, clusters):
+        from sklearn.cluster import MiniBatchKMeans
+        
+        # Los lotes dispersos se pasan tal cual a MiniBatchKMeans, sin densificarlos
+        preparar = lambda lote: lote
+        if fuente is None:
+            fuente = self._datos.data
+        elif self._transformacion is not None:
+            # Los lotes de otra fuente pasan por el mismo preprocesamiento que df
+            preparar = self._transformacion.transformar
+        lotes = iterar_lotes(fuente, tamano_lote)
+        
+        # Entrenar lote a lote
+        kmeans = MiniBatchKMeans(n_clusters = clusters, batch_size = tamano_lote,
+                                 random_state = random_state)
+        n = 0
+        for epoca in range(epocas):
+            n = 0
+            for lote in lotes():
+                kmeans.partial_fit(preparar(lote))
+                n += lote.shape[0]
+        
+        # Escribir las etiquetas lote a lote
+        if salida is not None:
+            etiquetas = np.lib.format.open_memmap(salida, mode = 'w+', dtype = np.int32, shape = (n,))
+        else:
+            etiquetas = np.empty(n, dtype = np.int32)
+        inicio = 0
+        for lote in lotes():
+            etiquetas[inicio:inicio + lote.shape[0]] = kmeans.predict(preparar(lote))
+            inicio += lote.shape[0]
+        
+        if salida is not None:
+            etiquetas.flush()
+        return etiquetas
+    
+    @instrumentado
+    def graficar(self, clusters = None, resultado = None, modo = 'pairplot',
+                 archivo = None, **opciones):
         '''Genera un pairplot del dataset con las etiquetas de los clusters.
 
         Parameters
         --------------
         clusters : int
             Número de clusters.
+        resultado : ResultadoClusters, default None
+            Resultado ya calculado para graficar sin volver a hacer el clustering.
+        modo : {'pairplot', 'escalable'}, default 'pairplot'
+            'pairplot' dibuja sns.pairplot con todos los puntos y columnas.
+            'escalable' usa graficos.graficar_escalable: muestra por cluster,
+            columnas más discriminantes o PCA y densidad con hexbin.
+        archivo : str, default None
+            Ruta donde guardar la figura en lugar de mostrarla.
+        **opciones
+            Argumentos adicionales de graficos.graficar_escalable.
     
         Returns
         -------------
         None
         '''
-        dataset = self.clusters(clusters)
-        
-        # Graficar
-        pairplot = sns.pairplot(dataset, hue = 'cluster', palette = 'Accent')
-        pairplot.fig.suptitle(f"Pairplot con K-Means Clusters", y = 1.02)
-        plt.show()
+        if resultado is None:
+            resultado = self.clusters(clusters, como_dataframe = False)
+        self._graficar(resultado, modo, archivo, **opciones)
         
-    def mejor_cluster(self):
+    @instrumentado
+    def mejor_cluster(self, k_values = range(2, 11), random_state = None, max_n_distancias = 10000,
+                      modo = 'auto', presupuesto = PRESUPUESTO):
         '''Calcula el silhouette score para diferentes cantidades de clusters
 
+        Cada k parte de la solución del k anterior, dividiendo en dos el cluster
+        con mayor inercia, en lugar de ajustarse desde cero. Si la matriz de
+        distancias cabe en el presupuesto se calcula una sola vez, solo para
+        este barrido, y se reutiliza en todos los Silhouette Scores.
+
         Parameters
         --------------
-        None
+        k_values : iterable of int, default range(2, 11)
+            Cantidades de clusters a evaluar, en orden creciente.
+        random_state : int, default None
+            Estado aleatorio para la inicialización del primer KMeans.
+        max_n_distancias : int, default 10000
+            Máxima cantidad de filas para calcular la matriz de distancias completa.
+            Con más filas, o si n * n no cabe en el presupuesto, el Silhouette
+            Score se calcula con puntaje_silueta.
+        modo : {'auto', 'exacto', 'muestreo', 'simplificado'}, default 'auto'
+            Forma de calcular el Silhouette Score (ver silueta.puntaje_silueta).
+        presupuesto : int, default PRESUPUESTO
+            Cantidad máxima de distancias entre pares para el Silhouette Score.
     
         Returns
         -------------
-        None
+        resultados : pd.DataFrame
+            Tabla con k, inercia, Silhouette Score y tiempo en segundos.
         '''
+        import pandas as pd
+        from sklearn.cluster import KMeans
+        from sklearn.metrics import pairwise_distances, silhouette_score
+        
         
         # Cargar el dataset
-        X = self.__df.data
+        X = self._datos.data
+        n = X.shape[0]
+        usar_distancias = n <= max_n_distancias and (modo == 'exacto' or (modo == 'auto' and n * n <= presupuesto))
+        distancias = None
+        if usar_distancias:
+            # La matriz es local al barrido: no se guarda en el ConjuntoDatos compartido
+            with fase('distancias'):
+                distancias = pairwise_distances(X)
         
-        for n_clusters in range(2, 11):
-            kmeans = KMeans(n_clusters=n_clusters)
-            resultado = kmeans.fit_predict(X)
-            silueta = silhouette_score(X, resultado)
-            print(f"Cantidad de clusters: {n_clusters}, Silhouette Score: {silueta}")
+        filas = []
+        centros = None
+        for n_clusters in sorted(k_values):
+            inicio = time.perf_counter()
+            if centros is None:
+                kmeans = KMeans(n_clusters = n_clusters, random_state = random_state)
+            else:
+                # Partir de la solución anterior dividiendo el peor cluster
+                while len(centros) < n_clusters:
+                    centros = _dividir_peor_cluster(X, resultado, centros)
+                    resultado = _asignar(X, centros)
+                kmeans = KMeans(n_clusters = n_clusters, init = centros, n_init = 1)
+            with fase('ajuste', metodo = 'KMeans', k = n_clusters) as medicion:
+                resultado = kmeans.fit_predict(X)
+                medicion.anotar(n_iter = kmeans.n_iter_)
+            centros = kmeans.cluster_centers_
             
-        return()
+            with fase('silueta', modo = modo, k = n_clusters):
+                if distancias is not None:
+                    silueta = silhouette_score(distancias, resultado, metric = 'precomputed')
+                else:
+                    silueta = puntaje_silueta(X, resultado, modo, presupuesto,
+                                              centroides = kmeans.cluster_centers_).valor
+            filas.append({'k': n_clusters,
+                          'inercia': kmeans.inertia_,
+                          'silhouette': silueta,
+                          'tiempo': time.perf_counter() - inicio})
+            
+        return pd.DataFrame(filas)
+    
+    def distancias(self):
+        '''Calcula (o reutiliza) la matriz de distancias euclídeas entre las filas del dataset.
+
+        La matriz se guarda en el ConjuntoDatos, así que la comparten todos los
+        métodos que trabajan sobre los mismos datos.
+
+        Parameters
+        --------------
+        None
+    
+        Returns
+        -------------
+        distancias : np.ndarray
+            Matriz de distancias de tamaño (n, n).
+        '''
+        return self._datos.distancias()
+        
+    @instrumentado
+    def elegir_k(self, k_min = 2, k_max = 30, criterio = 'silueta', estrategia = 'gruesa_fina', paciencia = 2,
+                 modo = 'auto', presupuesto = PRESUPUESTO, random_state = 0):
+        '''Elige la cantidad de clusters de KMeans evaluando pocos k en lugar de toda la grilla.
+
+        Cada k se ajusta una sola vez (los modelos quedan en la cache) y la
+        búsqueda se detiene cuando el criterio deja de mejorar (ver
+        seleccion.buscar_k).
+
+        Parameters
+        --------------
+        k_min : int, default 2
+            Menor cantidad de clusters.
+        k_max : int, default 30
+            Mayor cantidad de clusters. Se limita a la cantidad de filas menos uno.
+        criterio : {'silueta', 'gap'}, default 'silueta'
+            Criterio a maximizar: el Silhouette Score (muestreado si no cabe en el presupuesto) o el estadístico gap (ver seleccion).
+        estrategia : {'gruesa_fina', 'dorada'}, default 'gruesa_fina'
+            'gruesa_fina' recorre una grilla logarítmica de k y la refina
+            alrededor del mejor; 'dorada' hace una búsqueda de sección dorada,
+            que supone un único máximo.
+        paciencia : int, default 2
+            Puntos seguidos de la grilla gruesa sin mejora tras los que se corta.
+            Si es None se recorre completa.
+        modo : {'auto', 'exacto', 'muestreo', 'simplificado'}, default 'auto'
+            Forma de calcular el Silhouette Score (ver silueta.puntaje_silueta).
+        presupuesto : int, default PRESUPUESTO
+            Cantidad máxima de distancias entre pares para el Silhouette Score.
+        random_state : int, default 0
+            Estado aleatorio de los criterios.
+    
+        Returns
+        -------------
+        k : int
+            Cantidad de clusters elegida.
+        evidencia : pd.DataFrame
+            Valor del criterio en cada k evaluado, ordenado por k, con el orden
+            de evaluación, el tiempo y la columna 'elegido'.
+        '''
+        def ajustar(k):
+            kmeans = self.__modelo(k)
+            return kmeans.labels_, kmeans.cluster_centers_
+        
+        return seleccionar_k(self._datos.data, ajustar, criterio, k_min, min(k_max, len(self._datos) - 1),
+                             estrategia, paciencia = paciencia, modo = modo, presupuesto = presupuesto,
+                             random_state = random_state)
+    
+    @instrumentado
+    def fit(self, clusters):
+        '''Ajusta el modelo y lo guarda para etiquetar datos nuevos con predict.
+
+        Parameters
+        --------------
+        clusters : int
+            Número de clusters.
+    
+        Returns
+        -------------
+        self : MetodoKMeans
+            El mismo objeto, con el modelo ajustado.
+        '''
+        import copy
         
-    def silhouette(self, clusters):
+        # Las etiquetas del ajuste no hacen falta para predecir
+        kmeans = copy.copy(self.__modelo(clusters))
+        del kmeans.labels_
+        return self._guardar_ajuste({'clusters': clusters}, estimador = kmeans)
+    
+    @instrumentado
+    def silhouette(self, clusters, modo = 'auto', presupuesto = PRESUPUESTO):
         '''Calcula y devuelve el Silhouette Score del clustering con KMeans.
 
         Parameters
         --------------
         clusters : int
             Número de clusters.
+        modo : {'auto', 'exacto', 'muestreo', 'simplificado'}, default 'auto'
+            Forma de calcular el Silhouette Score (ver silueta.puntaje_silueta).
+        presupuesto : int, default PRESUPUESTO
+            Cantidad máxima de distancias entre pares para el Silhouette Score.
     
         Returns
         -------------
         silueta: str
             Silhouette Score del clustering.
         '''
-        # Cargar el dataset
-        X = self.__df.data
-        
         # Encontrar los clusters
-        kmeans = KMeans(n_clusters = clusters)
-        resultado = kmeans.fit_predict(X)
+        kmeans = self.__modelo(clusters)
+        resultado = kmeans.labels_
         
-        silueta = silhouette_score(X, resultado)
+        silueta = self._silueta(resultado, modo, presupuesto, centroides = kmeans.cluster_centers_)
         
         return(f'Silhouette Score KMeans: {silueta}')
-        
\ No newline at end of file
+    
+    def __modelo(self, clusters):
+        from sklearn.cluster import KMeans
+        
+        # Reutilizar el modelo si ya se ajustó con los mismos parámetros y datos
+        llave = self._llave(clusters)
+        
+        def ajustar():
+            with fase('ajuste', metodo = 'KMeans', k = clusters) as medicion:
+                kmeans = KMeans(n_clusters = clusters).fit(self._datos.data)
+                medicion.anotar(n_iter = kmeans.n_iter_)
+            return kmeans
+        
+        return self._modelos.obtener(llave, ajustar)
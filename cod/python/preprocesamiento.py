@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: sofiabocker
+"""
+
+import numpy as np
+
+from base import ConjuntoDatos, centro_escala, escalar
+from instrumentacion import fase
+
+class Transformacion():
+
+    # Constructor
+    def __init__(self, centro = None, escala = None, media = None, proyeccion = None):
+        '''
+        Inicializa una transformación ajustada: ((X - centro) / escala - media) @ proyeccion.
+
+        Parameters
+        ----------
+        centro : np.ndarray, default None
+            Centro de cada columna. Si es None no se centra.
+        escala : np.ndarray, default None
+            Escala de cada columna. Si es None no se escala.
+        media : np.ndarray, default None
+            Media que se resta antes de proyectar (PCA).
+        proyeccion : np.ndarray o scipy.sparse matrix, default None
+            Matriz de tamaño (d, k). Si es None no se reduce la dimensión.
+
+        Returns
+        -------
+        None
+        '''
+        self.__centro = centro
+        self.__escala = escala
+        self.__media = media
+        self.__proyeccion = proyeccion
+
+    # Get
+    @property
+    def dimensiones(self):
+        '''
+        Obtiene la cantidad de columnas que devuelve la transformación.
+
+        Returns
+        -------
+        dimensiones : int o None
+            Cantidad de columnas, o None si no se reduce la dimensión.
+        '''
+        return None if self.__proyeccion is None else self.__proyeccion.shape[1]
+
+    # Str
+    def __str__(self):
+        '''
+        Devuelve una representación de cadena del objeto.
+
+        Returns
+        -------
+        __str__ : str
+            Una cadena con los pasos de la transformación.
+        '''
+        pasos = []
+        if self.__escala is not None:
+            pasos.append('escalado')
+        if self.__proyeccion is not None:
+            pasos.append(f'proyección a {self.dimensiones} dimensiones')
+        return f"Transformacion : {', '.join(pasos) or 'identidad'}"
+
+    # Métodos
+    def transformar(self, X, tamano_lote = 100000):
+        '''Aplica la transformación a X por lotes.
+
+        Una matriz dispersa nunca se densifica: sin reducción se devuelve
+        escalada y dispersa, y con reducción el centro y la media se restan
+        después de proyectar, como (X / escala) @ proyeccion - corrimiento @
+        proyeccion, que es igual pero no llena los ceros.
+
+        Parameters
+        --------------
+        X : np.ndarray o scipy.sparse matrix
+            Datos de tamaño (n, d), con las mismas columnas que el ajuste.
+        tamano_lote : int, default 100000
+            Cantidad de filas por lote.
+
+        Returns
+        -------------
+        transformados : np.ndarray o scipy.sparse.csr_matrix
+            Datos float32 de tamaño (n, k), dispersos solo si X lo es y no hay reducción.
+        '''
+        from scipy.sparse import issparse
+
+        disperso = issparse(X)
+        if disperso and self.__proyeccion is None:
+            X = X.tocsr().astype(np.float64)
+            if self.__escala is not None:
+                X = escalar(X, self.__centro, self.__escala)
+            return X.astype(np.float32)
+
+        if disperso:
+            X = X.tocsr()
+            # Lo que se resta a cada fila antes de proyectar, ya escalado
+            corrimiento = np.zeros(X.shape[1])
+            if self.__centro is not None:
+                corrimiento += self.__centro / self.__escala
+            if self.__media is not None:
+                corrimiento += self.__media
+            corrimiento = corrimiento @ self.__proyeccion
+
+        columnas = X.shape[1] if self.__proyeccion is None else self.__proyeccion.shape[1]
+        transformados = np.empty((X.shape[0], columnas), dtype = np.float32)
+        for inicio in range(0, X.shape[0], tamano_lote):
+            if disperso:
+                lote = X[inicio:inicio + tamano_lote].astype(np.float64)
+                if self.__escala is not None:
+                    lote = escalar(lote, None, self.__escala)
+                lote = lote @ self.__proyeccion
+                lote = (lote.toarray() if issparse(lote) else lote) - corrimiento
+            else:
+                lote = np.asarray(X[inicio:inicio + tamano_lote], dtype = np.float64)
+                if self.__escala is not None:
+                    lote = escalar(lote, self.__centro, self.__escala)
+                if self.__media is not None:
+                    lote = lote - self.__media
+                if self.__proyeccion is not None:
+                    lote = lote @ self.__proyeccion
+            transformados[inicio:inicio + len(lote)] = lote
+        return transformados
+
+class Preprocesamiento():
+
+    # Constructor
+    def __init__(self, escalado = 'estandar', reduccion = None, dimensiones = None, tamano_muestra = 100000,
+                 random_state = 0):
+        '''
+        Inicializa una etapa de preprocesamiento: escalado y reducción de dimensión.
+
+        Los parámetros se estiman con una muestra de a lo sumo tamano_muestra
+        filas y luego se transforman todos los datos por lotes. El resultado se
+        guarda en el ConjuntoDatos de entrada, así que todos los métodos que
+        comparten ese conjunto y la misma configuración lo calculan una sola vez.
+        Reducir d a k dimensiones baja en la misma proporción el costo de las
+        distancias de KMeans, de la búsqueda de vecinos de DBSCAN y del
+        Silhouette Score. Con datos dispersos el escalado no centra (ver
+        base.centro_escala) y la reducción 'svd' o las proyecciones aleatorias
+        los llevan a una matriz densa de pocas columnas sin densificarlos antes.
+
+        Parameters
+        ----------
+        escalado : {'estandar', 'minmax', 'robusto', None}, default 'estandar'
+            Escalado de las columnas (ver base.centro_escala). None no escala.
+        reduccion : {None, 'pca', 'svd', 'aleatoria', 'dispersa'}, default None
+            'pca' proyecta en las componentes principales, 'svd' en los
+            vectores singulares sin centrar (SVD truncada, la opción para datos
+            dispersos), 'aleatoria' usa una proyección gaussiana aleatoria y
+            'dispersa' una proyección aleatoria dispersa, que es la más barata
+            de aplicar.
+        dimensiones : int o float, default None
+            Cantidad de dimensiones de la reducción. Con 'pca' puede ser una
+            fracción entre 0 y 1 de la varianza a conservar; si es None se
+            conserva el 95 %. 'svd' y las proyecciones aleatorias la requieren.
+        tamano_muestra : int, default 100000
+            Cantidad máxima de filas con que se estiman los parámetros.
+        random_state : int, default 0
+            Estado aleatorio de la muestra y de la proyección.
+
+        Returns
+        -------
+        None
+        '''
+        if reduccion not in (None, 'pca', 'svd', 'aleatoria', 'dispersa'):
+            raise ValueError(f"Reducción desconocida: {reduccion}")
+        if reduccion in ('svd', 'aleatoria', 'dispersa') and dimensiones is None:
+            raise ValueError(f"La reducción '{reduccion}' necesita la cantidad de dimensiones")
+        self.__escalado = escalado
+        self.__reduccion = reduccion
+        self.__dimensiones = dimensiones
+        self.__tamano_muestra = tamano_muestra
+        self.__random_state = random_state
+
+    # Get
+    @property
+    def configuracion(self):
+        '''
+        Obtiene la configuración de la etapa, que identifica su resultado guardado.
+
+        Returns
+        -------
+        configuracion : tuple
+            Escalado, reducción, dimensiones, tamaño de la muestra y estado aleatorio.
+        '''
+        return (self.__escalado, self.__reduccion, self.__dimensiones, self.__tamano_muestra,
+                self.__random_state)
+
+    # Str
+    def __str__(self):
+        '''
+        Devuelve una representación de cadena del objeto.
+
+        Returns
+        -------
+        __str__ : str
+            Una cadena que representa el objeto con los valores actuales de sus atributos.
+        '''
+        return (f'Preprocesamiento : escalado {self.__escalado}, reducción {self.__reduccion}, '
+                f'dimensiones {self.__dimensiones}')
+
+    # Métodos
+    def ajustar(self, X):
+        '''Estima los parámetros del escalado y de la reducción con una muestra de X.
+
+        Parameters
+        --------------
+        X : np.ndarray o scipy.sparse matrix
+            Datos de tamaño (n, d).
+
+        Returns
+        -------------
+        transformacion : Transformacion
+            Transformación ajustada.
+        '''
+        from scipy.sparse import issparse
+
+        disperso = issparse(X)
+        if disperso and self.__reduccion == 'pca':
+            raise ValueError("PCA centra los datos y no se puede usar con datos dispersos: use reduccion 'svd'")
+        n = X.shape[0]
+        generador = np.random.default_rng(self.__random_state)
+        if n > self.__tamano_muestra:
+            X = X[np.sort(generador.choice(n, self.__tamano_muestra, replace = False))]
+        muestra = X.tocsr().astype(np.float64) if disperso else np.asarray(X, dtype = np.float64)
+
+        centro = escala = None
+        if self.__escalado is not None:
+            centro, escala = centro_escala(muestra, self.__escalado)
+            muestra = escalar(muestra, centro, escala)
+
+        # Reducir solo si la cantidad de dimensiones pedida es menor que la de los datos
+        d = muestra.shape[1]
+        dimensiones = self.__dimensiones
+        if self.__reduccion is None or (isinstance(dimensiones, (int, np.integer)) and dimensiones >= d):
+            return Transformacion(centro, escala)
+
+        media = None
+        if self.__reduccion == 'pca':
+            from sklearn.decomposition import PCA
+
+            if dimensiones is None:
+                dimensiones = 0.95
+            # Con una fracción de varianza sklearn necesita la SVD completa
+            solver = 'full' if dimensiones < 1 else 'auto'
+            pca = PCA(n_components = dimensiones, svd_solver = solver, random_state = self.__random_state)
+            pca.fit(muestra)
+            media, proyeccion = pca.mean_, pca.components_.T
+        elif self.__reduccion == 'svd':
+            from sklearn.decomposition import TruncatedSVD
+
+            proyeccion = TruncatedSVD(n_components = dimensiones,
+                                      random_state = self.__random_state).fit(muestra).components_.T
+        elif self.__reduccion == 'aleatoria':
+            from sklearn.random_projection import GaussianRandomProjection
+
+            proyeccion = GaussianRandomProjection(n_components = dimensiones,
+                                                  random_state = self.__random_state).fit(muestra).components_.T
+        else:
+            from sklearn.random_projection import SparseRandomProjection
+
+            proyeccion = SparseRandomProjection(n_components = dimensiones, dense_output = True,
+                                                random_state = self.__random_state).fit(muestra).components_.T.tocsr()
+        return Transformacion(centro, escala, media, proyeccion)
+
+    def aplicar(self, datos):
+        '''Devuelve (y guarda en datos) los datos preprocesados y la transformación ajustada.
+
+        Parameters
+        --------------
+        datos : ConjuntoDatos
+            Datos originales.
+
+        Returns
+        -------------
+        preprocesados : ConjuntoDatos
+            Datos transformados, con sus propias estructuras derivadas.
+        transformacion : Transformacion
+            Transformación para aplicar a datos nuevos.
+        '''
+        def calcular():
+            with fase('preprocesamiento', escalado = self.__escalado, reduccion = self.__reduccion) as medicion:
+                transformacion = self.ajustar(datos.data)
+                X = transformacion.transformar(datos.data)
+                medicion.anotar(dimensiones = X.shape[1])
+            if transformacion.dimensiones is None:
+                nombres = datos.feature_names
+            else:
+                prefijo = {'pca': 'pc', 'svd': 'sv'}.get(self.__reduccion, 'p')
+                nombres = [f'{prefijo}{i}' for i in range(X.shape[1])]
+            return ConjuntoDatos(X, nombres, datos.target), transformacion
+
+        return datos.derivado(('preprocesamiento',) + self.configuracion, calcular)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: sofiabocker
+"""
+
+import numpy as np
+
+class ResultadoClusters():
+
+    # Constructor
+    def __init__(self, X, etiquetas, feature_names = None, estabilidad = None):
+        '''
+        Inicializa un resultado de clustering sin copiar los datos.
+
+        Parameters
+        ----------
+        X : np.ndarray o scipy.sparse matrix
+            Datos de tamaño (n, d). Se guarda una vista de solo lectura; una
+            matriz dispersa se guarda tal cual, sin densificarla.
+        etiquetas : np.ndarray
+            Etiqueta de cluster de cada fila.
+        feature_names : list of str, default None
+            Nombres de las columnas de X.
+        estabilidad : np.ndarray, default None
+            Estabilidad de la etiqueta de cada fila, por ejemplo en un clustering
+            de consenso.
+
+        Returns
+        -------
+        None
+        '''
+        from scipy.sparse import issparse
+
+        if issparse(X):
+            self.__X = X
+        else:
+            self.__X = np.asarray(X).view()
+            self.__X.flags.writeable = False
+        self.__etiquetas = np.asarray(etiquetas, dtype = np.int32)
+        if feature_names is None:
+            feature_names = [f'x{i}' for i in range(self.__X.shape[1])]
+        self.__feature_names = list(feature_names)
+        self.__estabilidad = None if estabilidad is None else np.asarray(estabilidad)
+
+    # Get
+    @property
+    def X(self):
+        '''
+        Obtiene la vista de solo lectura de los datos.
+
+        Returns
+        -------
+        X : np.ndarray o scipy.sparse matrix
+            Datos de tamaño (n, d).
+        '''
+        return self.__X
+
+    @property
+    def etiquetas(self):
+        '''
+        Obtiene las etiquetas de los clusters.
+
+        Returns
+        -------
+        etiquetas : np.ndarray
+            Etiquetas int32 de tamaño n.
+        '''
+        return self.__etiquetas
+
+    @property
+    def feature_names(self):
+        '''
+        Obtiene los nombres de las columnas.
+
+        Returns
+        -------
+        feature_names : list of str
+            Nombres de las columnas de X.
+        '''
+        return self.__feature_names
+
+    @property
+    def estabilidad(self):
+        '''
+        Obtiene la estabilidad de la etiqueta de cada fila, si se calculó.
+
+        Returns
+        -------
+        estabilidad : np.ndarray o None
+            Valores entre 0 y 1 de tamaño n.
+        '''
+        return self.__estabilidad
+
+    def __len__(self):
+        return len(self.__etiquetas)
+
+    # Str
+    def __str__(self):
+        '''
+        Devuelve una representación de cadena del objeto.
+
+        Returns
+        -------
+        __str__ : str
+            Una cadena con la cantidad de filas y el tamaño de cada cluster.
+        '''
+        return f'ResultadoClusters : {len(self)} filas, clusters {self.tamanos()}'
+
+    # Métodos
+    def tamanos(self):
+        '''Cuenta las filas de cada cluster.
+
+        Parameters
+        --------------
+        None
+
+        Returns
+        -------------
+        tamanos : dict
+            Cantidad de filas por etiqueta.
+        '''
+        valores, conteos = np.unique(self.__etiquetas, return_counts = True)
+        return dict(zip(valores.tolist(), conteos.tolist()))
+
+    def a_dataframe(self, copiar = True):
+        '''Construye un DataFrame con los datos y la columna 'cluster'.
+
+        Si X es dispersa, las columnas de datos son columnas dispersas de pandas
+        (pd.SparseDtype con valor de relleno 0), que guardan solo los valores no
+        nulos.
+
+        Parameters
+        --------------
+        copiar : bool, default True
+            Si es True se copia X y el DataFrame se puede modificar. Si es False
+            las columnas de datos son vistas de solo lectura de X, sin copia.
+
+        Returns
+        -------------
+        dataset : pd.DataFrame
+            DataFrame con los datos, la columna 'cluster' y, si existe, 'estabilidad'.
+        '''
+        import pandas as pd
+
+        if isinstance(self.__X, np.ndarray):
+            dataset = pd.DataFrame(self.__X, columns = self.__feature_names, copy = copiar)
+        else:
+            # Una columna dispersa por columna de X (pd.DataFrame.sparse.from_spmatrix rellena con NaN)
+            columnas = self.__X.tocsc()
+            dataset = pd.DataFrame({j: pd.arrays.SparseArray.from_spmatrix(columnas[:, j:j + 1])
+                                    for j in range(columnas.shape[1])})
+            dataset.columns = self.__feature_names
+        dataset['cluster'] = self.__etiquetas
+        if self.__estabilidad is not None:
+            dataset['estabilidad'] = self.__estabilidad
+        return dataset
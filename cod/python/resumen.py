@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: sofiabocker
+"""
+
+import numpy as np
+
+from cargadores import lotes as iterar_lotes
+
+# Cuantiles de la tabla, los mismos que usa pd.DataFrame.describe
+CUANTILES = (0.25, 0.5, 0.75)
+
+class SketchKLL():
+
+    # Constructor
+    def __init__(self, k = 200, random_state = None):
+        '''
+        Inicializa un sketch KLL de cuantiles de una columna.
+
+        Parameters
+        ----------
+        k : int, default 200
+            Capacidad del nivel más alto. El error de rango es del orden de 1 / k.
+        random_state : int o np.random.Generator, default None
+            Estado aleatorio de las compactaciones.
+
+        Returns
+        -------
+        None
+        '''
+        self.__k = k
+        self.__generador = np.random.default_rng(random_state)
+        self.__niveles = [np.empty(0)]
+
+    def __capacidad(self, nivel):
+        # Los niveles bajos tienen menos capacidad que el más alto, en razón 2/3
+        profundidad = len(self.__niveles) - nivel - 1
+        return max(int(np.ceil(self.__k * (2 / 3) ** profundidad)), 2)
+
+    def __comprimir(self):
+        nivel = 0
+        while nivel < len(self.__niveles):
+            if len(self.__niveles[nivel]) > self.__capacidad(nivel):
+                if nivel + 1 == len(self.__niveles):
+                    self.__niveles.append(np.empty(0))
+                valores = np.sort(self.__niveles[nivel])
+                resto = valores[len(valores) - len(valores) % 2:]
+                valores = valores[:len(valores) - len(valores) % 2]
+
+                # Se promueve uno de cada dos valores, con peso doble
+                inicio = self.__generador.integers(2)
+                self.__niveles[nivel + 1] = np.concatenate([self.__niveles[nivel + 1], valores[inicio::2]])
+                self.__niveles[nivel] = resto
+                nivel = 0
+            else:
+                nivel += 1
+
+    # Métodos
+    def actualizar(self, valores):
+        '''Agrega valores al sketch, ignorando los NaN.
+
+        Parameters
+        --------------
+        valores : np.ndarray
+            Valores de la columna.
+
+        Returns
+        -------------
+        None
+        '''
+        valores = np.asarray(valores, dtype = float).ravel()
+        valores = valores[~np.isnan(valores)]
+        self.__niveles[0] = np.concatenate([self.__niveles[0], valores])
+        self.__comprimir()
+
+    def combinar(self, otro):
+        '''Agrega al sketch el contenido de otro sketch.
+
+        Parameters
+        --------------
+        otro : SketchKLL
+            Sketch de otra parte de los datos.
+
+        Returns
+        -------------
+        None
+        '''
+        for nivel, valores in enumerate(otro.__niveles):
+            if nivel == len(self.__niveles):
+                self.__niveles.append(np.empty(0))
+            self.__niveles[nivel] = np.concatenate([self.__niveles[nivel], valores])
+        self.__comprimir()
+
+    def cuantiles(self, qs):
+        '''Estima los cuantiles pedidos.
+
+        Parameters
+        --------------
+        qs : iterable of float
+            Cuantiles entre 0 y 1.
+
+        Returns
+        -------------
+        valores : np.ndarray
+            Cuantiles estimados (NaN si el sketch está vacío).
+        '''
+        qs = np.asarray(qs, dtype = float)
+        valores = np.concatenate(self.__niveles)
+        if len(valores) == 0:
+            return np.full(len(qs), np.nan)
+        pesos = np.concatenate([np.full(len(v), 2.0 ** nivel) for nivel, v in enumerate(self.__niveles)])
+        orden = np.argsort(valores)
+        valores, acumulados = valores[orden], np.cumsum(pesos[orden])
+        posiciones = np.searchsorted(acumulados, qs * acumulados[-1], side = 'left')
+        return valores[np.minimum(posiciones, len(valores) - 1)]
+
+class ResumenStreaming():
+
+    # Constructor
+    def __init__(self, nombres = None, k = 200, random_state = None):
+        '''
+        Inicializa un resumen de columnas que se calcula lote a lote.
+
+        Guarda por columna la cantidad de valores, la media y la suma de
+        cuadrados centrada (Welford), el mínimo, el máximo y un sketch KLL para
+        los cuantiles. Dos resúmenes se pueden combinar, por ejemplo los de
+        distintos procesos.
+
+        Parameters
+        ----------
+        nombres : list of str, default None
+            Nombres de las columnas. Si es None se usan x0, x1, ...
+        k : int, default 200
+            Capacidad de los sketches KLL.
+        random_state : int, default None
+            Estado aleatorio de los sketches.
+
+        Returns
+        -------
+        None
+        '''
+        self.__nombres = None if nombres is None else list(nombres)
+        self.__k = k
+        self.__generador = np.random.default_rng(random_state)
+        self.__conteo = None
+
+    def __iniciar(self, d):
+        self.__conteo = np.zeros(d)
+        self.__media = np.zeros(d)
+        self.__m2 = np.zeros(d)
+        self.__minimo = np.full(d, np.inf)
+        self.__maximo = np.full(d, -np.inf)
+        self.__sketches = [SketchKLL(self.__k, self.__generador) for _ in range(d)]
+        if self.__nombres is None:
+            self.__nombres = [f'x{i}' for i in range(d)]
+
+    def __fusionar(self, conteo, media, m2, minimo, maximo):
+        # Fórmula de Chan et al. para combinar medias y sumas de cuadrados
+        total = self.__conteo + conteo
+        delta = media - self.__media
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            proporcion = np.where(total > 0, conteo / total, 0)
+        self.__media = self.__media + delta * proporcion
+        self.__m2 = self.__m2 + m2 + delta ** 2 * self.__conteo * proporcion
+        self.__conteo = total
+        self.__minimo = np.fmin(self.__minimo, minimo)
+        self.__maximo = np.fmax(self.__maximo, maximo)
+
+    # Métodos
+    def actualizar(self, bloque):
+        '''Agrega un lote de filas al resumen, ignorando los NaN.
+
+        Parameters
+        --------------
+        bloque : np.ndarray
+            Lote de tamaño (m, d).
+
+        Returns
+        -------------
+        None
+        '''
+        bloque = np.asarray(bloque, dtype = float)
+        if bloque.ndim == 1:
+            bloque = bloque[:, None]
+        if self.__conteo is None:
+            self.__iniciar(bloque.shape[1])
+
+        validos = ~np.isnan(bloque)
+        conteo = validos.sum(axis = 0)
+        ceros = np.where(validos, bloque, 0)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            media = np.where(conteo > 0, ceros.sum(axis = 0) / conteo, 0)
+        m2 = np.where(validos, (bloque - media) ** 2, 0).sum(axis = 0)
+        minimo = np.where(validos, bloque, np.inf).min(axis = 0, initial = np.inf)
+        maximo = np.where(validos, bloque, -np.inf).max(axis = 0, initial = -np.inf)
+        self.__fusionar(conteo, media, m2, minimo, maximo)
+
+        for j, sketch in enumerate(self.__sketches):
+            sketch.actualizar(bloque[:, j])
+
+    def combinar(self, otro):
+        '''Agrega al resumen el de otra parte de los datos.
+
+        Parameters
+        --------------
+        otro : ResumenStreaming
+            Resumen de otras filas con las mismas columnas.
+
+        Returns
+        -------------
+        resumen : ResumenStreaming
+            El mismo objeto, actualizado.
+        '''
+        if otro.__conteo is None:
+            return self
+        if self.__conteo is None:
+            self.__iniciar(len(otro.__conteo))
+        self.__fusionar(otro.__conteo, otro.__media, otro.__m2, otro.__minimo, otro.__maximo)
+        for sketch, sketch_otro in zip(self.__sketches, otro.__sketches):
+            sketch.combinar(sketch_otro)
+        return self
+
+    def tabla(self):
+        '''Genera la tabla resumen con el mismo formato que pd.DataFrame.describe.
+
+        Parameters
+        --------------
+        None
+
+        Returns
+        -------------
+        resumen : pd.DataFrame
+            Cantidad, media, desviación estándar, mínimo, cuartiles y máximo.
+        '''
+        import pandas as pd
+
+        if self.__conteo is None:
+            return pd.DataFrame(index = ['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max'])
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            desvio = np.sqrt(np.where(self.__conteo > 1, self.__m2 / (self.__conteo - 1), np.nan))
+        vacias = self.__conteo == 0
+        cuantiles = np.array([sketch.cuantiles(CUANTILES) for sketch in self.__sketches]).T
+        filas = [self.__conteo,
+                 np.where(vacias, np.nan, self.__media),
+                 desvio,
+                 np.where(vacias, np.nan, self.__minimo),
+                 *cuantiles,
+                 np.where(vacias, np.nan, self.__maximo)]
+        return pd.DataFrame(filas, columns = self.__nombres,
+                            index = ['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max'])
+
+def _resumir_rango(ruta, inicio, fin, tamano_bloque, k, semilla):
+    '''Resume las filas [inicio, fin) de un archivo .npy en un proceso aparte.'''
+    X = np.load(ruta, mmap_mode = 'r')
+    resumen = ResumenStreaming(k = k, random_state = semilla)
+    for desde in range(inicio, fin, tamano_bloque):
+        resumen.actualizar(X[desde:min(desde + tamano_bloque, fin)])
+    return resumen
+
+def resumir(fuente, nombres = None, tamano_bloque = 100000, n_jobs = 1, k = 200, random_state = None):
+    '''Calcula el resumen de una fuente de datos recorriéndola por bloques.
+
+    Parameters
+    --------------
+    fuente : str, np.ndarray o callable
+        Ruta a un archivo .npy, arreglo (por ejemplo np.memmap) o función sin
+        argumentos que devuelve un iterador de lotes.
+    nombres : list of str, default None
+        Nombres de las columnas.
+    tamano_bloque : int, default 100000
+        Cantidad de filas por bloque.
+    n_jobs : int, default 1
+        Procesos para repartir las filas. Solo se usa si la fuente es una ruta
+        .npy, que cada proceso abre con mmap.
+    k : int, default 200
+        Capacidad de los sketches KLL.
+    random_state : int, default None
+        Estado aleatorio de los sketches.
+
+    Returns
+    -------------
+    resumen : ResumenStreaming
+        Resumen de todas las filas.
+    '''
+    if isinstance(fuente, str) and n_jobs > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        n = len(np.load(fuente, mmap_mode = 'r'))
+        cortes = np.linspace(0, n, n_jobs + 1).astype(int)
+        semillas = np.random.SeedSequence(random_state).spawn(n_jobs)
+        with ProcessPoolExecutor(max_workers = n_jobs) as pool:
+            partes = list(pool.map(_resumir_rango, [fuente] * n_jobs, cortes[:-1], cortes[1:],
+                                   [tamano_bloque] * n_jobs, [k] * n_jobs,
+                                   [s.generate_state(1)[0] for s in semillas]))
+        resumen = ResumenStreaming(nombres, k = k, random_state = random_state)
+        for parte in partes:
+            resumen.combinar(parte)
+        return resumen
+
+    resumen = ResumenStreaming(nombres, k = k, random_state = random_state)
+    for bloque in iterar_lotes(fuente, tamano_bloque)():
+        resumen.actualizar(bloque)
+    return resumen
+
+def resumir_dataset(df, tamano_bloque = 100000, nombre_objetivo = 'target', k = 200, random_state = None):
+    '''Resume un dataset de sklearn.datasets (data y, si existe, target) por bloques.
+
+    Parameters
+    --------------
+    df : sklearn.datasets
+        Dataset con data y, opcionalmente, target y feature_names.
+    tamano_bloque : int, default 100000
+        Cantidad de filas por bloque.
+    nombre_objetivo : str, default 'target'
+        Nombre de la columna del target en la tabla.
+    k : int, default 200
+        Capacidad de los sketches KLL.
+    random_state : int, default None
+        Estado aleatorio de los sketches.
+
+    Returns
+    -------------
+    resumen : pd.DataFrame
+        Tabla con el mismo formato que pd.DataFrame.describe.
+    '''
+    X, y = df.data, getattr(df, 'target', None)
+    nombres = getattr(df, 'feature_names', None)
+    nombres = [f'x{i}' for i in range(X.shape[1])] if nombres is None else list(nombres)
+    if y is not None:
+        nombres = nombres + [nombre_objetivo]
+
+    def bloques():
+        for inicio in range(0, len(X), tamano_bloque):
+            bloque = np.asarray(X[inicio:inicio + tamano_bloque], dtype = float)
+            if y is not None:
+                bloque = np.column_stack([bloque, y[inicio:inicio + tamano_bloque]])
+            yield bloque
+
+    return resumir(bloques, nombres, tamano_bloque, k = k, random_state = random_state).tabla()
+
+def resumir_disperso(X, nombres = None, objetivo = None, nombre_objetivo = 'target'):
+    '''Calcula la tabla resumen de una matriz dispersa sin densificarla.
+
+    Los ceros implícitos cuentan como valores de cada columna. La media, la
+    desviación estándar y los extremos salen de los valores no nulos y de la
+    cantidad de ceros, y los cuartiles son exactos (con la misma interpolación
+    que pd.DataFrame.describe): basta con ordenar los valores no nulos de cada
+    columna y ubicar el bloque de ceros entre los negativos y los positivos.
+    El costo es O(nnz log nnz), sin importar la cantidad de ceros.
+
+    Parameters
+    --------------
+    X : scipy.sparse matrix
+        Datos de tamaño (n, d).
+    nombres : list of str, default None
+        Nombres de las columnas. Si es None se usan x0, x1, ...
+    objetivo : np.ndarray, default None
+        Columna densa adicional, por ejemplo el target o las etiquetas.
+    nombre_objetivo : str, default 'target'
+        Nombre de la columna adicional en la tabla.
+
+    Returns
+    -------------
+    resumen : pd.DataFrame
+        Tabla con el mismo formato que pd.DataFrame.describe.
+    '''
+    import pandas as pd
+
+    X = X.tocsc()
+    n, d = X.shape
+    nombres = [f'x{i}' for i in range(d)] if nombres is None else list(nombres)
+    indice = ['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']
+
+    # Valores no nulos ordenados dentro de cada columna
+    no_nulos = np.diff(X.indptr)
+    columnas = np.repeat(np.arange(d), no_nulos)
+    valores = X.data.astype(np.float64)
+    valores = valores[np.lexsort((valores, columnas))]
+    ceros = n - no_nulos
+    negativos = np.bincount(columnas, weights = valores < 0, minlength = d).astype(np.int64)
+
+    media = np.bincount(columnas, weights = valores, minlength = d) / max(n, 1)
+    m2 = np.bincount(columnas, weights = (valores - media[columnas]) ** 2, minlength = d) + ceros * media ** 2
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        desvio = np.sqrt(m2 / (n - 1)) if n > 1 else np.full(d, np.nan)
+
+    def elemento(i):
+        # Valor en la posición i de cada columna ordenada: negativos, ceros implícitos y el resto
+        posiciones = X.indptr[:-1] + np.where(i < negativos, i, i - ceros)
+        leidos = valores[np.clip(posiciones, 0, len(valores) - 1)] if len(valores) else np.zeros(d)
+        return np.where((i >= negativos) & (i < negativos + ceros), 0.0, leidos)
+
+    cuantiles = []
+    for q in CUANTILES:
+        posicion = q * (n - 1)
+        abajo = int(np.floor(posicion))
+        arriba = min(abajo + 1, n - 1)
+        inferior = elemento(abajo)
+        cuantiles.append(inferior + (elemento(arriba) - inferior) * (posicion - abajo))
+
+    filas = [np.full(d, float(n)), media, desvio, elemento(0), *cuantiles, elemento(n - 1)]
+    if n == 0:
+        filas = [np.zeros(d)] + [np.full(d, np.nan)] * 7
+    resumen = pd.DataFrame(np.array(filas), columns = nombres, index = indice)
+    if objetivo is not None:
+        resumen[nombre_objetivo] = pd.Series(np.asarray(objetivo, dtype = float)).describe().values
+    return resumen
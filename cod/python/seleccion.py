@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: sofiabocker
+"""
+
+import time
+
+import numpy as np
+
+from silueta import puntaje_silueta, PRESUPUESTO
+from instrumentacion import fase
+
+# Proporción áurea para la búsqueda de sección dorada
+_RAZON = (np.sqrt(5) - 1) / 2
+
+def _dorada(evaluar, k_min, k_max):
+    '''Busca el máximo de un criterio unimodal en los enteros de [k_min, k_max] por sección dorada.'''
+    a, b = k_min, k_max
+    while b - a > 2:
+        paso = int(round(_RAZON * (b - a)))
+        c, d = b - paso, a + paso
+        if c >= d:
+            c, d = (a + b) // 2, (a + b) // 2 + 1
+        if evaluar(c) >= evaluar(d):
+            b = d
+        else:
+            a = c
+    return max(range(a, b + 1), key = evaluar)
+
+def _gruesa_fina(evaluar, k_min, k_max, puntos, paciencia):
+    '''Evalúa una grilla logarítmica de k y la refina alrededor del mejor valor.
+
+    La grilla gruesa se recorre en orden creciente y se corta cuando el
+    criterio no mejora durante paciencia puntos seguidos.
+    '''
+    grilla = np.unique(np.round(np.geomspace(k_min, k_max, puntos)).astype(int))
+    mejor = None
+    sin_mejora = 0
+    for i, k in enumerate(grilla):
+        valor = evaluar(k)
+        if mejor is None or valor > evaluar(grilla[mejor]):
+            mejor, sin_mejora = i, 0
+        else:
+            sin_mejora += 1
+            if paciencia is not None and sin_mejora >= paciencia:
+                break
+
+    # Refinar entre los vecinos del mejor punto hasta que no queden huecos
+    while True:
+        izquierda = grilla[mejor - 1] if mejor > 0 else k_min
+        derecha = grilla[mejor + 1] if mejor + 1 < len(grilla) else k_max
+        if derecha - izquierda <= puntos:
+            return max(range(izquierda, derecha + 1), key = evaluar)
+        grilla = np.unique(np.round(np.linspace(izquierda, derecha, puntos)).astype(int))
+        mejor = max(range(len(grilla)), key = lambda i: evaluar(grilla[i]))
+
+def _tibshirani(evaluar, k_min, k_max):
+    '''Devuelve el menor k con Gap(k) >= Gap(k + 1) - s(k + 1), o k_max si ninguno cumple.'''
+    for k in range(k_min, k_max):
+        actual, siguiente = evaluar(k), evaluar(k + 1)
+        if actual['valor'] >= siguiente['valor'] - siguiente['error']:
+            return k
+    return k_max
+
+def buscar_k(evaluar, k_min = 2, k_max = 30, estrategia = 'gruesa_fina', puntos = 6, paciencia = 2):
+    '''Busca la cantidad de clusters que maximiza un criterio evaluando pocos k.
+
+    Cada k se evalúa una sola vez. Con 'gruesa_fina' se recorre una grilla
+    logarítmica, que se corta si el criterio deja de mejorar, y se refina
+    alrededor del mejor punto. Con 'dorada' se hace una búsqueda de sección
+    dorada, que supone que el criterio tiene un único máximo y evalúa unos
+    log(k_max - k_min) / log(1.618) + 3 valores de k. Con 'tibshirani' se
+    recorren los k en orden y se elige el primero cuyo valor no es superado
+    por el del siguiente menos su error (la regla del estadístico gap), así
+    que evaluar también tiene que devolver la llave 'error'.
+
+    Parameters
+    --------------
+    evaluar : callable
+        Función evaluar(k) que devuelve un dict con la llave 'valor' (mayor es
+        mejor) y, opcionalmente, otras columnas para la evidencia.
+    k_min : int, default 2
+        Menor cantidad de clusters.
+    k_max : int, default 30
+        Mayor cantidad de clusters.
+    estrategia : {'gruesa_fina', 'dorada', 'tibshirani'}, default 'gruesa_fina'
+        Forma de elegir los k a evaluar.
+    puntos : int, default 6
+        Cantidad de puntos de cada grilla de 'gruesa_fina'.
+    paciencia : int, default 2
+        Puntos seguidos sin mejora tras los que se corta la grilla gruesa. Si
+        es None se recorre completa.
+
+    Returns
+    -------------
+    k : int
+        Cantidad de clusters elegida.
+    evidencia : pd.DataFrame
+        Una fila por k evaluado, ordenada por k, con el valor del criterio, las
+        columnas que devuelve evaluar, el orden de evaluación y el tiempo.
+    '''
+    import pandas as pd
+
+    if k_min > k_max:
+        raise ValueError("k_min no puede ser mayor que k_max")
+    evaluaciones = {}
+
+    def fila_memo(k):
+        k = int(k)
+        if k not in evaluaciones:
+            inicio = time.perf_counter()
+            fila = dict(evaluar(k))
+            fila.update({'k': k, 'orden': len(evaluaciones), 'tiempo': time.perf_counter() - inicio})
+            evaluaciones[k] = fila
+        return evaluaciones[k]
+
+    def evaluar_memo(k):
+        # Los valores no definidos (nan) nunca se eligen
+        valor = fila_memo(k)['valor']
+        return -np.inf if np.isnan(valor) else valor
+
+    if estrategia == 'gruesa_fina':
+        k = _gruesa_fina(evaluar_memo, k_min, k_max, max(puntos, 3), paciencia)
+    elif estrategia == 'dorada':
+        k = _dorada(evaluar_memo, k_min, k_max)
+    elif estrategia == 'tibshirani':
+        k = _tibshirani(fila_memo, k_min, k_max)
+    else:
+        raise ValueError(f"Estrategia desconocida: {estrategia}")
+
+    evidencia = pd.DataFrame(list(evaluaciones.values())).sort_values('k', ignore_index = True)
+    columnas = ['k', 'valor'] + [c for c in evidencia.columns if c not in ('k', 'valor', 'orden', 'tiempo')]
+    evidencia = evidencia[columnas + ['orden', 'tiempo']]
+    evidencia['elegido'] = evidencia['k'] == k
+    return int(k), evidencia
+
+def criterio_silueta(X, modo = 'auto', presupuesto = PRESUPUESTO, random_state = 0):
+    '''Crea el criterio del Silhouette Score (muestreado si no cabe en el presupuesto).
+
+    Parameters
+    --------------
+    X : np.ndarray o scipy.sparse matrix
+        Datos de tamaño (n, d).
+    modo : {'auto', 'exacto', 'muestreo', 'simplificado'}, default 'auto'
+        Forma de calcular el Silhouette Score (ver silueta.puntaje_silueta).
+    presupuesto : int, default PRESUPUESTO
+        Cantidad máxima de distancias entre pares para el Silhouette Score.
+    random_state : int, default 0
+        Estado aleatorio del muestreo.
+
+    Returns
+    -------------
+    criterio : callable
+        Función criterio(etiquetas, centroides = None) que devuelve un dict con
+        'valor', 'inferior' y 'superior'.
+    '''
+    def criterio(etiquetas, centroides = None):
+        if len(np.unique(etiquetas)) < 2:
+            return {'valor': np.nan, 'inferior': np.nan, 'superior': np.nan}
+        silueta = puntaje_silueta(X, etiquetas, modo, presupuesto, centroides = centroides,
+                                  random_state = random_state)
+        return {'valor': silueta.valor, 'inferior': silueta.inferior, 'superior': silueta.superior}
+    return criterio
+
+def _log_dispersion(X, etiquetas):
+    '''Logaritmo de la suma de distancias al cuadrado de cada punto a la media de su cluster.'''
+    _, codigos = np.unique(etiquetas, return_inverse = True)
+    conteos = np.bincount(codigos)
+    medias = np.zeros((len(conteos), X.shape[1]))
+    np.add.at(medias, codigos, X)
+    medias /= conteos[:, None]
+    return np.log(((X - medias[codigos]) ** 2).sum())
+
+def criterio_gap(X, n_referencias = 5, tamano_muestra = 5000, random_state = 0):
+    '''Crea el criterio del estadístico gap de Tibshirani, Walther y Hastie.
+
+    La dispersión de los clusters se compara con la de conjuntos de referencia
+    uniformes en la caja de los datos, agrupados con KMeans. Todo se calcula
+    sobre una muestra de a lo sumo tamano_muestra filas, de modo que el costo
+    no depende de n. Las referencias uniformes son densas, así que no se
+    admiten datos dispersos.
+
+    Parameters
+    --------------
+    X : np.ndarray
+        Datos de tamaño (n, d).
+    n_referencias : int, default 5
+        Cantidad de conjuntos de referencia por k.
+    tamano_muestra : int, default 5000
+        Cantidad máxima de filas de la muestra y de cada referencia.
+    random_state : int, default 0
+        Estado aleatorio de la muestra, de las referencias y de KMeans.
+
+    Returns
+    -------------
+    criterio : callable
+        Función criterio(etiquetas, centroides = None) que devuelve un dict con
+        'valor' (el gap) y 'error' (su error estándar).
+    '''
+    from scipy.sparse import issparse
+    from sklearn.cluster import KMeans
+
+    if issparse(X):
+        raise ValueError("El estadístico gap no admite datos dispersos: use el criterio 'silueta'")
+    generador = np.random.default_rng(random_state)
+    filas = np.arange(len(X))
+    if len(X) > tamano_muestra:
+        filas = np.sort(generador.choice(len(X), tamano_muestra, replace = False))
+    muestra = np.asarray(X[filas], dtype = np.float64)
+    minimos, maximos = muestra.min(axis = 0), muestra.max(axis = 0)
+    referencias = [generador.uniform(minimos, maximos, size = muestra.shape) for _ in range(n_referencias)]
+
+    def criterio(etiquetas, centroides = None):
+        k = len(np.unique(etiquetas))
+        dispersion = _log_dispersion(muestra, np.asarray(etiquetas)[filas])
+        esperadas = np.array([_log_dispersion(referencia, KMeans(n_clusters = k, n_init = 1,
+                                                                 random_state = random_state).fit_predict(referencia))
+                              for referencia in referencias])
+        error = esperadas.std() * np.sqrt(1 + 1 / n_referencias)
+        return {'valor': esperadas.mean() - dispersion, 'error': error}
+    return criterio
+
+def seleccionar_k(X, ajustar, criterio = 'silueta', k_min = 2, k_max = 30, estrategia = 'gruesa_fina',
+                  puntos = 6, paciencia = 2, modo = 'auto', presupuesto = PRESUPUESTO, n_referencias = 5,
+                  random_state = 0, criterios = None):
+    '''Elige la cantidad de clusters de un método buscando k de forma adaptativa (ver buscar_k).
+
+    Parameters
+    --------------
+    X : np.ndarray o scipy.sparse matrix
+        Datos de tamaño (n, d).
+    ajustar : callable
+        Función ajustar(k) que devuelve las etiquetas y los centroides (o None).
+    criterio : {'silueta', 'gap'} o llave de criterios, default 'silueta'
+        Criterio a maximizar. Con 'gap' se elige el menor k con
+        Gap(k) >= Gap(k + 1) - s(k + 1) (regla de Tibshirani).
+    k_min : int, default 2
+        Menor cantidad de clusters.
+    k_max : int, default 30
+        Mayor cantidad de clusters.
+    estrategia : {'gruesa_fina', 'dorada'}, default 'gruesa_fina'
+        Forma de elegir los k a evaluar. Con criterio 'gap' se ignora y los k
+        se recorren en orden.
+    puntos : int, default 6
+        Cantidad de puntos de cada grilla de 'gruesa_fina'.
+    paciencia : int, default 2
+        Puntos seguidos sin mejora tras los que se corta la grilla gruesa.
+    modo : {'auto', 'exacto', 'muestreo', 'simplificado'}, default 'auto'
+        Forma de calcular el Silhouette Score (ver silueta.puntaje_silueta).
+    presupuesto : int, default PRESUPUESTO
+        Cantidad máxima de distancias entre pares para el Silhouette Score.
+    n_referencias : int, default 5
+        Cantidad de conjuntos de referencia del estadístico gap.
+    random_state : int, default 0
+        Estado aleatorio de los criterios.
+    criterios : dict, default None
+        Criterios propios del método, por ejemplo {'bic': funcion}, donde
+        funcion(k) devuelve un dict con la llave 'valor'.
+
+    Returns
+    -------------
+    k : int
+        Cantidad de clusters elegida.
+    evidencia : pd.DataFrame
+        Valor del criterio en cada k evaluado (ver buscar_k).
+    '''
+    criterios = criterios or {}
+    if criterio in criterios:
+        evaluar = criterios[criterio]
+    else:
+        if criterio == 'silueta':
+            medir = criterio_silueta(X, modo, presupuesto, random_state)
+        elif criterio == 'gap':
+            medir = criterio_gap(X, n_referencias, random_state = random_state)
+            # El gap se elige con la regla de Tibshirani, no con su máximo
+            estrategia = 'tibshirani'
+        else:
+            raise ValueError(f"Criterio desconocido: {criterio}")
+
+        def evaluar(k):
+            etiquetas, centroides = ajustar(k)
+            with fase('criterio', criterio = criterio, k = k):
+                return medir(etiquetas, centroides)
+
+    with fase('seleccion', criterio = criterio, estrategia = estrategia) as medicion:
+        k, evidencia = buscar_k(evaluar, k_min, k_max, estrategia, puntos, paciencia)
+        medicion.anotar(k = k, evaluados = len(evidencia))
+    return k, evidencia
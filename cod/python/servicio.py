@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: sofiabocker
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from base import ConjuntoDatos
+from cache import CacheModelos
+from comparar import METODOS
+from resultado import ResultadoClusters
+from instrumentacion import registrar, quitar
+
+# Métodos de las clases Metodo* que se pueden pedir como trabajos
+OPERACIONES = ('clusters', 'silhouette', 'mejor_cluster', 'elegir_k', 'consenso', 'recomendado',
+               'clusters_jerarquia', 'tabla_resumen', 'fit')
+
+def _congelar(valor):
+    '''Convierte diccionarios, listas y arreglos en tuplas para usarlos como llave.'''
+    if valor is None:
+        return ()
+    if isinstance(valor, dict):
+        return tuple(sorted((llave, _congelar(v)) for llave, v in valor.items()))
+    if isinstance(valor, (list, tuple, range)):
+        return tuple(_congelar(v) for v in valor)
+    if isinstance(valor, np.ndarray):
+        return (valor.dtype.str, valor.shape, valor.tobytes())
+    return valor
+
+def _serializar(valor):
+    '''Convierte un resultado en tipos de JSON.'''
+    import pandas as pd
+
+    if isinstance(valor, pd.DataFrame):
+        return json.loads(valor.to_json(orient = 'split'))
+    if isinstance(valor, np.ndarray):
+        return valor.tolist()
+    if isinstance(valor, (tuple, list)):
+        return [_serializar(v) for v in valor]
+    if isinstance(valor, dict):
+        return {str(llave): _serializar(v) for llave, v in valor.items()}
+    if isinstance(valor, ResultadoClusters):
+        return {'etiquetas': valor.etiquetas.tolist(),
+                'estabilidad': None if valor.estabilidad is None else valor.estabilidad.tolist()}
+    if isinstance(valor, np.generic):
+        return valor.item()
+    if valor is None or isinstance(valor, (bool, int, float, str)):
+        return valor
+    return str(valor)
+
+class _Trabajo():
+    '''Trabajo en curso: el futuro del resultado y quienes siguen su progreso.'''
+
+    def __init__(self):
+        self.futuro = None
+        self.oyentes = []
+
+    def avisar(self, registro):
+        for oyente in list(self.oyentes):
+            oyente(registro)
+
+class ServicioClustering():
+
+    # Constructor
+    def __init__(self, max_trabajadores = 2, max_lote = 4096, espera_lote = 0.005, max_objetos = 16):
+        '''
+        Inicializa un servicio asyncio que corre trabajos de clustering en un grupo acotado de hilos.
+
+        Los objetos Metodo* se crean una vez por algoritmo, dataset y opciones y
+        se reutilizan entre trabajos, así que sus caches de modelos y el
+        ConjuntoDatos compartido evitan reajustar. Los modelos que usa predict se
+        guardan ajustados por algoritmo, huella de los datos, opciones y parámetros. Los trabajos sobre un mismo
+        objeto se corren de a uno; los pedidos idénticos que llegan mientras uno
+        está en curso esperan su resultado en lugar de repetirlo.
+
+        Parameters
+        ----------
+        max_trabajadores : int, default 2
+            Cantidad máxima de trabajos que corren a la vez.
+        max_lote : int, default 4096
+            Cantidad de filas a partir de la cual se despacha un lote de predict
+            sin esperar más pedidos.
+        espera_lote : float, default 0.005
+            Segundos que se esperan pedidos de predict para juntarlos en un lote.
+        max_objetos : int, default 16
+            Cantidad máxima de objetos Metodo* que se guardan; se descarta el
+            usado hace más tiempo.
+
+        Returns
+        -------
+        None
+        '''
+        self.__ejecutor = ThreadPoolExecutor(max_workers = max_trabajadores)
+        self.__max_lote = max_lote
+        self.__espera_lote = espera_lote
+        self.__max_objetos = max_objetos
+        self.__datasets = {}
+        self.__objetos = OrderedDict()
+        self.__candado = threading.Lock()
+        self.__en_curso = {}
+        self.__pendientes = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *excepcion):
+        self.cerrar()
+        return False
+
+    # Str
+    def __str__(self):
+        '''
+        Devuelve una representación de cadena del objeto.
+
+        Returns
+        -------
+        __str__ : str
+            Una cadena con los datasets, los objetos y los trabajos en curso.
+        '''
+        return (f'ServicioClustering : {len(self.__datasets)} datasets, {len(self.__objetos)} objetos, '
+                f'{len(self.__en_curso)} trabajos en curso')
+
+    # Métodos
+    def registrar_dataset(self, nombre, df):
+        '''Registra un dataset para referirse a él por nombre en los trabajos.
+
+        Parameters
+        --------------
+        nombre : str
+            Nombre del dataset.
+        df : sklearn.datasets o ConjuntoDatos
+            Dataset. Se guarda como ConjuntoDatos.
+
+        Returns
+        -------------
+        None
+        '''
+        with self.__candado:
+            self.__datasets[nombre] = ConjuntoDatos.desde(df)
+
+    async def enviar(self, algoritmo, operacion, dataset, parametros = None, opciones = None, progreso = None):
+        '''Corre un trabajo de clustering y devuelve su resultado.
+
+        Parameters
+        --------------
+        algoritmo : str
+            Llave de comparar.METODOS, por ejemplo 'KMeans'.
+        operacion : str
+            Método a correr, entre OPERACIONES.
+        dataset : str
+            Nombre de un dataset registrado o ruta de un archivo que entienda
+            cargadores.cargar.
+        parametros : dict, default None
+            Argumentos de la operación, por ejemplo {'clusters': 3}.
+        opciones : dict, default None
+            Argumentos del constructor de la clase, por ejemplo {'compresion': 'auto'}.
+        progreso : callable, default None
+            Función que recibe, en el hilo del event loop, cada registro de
+            instrumentacion de las fases del trabajo (por ejemplo los ajustes y
+            siluetas de un barrido de mejor_cluster).
+
+        Returns
+        -------------
+        resultado : object
+            Lo que devuelve la operación. Los pedidos idénticos reciben el mismo
+            objeto, que no debe modificarse.
+        '''
+        if algoritmo not in METODOS:
+            raise ValueError(f"Algoritmo desconocido: {algoritmo}")
+        if operacion not in OPERACIONES:
+            raise ValueError(f"Operación no permitida: {operacion}")
+
+        llave = (algoritmo, dataset, _congelar(opciones), operacion, _congelar(parametros))
+        trabajo = self.__en_curso.get(llave)
+        if trabajo is None:
+            loop = asyncio.get_running_loop()
+            trabajo = _Trabajo()
+            trabajo.futuro = loop.run_in_executor(self.__ejecutor, self.__correr, trabajo, loop, algoritmo,
+                                                  dataset, opciones, operacion, parametros)
+            self.__en_curso[llave] = trabajo
+            trabajo.futuro.add_done_callback(lambda _: self.__en_curso.pop(llave, None))
+        if progreso is not None:
+            trabajo.oyentes.append(progreso)
+        return await asyncio.shield(trabajo.futuro)
+
+    async def transmitir(self, algoritmo, operacion, dataset, parametros = None, opciones = None):
+        '''Corre un trabajo y va entregando su progreso a medida que ocurre.
+
+        Parameters
+        --------------
+        algoritmo, operacion, dataset, parametros, opciones
+            Como en enviar.
+
+        Returns
+        -------------
+        eventos : async generator of dict
+            Eventos {'tipo': 'progreso', 'registro': registro} y, al final,
+            {'tipo': 'resultado', 'resultado': resultado}.
+        '''
+        cola = asyncio.Queue()
+        tarea = asyncio.ensure_future(self.enviar(algoritmo, operacion, dataset, parametros, opciones,
+                                                  progreso = cola.put_nowait))
+        try:
+            while True:
+                siguiente = asyncio.ensure_future(cola.get())
+                hechos, _ = await asyncio.wait({siguiente, tarea}, return_when = asyncio.FIRST_COMPLETED)
+                if siguiente in hechos:
+                    yield {'tipo': 'progreso', 'registro': siguiente.result()}
+                    continue
+                siguiente.cancel()
+                # Los avisos llegan al loop antes que el resultado
+                while not cola.empty():
+                    yield {'tipo': 'progreso', 'registro': cola.get_nowait()}
+                yield {'tipo': 'resultado', 'resultado': tarea.result()}
+                return
+        finally:
+            if not tarea.done():
+                tarea.cancel()
+
+    async def predecir(self, algoritmo, dataset, parametros, X, opciones = None):
+        '''Etiqueta X con el modelo ajustado con parametros, juntando los pedidos en lotes.
+
+        Los pedidos para un mismo modelo que llegan dentro de espera_lote
+        segundos se apilan y se etiquetan con una sola llamada a predict. El
+        modelo se ajusta con fit la primera vez y luego sale de la cache.
+
+        Parameters
+        --------------
+        algoritmo : str
+            Llave de comparar.METODOS.
+        dataset : str
+            Dataset con el que se ajusta el modelo.
+        parametros : dict
+            Argumentos de fit, por ejemplo {'clusters': 3}.
+        X : np.ndarray
+            Datos de tamaño (m, d).
+        opciones : dict, default None
+            Argumentos del constructor de la clase.
+
+        Returns
+        -------------
+        etiquetas : np.ndarray
+            Etiquetas int32 de las filas de X.
+        '''
+        if algoritmo not in METODOS:
+            raise ValueError(f"Algoritmo desconocido: {algoritmo}")
+
+        loop = asyncio.get_running_loop()
+        llave = (algoritmo, dataset, _congelar(opciones), _congelar(parametros))
+        pendientes = self.__pendientes.get(llave)
+        if pendientes is None:
+            pendientes = self.__pendientes[llave] = []
+            loop.call_later(self.__espera_lote, self.__despachar, llave, pendientes, algoritmo, dataset,
+                            parametros, opciones)
+        futuro = loop.create_future()
+        pendientes.append((np.atleast_2d(X), futuro))
+        if sum(len(filas) for filas, _ in pendientes) >= self.__max_lote:
+            self.__despachar(llave, pendientes, algoritmo, dataset, parametros, opciones)
+        return await futuro
+
+    def cerrar(self):
+        '''Espera a que terminen los trabajos en curso y cierra el grupo de hilos.
+
+        Parameters
+        --------------
+        None
+
+        Returns
+        -------------
+        None
+        '''
+        self.__ejecutor.shutdown(wait = True)
+
+    def __despachar(self, llave, pendientes, algoritmo, dataset, parametros, opciones):
+        # Si el lote ya se despachó por tamaño no se hace nada
+        if self.__pendientes.get(llave) is not pendientes:
+            return
+        del self.__pendientes[llave]
+        asyncio.ensure_future(self.__predecir_lote(pendientes, algoritmo, dataset, parametros, opciones))
+
+    async def __predecir_lote(self, pendientes, algoritmo, dataset, parametros, opciones):
+        loop = asyncio.get_running_loop()
+        try:
+            X = np.vstack([filas for filas, _ in pendientes])
+            etiquetas = await loop.run_in_executor(self.__ejecutor, self.__correr_prediccion, algoritmo, dataset,
+                                                   parametros, opciones, X)
+        except Exception as error:
+            for _, futuro in pendientes:
+                if not futuro.done():
+                    futuro.set_exception(error)
+            return
+        cortes = np.cumsum([len(filas) for filas, _ in pendientes])[:-1]
+        for (_, futuro), parte in zip(pendientes, np.split(etiquetas, cortes)):
+            if not futuro.done():
+                futuro.set_result(parte)
+
+    def __correr(self, trabajo, loop, algoritmo, dataset, opciones, operacion, parametros):
+        # Corre en un hilo del grupo: los registros de fases de este hilo se reenvían al loop
+        objeto, candado, _ = self.__objeto(algoritmo, dataset, opciones)
+        hilo = threading.get_ident()
+
+        def reenviar(registro):
+            if threading.get_ident() == hilo and trabajo.oyentes:
+                loop.call_soon_threadsafe(trabajo.avisar, registro)
+
+        registrar(reenviar)
+        try:
+            with candado:
+                return getattr(objeto, operacion)(**(parametros or {}))
+        finally:
+            quitar(reenviar)
+
+    def __correr_prediccion(self, algoritmo, dataset, parametros, opciones, X):
+        objeto, candado, ajustados = self.__objeto(algoritmo, dataset, opciones)
+        # El modelo ajustado se guarda por algoritmo, huella de los datos, opciones y
+        # parámetros: cada lote solo predice y no vuelve a ajustar
+        llave = (algoritmo, self.__conjunto(dataset).huella, _congelar(opciones), _congelar(parametros))
+        with candado:
+            modelo = ajustados.obtener(llave, lambda: objeto.fit(**parametros)._modelo_ajustado())
+        return modelo.predict(X)
+
+    def __objeto(self, algoritmo, dataset, opciones):
+        llave = (algoritmo, dataset, _congelar(opciones))
+        with self.__candado:
+            if llave in self.__objetos:
+                self.__objetos.move_to_end(llave)
+                return self.__objetos[llave]
+            datos = self.__conjunto(dataset)
+            modulo, clase, _ = METODOS[algoritmo]
+            objeto = getattr(importlib.import_module(modulo), clase)(datos, **(opciones or {}))
+            self.__objetos[llave] = (objeto, threading.Lock(), CacheModelos())
+            if len(self.__objetos) > self.__max_objetos:
+                self.__objetos.popitem(last = False)
+            return self.__objetos[llave]
+
+    def __conjunto(self, referencia):
+        if referencia not in self.__datasets:
+            if not (isinstance(referencia, str) and os.path.exists(referencia)):
+                raise ValueError(f"Dataset desconocido: {referencia}")
+            from cargadores import cargar
+
+            self.__datasets[referencia] = ConjuntoDatos.desde(cargar(referencia))
+        return self.__datasets[referencia]
+
+class ClienteLocal():
+
+    # Constructor
+    def __init__(self, servicio):
+        '''
+        Inicializa un cliente que habla con el servicio en el mismo proceso, con
+        pedidos y respuestas en los mismos diccionarios de JSON que usaría una API web.
+
+        Parameters
+        ----------
+        servicio : ServicioClustering
+            Servicio al que se envían los pedidos.
+
+        Returns
+        -------
+        None
+        '''
+        self.__servicio = servicio
+
+    # Métodos
+    async def solicitar(self, pedido):
+        '''Envía un pedido y devuelve la respuesta.
+
+        Parameters
+        --------------
+        pedido : dict
+            {'tipo': 'trabajo', 'algoritmo', 'operacion', 'dataset', 'parametros', 'opciones'}
+            o {'tipo': 'predecir', 'algoritmo', 'dataset', 'parametros', 'X', 'opciones'}.
+
+        Returns
+        -------------
+        respuesta : dict
+            {'estado': 'ok', 'resultado': ...} o {'estado': 'error', 'mensaje': ...}.
+        '''
+        try:
+            if pedido.get('tipo', 'trabajo') == 'predecir':
+                resultado = await self.__servicio.predecir(pedido['algoritmo'], pedido['dataset'],
+                                                           pedido['parametros'], np.asarray(pedido['X']),
+                                                           pedido.get('opciones'))
+            else:
+                resultado = await self.__servicio.enviar(pedido['algoritmo'], pedido['operacion'],
+                                                         pedido['dataset'], pedido.get('parametros'),
+                                                         pedido.get('opciones'))
+        except Exception as error:
+            return {'estado': 'error', 'mensaje': f'{type(error).__name__}: {error}'}
+        return {'estado': 'ok', 'resultado': _serializar(resultado)}
+
+    async def transmitir(self, pedido):
+        '''Envía un pedido de trabajo y entrega sus eventos de progreso y el resultado.
+
+        Parameters
+        --------------
+        pedido : dict
+            Pedido de tipo 'trabajo' (ver solicitar).
+
+        Returns
+        -------------
+        eventos : async generator of dict
+            Eventos con los valores convertidos a tipos de JSON.
+        '''
+        eventos = self.__servicio.transmitir(pedido['algoritmo'], pedido['operacion'], pedido['dataset'],
+                                             pedido.get('parametros'), pedido.get('opciones'))
+        try:
+            async for evento in eventos:
+                yield _serializar(evento)
+        except Exception as error:
+            yield {'tipo': 'error', 'mensaje': f'{type(error).__name__}: {error}'}
+
+async def _demostracion(dataset, trabajadores):
+    '''Corre pedidos de ejemplo con el cliente local, comprueba que los pedidos juntados den
+    los mismos resultados que por separado e imprime las respuestas.'''
+    if dataset is None:
+        from sklearn.datasets import load_iris
+        df = load_iris()
+    else:
+        from cargadores import cargar
+        df = cargar(dataset)
+
+    async with ServicioClustering(max_trabajadores = trabajadores) as servicio:
+        dataset = 'demostracion'
+        servicio.registrar_dataset(dataset, df)
+        cliente = ClienteLocal(servicio)
+        trabajo = {'algoritmo': 'KMeans', 'operacion': 'silhouette', 'dataset': dataset,
+                   'parametros': {'clusters': 3}}
+
+        # Pedidos idénticos simultáneos: se corre un solo trabajo
+        respuestas = await asyncio.gather(*[cliente.solicitar(trabajo) for _ in range(4)])
+        assert all(respuesta == respuestas[0] for respuesta in respuestas), 'Los pedidos juntados difieren'
+        print(json.dumps({'pedidos': len(respuestas), 'respuesta': respuestas[0]}))
+
+        # Pedidos de predict que se juntan en un lote: deben coincidir con predecir fila por fila
+        X = np.asarray(df.data)
+        filas = range(0, len(X), max(len(X) // 8, 1))
+        predecir = {'tipo': 'predecir', 'algoritmo': 'KMeans', 'dataset': dataset, 'parametros': {'clusters': 3}}
+        predicciones = await asyncio.gather(*[cliente.solicitar({**predecir, 'X': X[i:i + 1].tolist()})
+                                              for i in filas])
+        individuales = [await cliente.solicitar({**predecir, 'X': X[i:i + 1].tolist()}) for i in filas]
+        assert all(r['estado'] == 'ok' for r in predicciones), 'Falló un predict en lote'
+        assert predicciones == individuales, 'El predict en lote difiere del predict fila por fila'
+        print(json.dumps({'predicciones': [r['resultado'] for r in predicciones]}))
+
+        # Progreso de un barrido
+        async for evento in cliente.transmitir({'algoritmo': 'GaussianMixture', 'operacion': 'mejor_cluster',
+                                                'dataset': dataset, 'parametros': {'random_state': 0}}):
+            if evento['tipo'] == 'progreso':
+                print(json.dumps({k: evento['registro'].get(k) for k in ('fase', 'k', 'pared')}))
+            else:
+                print(json.dumps({'tipo': evento['tipo']}))
+
+def main(argumentos = None):
+    parser = argparse.ArgumentParser(description = 'Servicio de clustering con un cliente local de ejemplo')
+    parser.add_argument('--dataset', default = None, help = 'Archivo .parquet, .csv o .npy (por defecto iris)')
+    parser.add_argument('--trabajadores', type = int, default = 2)
+    argumentos = parser.parse_args(argumentos)
+    asyncio.run(_demostracion(argumentos.dataset, argumentos.trabajadores))
+
+if __name__ == '__main__':
+    main()
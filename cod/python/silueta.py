@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: sofiabocker
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+# Presupuesto por defecto: cantidad de distancias entre pares que se permite calcular
+PRESUPUESTO = 10000 ** 2
+
+class Silueta(namedtuple('Silueta', ['valor', 'inferior', 'superior', 'modo'])):
+    '''Resultado de un Silhouette Score con su intervalo de confianza.'''
+
+    __slots__ = ()
+
+    def __str__(self):
+        if self.modo == 'muestreo':
+            return f'{self.valor} (IC: [{self.inferior}, {self.superior}])'
+        return f'{self.valor}'
+
+def _codificar(etiquetas):
+    '''Convierte las etiquetas a enteros 0..k-1 y devuelve también el tamaño de cada cluster.'''
+    _, codigos = np.unique(etiquetas, return_inverse = True)
+    codigos = codigos.ravel()
+    tamanos = np.bincount(codigos)
+    _validar(len(tamanos), len(codigos))
+    return codigos, tamanos
+
+def _validar(k, n):
+    '''El Silhouette Score solo está definido con 2 <= k <= n - 1 clusters, como en sklearn.'''
+    if not 2 <= k <= n - 1:
+        raise ValueError(f"Hay {k} clusters: el Silhouette Score necesita entre 2 y n - 1 = {n - 1}")
+
+def _siluetas_filas(X, filas, codigos, tamanos, memoria, metric):
+    '''Calcula la silueta de las filas indicadas usando las distancias a todo el dataset, por bloques.'''
+    from sklearn.metrics import pairwise_distances_chunked
+
+    k = len(tamanos)
+    pertenencia = np.zeros((len(codigos), k))
+    pertenencia[np.arange(len(codigos)), codigos] = 1
+
+    def reducir(bloque, inicio):
+        # Suma de distancias de cada fila del bloque a cada cluster
+        return bloque @ pertenencia
+
+    sumas = np.vstack(list(pairwise_distances_chunked(X[filas], X, reduce_func = reducir,
+                                                      metric = metric, working_memory = memoria)))
+
+    propios = codigos[filas]
+    tamanos_propios = tamanos[propios]
+    a = sumas[np.arange(len(filas)), propios] / np.maximum(tamanos_propios - 1, 1)
+
+    medias = sumas / tamanos
+    medias[np.arange(len(filas)), propios] = np.inf
+    b = medias.min(axis = 1)
+
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        s = (b - a) / np.maximum(a, b)
+    # Por convención la silueta de un punto solo en su cluster es 0
+    s[tamanos_propios == 1] = 0
+    return np.nan_to_num(s)
+
+def silueta_por_bloques(X, etiquetas, memoria = 64, metric = 'euclidean'):
+    '''Calcula el Silhouette Score exacto sin guardar la matriz de distancias completa.
+
+    Parameters
+    --------------
+    X : np.ndarray o scipy.sparse matrix
+        Datos de tamaño (n, d).
+    etiquetas : np.ndarray
+        Etiqueta de cluster de cada fila.
+    memoria : int, default 64
+        Memoria máxima en MiB para cada bloque de distancias.
+    metric : str, default 'euclidean'
+        Métrica de distancia.
+
+    Returns
+    -------------
+    silueta : float
+        Silhouette Score promedio.
+    '''
+    codigos, tamanos = _codificar(etiquetas)
+    filas = np.arange(len(codigos))
+    return float(_siluetas_filas(X, filas, codigos, tamanos, memoria, metric).mean())
+
+def silueta_muestreada(X, etiquetas, tamano_muestra, confianza = 0.95, random_state = None,
+                       memoria = 64, metric = 'euclidean'):
+    '''Estima el Silhouette Score con una muestra estratificada por cluster.
+
+    La silueta de cada punto de la muestra se calcula de forma exacta contra
+    todo el dataset, por lo que el costo es tamano_muestra * n distancias.
+
+    Parameters
+    --------------
+    X : np.ndarray o scipy.sparse matrix
+        Datos de tamaño (n, d).
+    etiquetas : np.ndarray
+        Etiqueta de cluster de cada fila.
+    tamano_muestra : int
+        Cantidad total de puntos de la muestra.
+    confianza : float, default 0.95
+        Nivel de confianza del intervalo.
+    random_state : int, default None
+        Estado aleatorio del muestreo.
+
+    Returns
+    -------------
+    silueta : Silueta
+        Estimación con su intervalo de confianza.
+    '''
+    from scipy.stats import norm
+
+    codigos, tamanos = _codificar(etiquetas)
+    n = len(codigos)
+    generador = np.random.default_rng(random_state)
+
+    # Repartir la muestra proporcionalmente al tamaño de cada cluster
+    cuotas = np.minimum(np.maximum(np.round(tamanos * tamano_muestra / n).astype(int), 2), tamanos)
+    filas = np.concatenate([generador.choice(np.flatnonzero(codigos == c), cuota, replace = False)
+                            for c, cuota in enumerate(cuotas)])
+    s = _siluetas_filas(X, filas, codigos, tamanos, memoria, metric)
+
+    # Media estratificada y su varianza con corrección por población finita
+    pesos = tamanos / n
+    estratos = codigos[filas]
+    medias = np.bincount(estratos, weights = s, minlength = len(tamanos)) / cuotas
+    desvios = np.bincount(estratos, weights = (s - medias[estratos]) ** 2, minlength = len(tamanos))
+    varianzas = desvios / np.maximum(cuotas - 1, 1)
+    valor = float(pesos @ medias)
+    varianza = float(np.sum(pesos ** 2 * varianzas / cuotas * (1 - cuotas / tamanos)))
+
+    margen = norm.ppf(0.5 + confianza / 2) * np.sqrt(varianza)
+    return Silueta(valor, float(valor - margen), float(valor + margen), 'muestreo')
+
+def silueta_simplificada(X, etiquetas, centroides):
+    '''Calcula el Silhouette Score simplificado usando las distancias a los centroides.
+
+    Parameters
+    --------------
+    X : np.ndarray o scipy.sparse matrix
+        Datos de tamaño (n, d).
+    etiquetas : np.ndarray
+        Índice del centroide de cada fila.
+    centroides : np.ndarray
+        Centroides de tamaño (k, d).
+
+    Returns
+    -------------
+    silueta : float
+        Silhouette Score simplificado promedio.
+    '''
+    from sklearn.metrics import pairwise_distances
+
+    _codificar(etiquetas)
+    distancias = pairwise_distances(X, centroides)
+    filas = np.arange(X.shape[0])
+    a = distancias[filas, etiquetas].copy()
+    distancias[filas, etiquetas] = np.inf
+    b = distancias.min(axis = 1)
+
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        s = (b - a) / np.maximum(a, b)
+    return float(np.nan_to_num(s).mean())
+
+def puntaje_silueta(X, etiquetas, modo = 'auto', presupuesto = PRESUPUESTO, centroides = None,
+                    random_state = None):
+    '''Calcula el Silhouette Score con el modo indicado o el que permita el presupuesto.
+
+    Parameters
+    --------------
+    X : np.ndarray o scipy.sparse matrix
+        Datos de tamaño (n, d).
+    etiquetas : np.ndarray
+        Etiqueta de cluster de cada fila.
+    modo : {'auto', 'exacto', 'muestreo', 'simplificado'}, default 'auto'
+        Con 'auto' se usa el modo exacto si n * n cabe en el presupuesto, el
+        simplificado si hay centroides y el muestreo en otro caso.
+    presupuesto : int, default PRESUPUESTO
+        Cantidad máxima de distancias entre pares a calcular.
+    centroides : np.ndarray, default None
+        Centroides del modelo, necesarios para el modo 'simplificado'.
+    random_state : int, default None
+        Estado aleatorio del muestreo.
+
+    Returns
+    -------------
+    silueta : Silueta
+        Valor, intervalo de confianza (igual al valor si es exacto) y modo usado.
+        Si las etiquetas no tienen entre 2 y n - 1 clusters (por ejemplo, todo
+        ruido en DBSCAN) el Silhouette Score no está definido y se devuelve NaN.
+    '''
+    n = X.shape[0]
+    if not 2 <= len(np.unique(etiquetas)) <= n - 1:
+        return Silueta(np.nan, np.nan, np.nan, modo)
+    if modo == 'auto':
+        if n * n <= presupuesto:
+            modo = 'exacto'
+        elif centroides is not None:
+            modo = 'simplificado'
+        else:
+            modo = 'muestreo'
+
+    if modo == 'exacto':
+        valor = silueta_por_bloques(X, etiquetas)
+    elif modo == 'simplificado':
+        if centroides is None:
+            raise ValueError("El modo 'simplificado' necesita los centroides del modelo")
+        valor = silueta_simplificada(X, etiquetas, centroides)
+    elif modo == 'muestreo':
+        return silueta_muestreada(X, etiquetas, max(presupuesto // n, 1), random_state = random_state)
+    else:
+        raise ValueError(f"Modo de silueta desconocido: {modo}")
+    return Silueta(valor, valor, valor, modo)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: sofiabocker
+"""
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.cluster import DBSCAN
+from sklearn.datasets import load_iris
+
+from dbscan import MetodoDBSCAN, _recortar_grafo
+
+# Grilla por defecto de mejor_cluster, la que usa el notebook
+EPS = np.arange(0.3, 1.2, 0.1)
+MIN_SAMPLES = range(2, 10)
+
+def test_barrido_igual_a_dbscan():
+    '''Las etiquetas del barrido son las de DBSCAN ajustado directamente en cada punto de la grilla.'''
+    df = load_iris()
+    metodo = MetodoDBSCAN(df)
+    barrido = metodo.mejor_cluster(EPS, MIN_SAMPLES)
+
+    for fila in barrido.itertuples():
+        esperadas = DBSCAN(eps = fila.eps, min_samples = fila.min_samples).fit_predict(df.data)
+        etiquetas = metodo.clusters(fila.eps, fila.min_samples, como_dataframe = False).etiquetas
+        assert np.array_equal(etiquetas, esperadas), (fila.eps, fila.min_samples)
+        assert fila.n_clusters == len(set(esperadas) - {-1})
+
+def test_recortar_grafo_filas_vacias():
+    '''Las filas sin aristas, también al final, quedan vacías al recortar.'''
+    grafo = csr_matrix(np.array([[0, 0, 0], [0.3, 0, 0.9], [0, 0, 0], [0, 0, 0]]))
+    recortado = _recortar_grafo(grafo, 0.5)
+    assert np.array_equal(np.diff(recortado.indptr), [0, 1, 0, 0])
+    assert np.array_equal(recortado.toarray(), [[0, 0, 0], [0.3, 0, 0], [0, 0, 0], [0, 0, 0]])
+
+def test_clusters_no_depende_del_barrido():
+    '''Las etiquetas de clusters son las mismas antes y después de un barrido que deja un grafo de radio mayor.'''
+    df = load_iris()
+    antes = MetodoDBSCAN(df).clusters(0.5, 9, como_dataframe = False).etiquetas
+
+    metodo = MetodoDBSCAN(df)
+    mismo_objeto = metodo.clusters(0.5, 9, como_dataframe = False).etiquetas
+    metodo.mejor_cluster()
+    despues = metodo.clusters(0.5, 9, como_dataframe = False).etiquetas
+
+    otro = MetodoDBSCAN(df)
+    otro.mejor_cluster()
+    tras_barrido = otro.clusters(0.5, 9, como_dataframe = False).etiquetas
+
+    for etiquetas in (mismo_objeto, despues, tras_barrido):
+        assert np.array_equal(etiquetas, antes)